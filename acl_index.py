@@ -0,0 +1,249 @@
+import os
+import pickle
+import threading
+import time
+
+ACL_INDEX_PATH = os.path.join('data', 'acl_index.pkl')
+ACL_TTL_SECONDS = 300
+# The background refresh rebuilds the index every ACL_TTL_SECONDS; an index
+# older than this is not being refreshed and is no longer trusted
+ACL_MAX_AGE_SECONDS = 2 * ACL_TTL_SECONDS
+PERMISSION_FIELDS = "permissions(type, role, emailAddress, domain)"
+
+class AccessIndex:
+    """Per-user readable-file bitsets built from Drive permissions at ingestion time.
+
+    Every indexed file gets a small integer position; each user, domain and the
+    "anyone with the link" audience maps to a Python int used as a bitset over
+    those positions, so a permission check is a dict lookup plus a bit test.
+    Drive permissions name groups, not their members, so group grants are
+    kept apart in ``group_bits`` for the checker to resolve live.
+    """
+
+    def __init__(self, file_ids, user_bits, domain_bits, public_bits, built_at=None, group_bits=None):
+        self.file_ids = list(file_ids)
+        self.file_pos = {file_id: i for i, file_id in enumerate(self.file_ids)}
+        self.user_bits = user_bits
+        self.domain_bits = domain_bits
+        self.public_bits = public_bits
+        self.built_at = built_at or time.time()
+        self.group_bits = group_bits or {}
+        self.group_shared = 0
+        for bits in self.group_bits.values():
+            self.group_shared |= bits
+
+    @classmethod
+    def build(cls, file_permissions):
+        """``file_permissions`` maps file ID -> list of Drive permission resources."""
+        file_ids = sorted(file_permissions)
+        user_bits, group_bits, domain_bits, public_bits = {}, {}, {}, 0
+        for pos, file_id in enumerate(file_ids):
+            bit = 1 << pos
+            for perm in file_permissions[file_id] or []:
+                kind = perm.get('type')
+                if kind in ('user', 'group') and perm.get('emailAddress'):
+                    email = perm['emailAddress'].lower()
+                    bits = user_bits if kind == 'user' else group_bits
+                    bits[email] = bits.get(email, 0) | bit
+                elif kind == 'domain' and perm.get('domain'):
+                    domain = perm['domain'].lower()
+                    domain_bits[domain] = domain_bits.get(domain, 0) | bit
+                elif kind == 'anyone':
+                    public_bits |= bit
+        return cls(file_ids, user_bits, domain_bits, public_bits, group_bits=group_bits)
+
+    def bits_for(self, email):
+        """Bitset of files ``email`` can read, or None if the user is unknown to the index."""
+        email = email.strip().lower()
+        bits = self.user_bits.get(email)
+        if bits is None:
+            return None
+        domain = email.rsplit('@', 1)[-1]
+        return bits | self.domain_bits.get(domain, 0) | self.public_bits
+
+    def _file_ids(self, bits):
+        file_ids = set()
+        while bits:
+            low = bits & -bits
+            file_ids.add(self.file_ids[low.bit_length() - 1])
+            bits ^= low
+        return file_ids
+
+    def allowed_file_ids(self, email):
+        """Files ``email`` can read without group grants, or None if the user is unknown to the index."""
+        bits = self.bits_for(email)
+        return None if bits is None else self._file_ids(bits)
+
+    def group_shared_file_ids(self):
+        """Files shared with at least one group."""
+        return self._file_ids(self.group_shared)
+
+    def can_read(self, email, file_id):
+        bits = self.bits_for(email)
+        pos = self.file_pos.get(file_id)
+        if bits is None or pos is None:
+            return None
+        return bool(bits >> pos & 1)
+
+    def save(self, path=ACL_INDEX_PATH):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({
+                'file_ids': self.file_ids,
+                'user_bits': self.user_bits,
+                'domain_bits': self.domain_bits,
+                'public_bits': self.public_bits,
+                'built_at': self.built_at,
+                'group_bits': self.group_bits,
+            }, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=ACL_INDEX_PATH):
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+        return cls(data['file_ids'], data['user_bits'], data['domain_bits'],
+                   data['public_bits'], data['built_at'], data.get('group_bits'))
+
+def fetch_file_permissions(service, file):
+    """Permissions for a Drive file listing entry, falling back to permissions().list."""
+    if file.get('permissions') is not None:
+        return file['permissions']
+    perms, page_token = [], None
+    while True:
+        response = service.permissions().list(
+            fileId=file['id'],
+            fields=f"nextPageToken, {PERMISSION_FIELDS}",
+            pageToken=page_token,
+        ).execute()
+        perms.extend(response.get('permissions', []))
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            return perms
+
+def build_access_index(service, listing):
+    """AccessIndex over ``listing``'s ``(file, folder_name)`` pairs; a file whose
+    permissions cannot be read is indexed as readable by nobody."""
+    file_permissions = {}
+    for file, folder_name in listing:
+        try:
+            file_permissions[file['id']] = fetch_file_permissions(service, file)
+        except Exception as e:
+            print(f"⚠️ Could not read permissions for {folder_name} / {file['name']}: {e}")
+            file_permissions[file['id']] = []
+    return AccessIndex.build(file_permissions)
+
+def refresh_access_index(service, path=ACL_INDEX_PATH):
+    """Re-read every file's permissions from Drive and save a new index; nothing is downloaded."""
+    from drive_auth_test11 import list_drive_files
+    acl_index = build_access_index(service, list_drive_files(service))
+    acl_index.save(path)
+    return acl_index
+
+def readable_file_ids(service, email):
+    """Live Drive query for every file ``email`` can read; slow, used on ACL index misses."""
+    file_ids, page_token = set(), None
+    while True:
+        response = service.files().list(
+            q=f"'{email}' in readers",
+            fields="nextPageToken, files(id)",
+            pageToken=page_token,
+        ).execute()
+        file_ids.update(f['id'] for f in response.get('files', []))
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            return file_ids
+
+class AccessChecker:
+    """Serves permission checks from the on-disk AccessIndex.
+
+    Every ``ttl`` seconds a daemon thread re-reads all permissions from Drive
+    with ``service_factory()`` (when given) and saves a new index, then
+    reloads the index if the file has changed. Users missing from the index,
+    files shared with groups, and everything once the index is older than
+    ``max_age`` are resolved with ``live_lookup`` (a live Drive query), whose
+    answer is cached for ``ttl`` seconds as well.
+    """
+
+    def __init__(self, path=ACL_INDEX_PATH, ttl=ACL_TTL_SECONDS, service_factory=None, max_age=ACL_MAX_AGE_SECONDS):
+        self.path = path
+        self.ttl = ttl
+        self.service_factory = service_factory
+        self.max_age = max_age
+        self.index = None
+        self._mtime = None
+        self._live_cache = {}
+        self._lock = threading.Lock()
+        self._reload()
+        # Also makes the first refresh, if the index on disk is already due for one
+        self._thread = threading.Thread(target=self._refresh_loop, name="acl-refresh", daemon=True)
+        self._thread.start()
+
+    def _reload(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            index = AccessIndex.load(self.path)
+        except Exception as e:
+            print(f"⚠️ Could not load ACL index {self.path}: {e}")
+            return
+        with self._lock:
+            self.index = index
+            self._mtime = mtime
+            self._live_cache.clear()
+
+    def _refresh_loop(self):
+        while True:
+            index = self.index
+            # Skipped while an ingest (or another process) has rebuilt the index recently
+            if self.service_factory is not None and (index is None or time.time() - index.built_at >= self.ttl):
+                try:
+                    refresh_access_index(self.service_factory(), self.path)
+                except Exception as e:
+                    print(f"⚠️ Could not refresh Drive permissions: {e}")
+            self._reload()
+            time.sleep(self.ttl)
+
+    def allowed_file_ids(self, email, live_lookup=None):
+        """Set of readable file IDs; ``live_lookup(email)`` is only called when the index cannot answer."""
+        email = email.strip().lower()
+        index = self.index
+        if index is not None and live_lookup is not None and time.time() - index.built_at > self.max_age:
+            index = None    # revoked access must not outlive a failing refresh
+        if index is not None:
+            allowed = index.allowed_file_ids(email)
+            if allowed is not None and index.group_shared and live_lookup is not None:
+                # Group membership is not in the index; Drive resolves it for the group-shared files
+                return allowed | (self._live_file_ids(email, live_lookup) & index.group_shared_file_ids())
+            if allowed is not None:
+                return allowed
+        return self._live_file_ids(email, live_lookup)
+
+    def _live_file_ids(self, email, live_lookup):
+        with self._lock:
+            cached = self._live_cache.get(email)
+        if cached and time.monotonic() - cached[0] < self.ttl:
+            return cached[1]
+        if live_lookup is None:
+            return set()
+        allowed = set(live_lookup(email))
+        with self._lock:
+            self._live_cache[email] = (time.monotonic(), allowed)
+        return allowed
+
+_checker = None
+_checker_lock = threading.Lock()
+
+def get_access_checker(path=ACL_INDEX_PATH, service_factory=None):
+    """The process-wide checker; ``service_factory`` of the first call enables the background refresh."""
+    global _checker
+    if _checker is None:
+        with _checker_lock:
+            if _checker is None:
+                _checker = AccessChecker(path, service_factory=service_factory)
+    return _checker
@@ -1,15 +1,11 @@
 import streamlit as st
 from datetime import datetime
-from sentence_transformers import SentenceTransformer
-import pickle
-import subprocess
 import json
 
-from embeddings_utils import load_embeddings
-from faiss_utils import create_faiss_index
-
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
+from acl_index import get_access_checker, readable_file_ids
+from refresh_job import get_refresh_job
+from search_engine import MAX_PER_FOLDER, get_search_engine
+from telemetry import STAGES, get_telemetry
 
 # ------------- PAGE CONFIG / HEADER -------------
 st.set_page_config(page_title="FamilyTLC Search Bot", layout="wide", page_icon="🧠")
@@ -61,34 +57,73 @@ input[type="text"], textarea, .stTextInput>div>div>input {border-radius:8px !imp
 """, unsafe_allow_html=True)
 
 # ------------- LOAD DOCUMENT DATA --------------
-try:
-    embedding_matrix = load_embeddings('data/embeddings.npy')
-    with open('data/sources.pkl', 'rb') as f:
-        sources = pickle.load(f)
-    with open('data/text_chunks.pkl', 'rb') as f:
-        text_chunks = pickle.load(f)
-    with open('data/file_ids.pkl', 'rb') as f:
-        file_ids = pickle.load(f)
-    DOCUMENT_COUNT = len(set(file_ids))
-except Exception:
-    sources, text_chunks, file_ids, embedding_matrix = [], [], [], None
-    DOCUMENT_COUNT = 0
+# Shared by every session in this server process; only reloads when a new snapshot is published.
+# The first load (model, index) runs on a warm-up thread so the page renders straight away.
+engine = get_search_engine(background=True)
+refresh_job = get_refresh_job(engine)
+DOCUMENT_COUNT = engine.stats()["documents"] if engine.ready else "…"
+
+def drive_metadata_service():
+    """Drive client with the service account from the app's secrets, for permission checks."""
+    from google.oauth2 import service_account
+    from googleapiclient.discovery import build
+
+    SCOPES = ['https://www.googleapis.com/auth/drive.metadata.readonly']
+
+    # Load credentials from secrets and write to file
+    creds_dict = dict(st.secrets["GOOGLE_CREDENTIALS"])
+    with open("service_account.json", "w") as f:
+        json.dump(creds_dict, f)
+
+    # Authenticate to Google Drive with service account
+    creds = service_account.Credentials.from_service_account_file("service_account.json", scopes=SCOPES)
+    return build('drive', 'v3', credentials=creds)
 
-# Placeholder stats (replace with real analytics for production)
-SEARCHES_TODAY = 42
-AVG_RESPONSE = "1.2s"
-SUCCESS_RATE = "98.9%"
-USERS_TODAY = 14
+# Re-reads Drive permissions in the background, so revoked access drops out within the TTL
+access_checker = get_access_checker(service_factory=drive_metadata_service)
+
+# Today's numbers from the local search telemetry store
+telemetry = get_telemetry()
+usage = telemetry.summary()
+SEARCHES_TODAY = usage['searches']
+total_latency = usage['stages'].get('total')
+MEDIAN_RESPONSE = f"{total_latency['p50']:.2f}s" if total_latency else "–"
+SUCCESS_RATE = f"{usage['success_rate']:.1%}" if usage['success_rate'] is not None else "–"
+USERS_TODAY = usage['users']
 
 POPULAR_SEARCHES = ["Vacation Policy", "Work From Home", "Sick Leave", "Team Meetings", "Employee Handbook", "IT Support"]
+# Keep the popular searches embedded and cached, including right after each snapshot swap
+engine.set_warm_queries(POPULAR_SEARCHES)
 
 # --------------- SIDEBAR ----------------
 with st.sidebar:
     st.header("🛠️ Admin Tools")
-    if st.button("🔄 Refresh Documents"):
-        with st.spinner("Updating documents from Google Drive..."):
-            subprocess.run(["python", "update_embeddings.py"])
-        st.success("✅ Documents refreshed!")
+    # The refresh runs in the background; searches keep using the current snapshot until the new one is swapped in
+    if st.button("🔄 Refresh Documents", disabled=refresh_job.running):
+        if not refresh_job.start():
+            st.info("A refresh is already running; showing its progress.")
+
+    def show_refresh_status():
+        if refresh_job.state == 'idle':
+            return
+        if refresh_job.running:
+            st.session_state.watching_refresh = True
+            st.info(f"⏳ Updating documents from Google Drive ({refresh_job.elapsed():.0f}s)...\n\n{refresh_job.message}")
+        elif st.session_state.get('watching_refresh'):
+            # Rerun the whole page once so the counts and results use the new snapshot
+            st.session_state.watching_refresh = False
+            st.rerun()
+        elif refresh_job.state == 'succeeded':
+            st.success(f"✅ Documents refreshed in {refresh_job.elapsed():.0f}s. {refresh_job.message}")
+        else:
+            st.error(f"❌ Refresh failed: {refresh_job.message}")
+        with st.expander("Refresh log"):
+            st.code("\n".join(refresh_job.log()[-40:]) or "Waiting for output...")
+
+    if hasattr(st, "fragment"):
+        # Poll only this block while a refresh is running
+        show_refresh_status = st.fragment(run_every=2 if refresh_job.running else None)(show_refresh_status)
+    show_refresh_status()
     st.markdown("### 📊 Quick Stats")
     st.markdown(f"""
     <div class='metric-card gradient-blue'>
@@ -104,11 +139,32 @@ with st.sidebar:
         <div class='stat-label'>Success Rate</div>
     </div>
     """, unsafe_allow_html=True)
+    engine_stats = engine.stats()
+    if engine_stats['warmup_seconds'] is not None:
+        st.caption(f"Search engine: {engine_stats['chunks']} chunks · ready in "
+                   f"{engine_stats['warmup_seconds']:.1f}s · ~{engine_stats['memory_bytes'] / 2**20:.0f} MB")
+    else:
+        st.caption(f"Search engine: {engine_stats['chunks']} chunks · loaded in "
+                   f"{engine_stats['load_seconds']:.1f}s · ~{engine_stats['memory_bytes'] / 2**20:.0f} MB")
+    st.caption(f"Cache hit rate: queries {engine_stats['query_cache']['hit_rate']:.0%} · "
+               f"results {engine_stats['result_cache']['hit_rate']:.0%}")
+    if usage['stages']:
+        with st.expander("⏱️ Latency today (ms)"):
+            st.table({
+                p: {stage: round(usage['stages'][stage][p] * 1000, 1) for stage in STAGES if stage in usage['stages']}
+                for p in ('p50', 'p95', 'p99')
+            })
     st.markdown("### 🕒 Recent Activity")
     st.markdown("- Policy updated: Remote Work<br>- New user: john.doe@familytlc.com<br>- Popular search: <b>vacation days</b>", unsafe_allow_html=True)
     st.markdown("### 🎯 Advanced Filters")
     filter_by_file = st.text_input("🔍 Filter by filename keyword")
     exact_match = st.checkbox("✅ Exact Match Only")
+    folder_limits = [0, 1, 2, 3]
+    max_per_folder = st.selectbox(
+        "📁 Max results per folder", folder_limits,
+        index=folder_limits.index(MAX_PER_FOLDER) if MAX_PER_FOLDER in folder_limits else 0,
+        format_func=lambda n: "No limit" if n == 0 else str(n),
+    )
     st.markdown("---")
     st.markdown("### 🕒 Recent Searches")
     if 'recent_queries' in st.session_state and st.session_state.recent_queries:
@@ -145,8 +201,8 @@ with cols[2]:
     st.markdown(f"""
     <div class="metric-card gradient-yellow">
         <div style="font-size:2em;">⚡</div>
-        <div class="stat-number">{AVG_RESPONSE}</div>
-        Avg Response
+        <div class="stat-number">{MEDIAN_RESPONSE}</div>
+        Median Response
     </div>
     """, unsafe_allow_html=True)
 with cols[3]:
@@ -169,14 +225,21 @@ for i, tag in enumerate(POPULAR_SEARCHES):
 # ------------- TABS: SEARCH / FAQ / ABOUT -------------
 tab_search, tab_faq, tab_about = st.tabs(["🔍 Search", "📖 FAQ", "ℹ️ About"])
 
-# --------- MODEL LOAD ---------
-model = None
-index = None
-if embedding_matrix is not None and len(embedding_matrix):
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-    index = create_faiss_index(embedding_matrix)
-
 with tab_search:
+    def show_search_readiness():
+        if engine.warming:
+            st.session_state.waiting_for_engine = True
+            st.info("⏳ Loading the search model and index. Search is enabled as soon as they are ready.")
+        elif st.session_state.get('waiting_for_engine'):
+            # Rerun the whole page once so the Search button and counts pick up the loaded engine
+            st.session_state.waiting_for_engine = False
+            st.rerun()
+
+    if hasattr(st, "fragment"):
+        # Poll only this block while the engine warms up
+        show_search_readiness = st.fragment(run_every=1 if engine.warming else None)(show_search_readiness)
+    show_search_readiness()
+
     with st.form(key="search_form"):
         user_email = st.text_input(
             "Enter your Google email for document access:",
@@ -190,93 +253,77 @@ with tab_search:
             placeholder="Show me the sick leave policy, find training materials, etc.",
             help="Try searching for HR policies, forms, or folders"
         )
-        submitted = st.form_submit_button("Search Documents")
+        submitted = st.form_submit_button("Search Documents", disabled=engine.warming)
 
     if submitted:
-        if not user_email:
-            st.markdown('<div class="status-error">Please enter your email address for secure access.</div>', unsafe_allow_html=True)
-        elif not question:
-            st.markdown('<div class="status-warning">Please enter a question to search documents.</div>', unsafe_allow_html=True)
-        elif model is None or index is None:
-            st.markdown('<div class="status-error">Search not initialized. Please contact admin or refresh documents.</div>', unsafe_allow_html=True)
-        else:
-            SCOPES = ['https://www.googleapis.com/auth/drive.metadata.readonly']
-
-            # Load credentials from secrets and write to file
-            creds_dict = dict(st.secrets["GOOGLE_CREDENTIALS"])
-            with open("service_account.json", "w") as f:
-                json.dump(creds_dict, f)
-
-            # Authenticate to Google Drive with service account
-            creds = service_account.Credentials.from_service_account_file("service_account.json", scopes=SCOPES)
-            drive_service = build('drive', 'v3', credentials=creds)
-
-            def get_user_accessible_file_ids(email):
-                query = f"'{email}' in readers"
-                file_ids = set()
-                page_token = None
-                while True:
-                    response = drive_service.files().list(
-                        q=query,
-                        fields="nextPageToken, files(id)",
-                        pageToken=page_token,
-                    ).execute()
-                    file_ids.update({f['id'] for f in response.get('files', [])})
-                    page_token = response.get('nextPageToken', None)
-                    if not page_token:
-                        break
-                return file_ids
+        # Pin one snapshot for the search and the rendering; a concurrent swap frees it only once we are done
+        with engine.acquire() as engine_state:
+            if not user_email:
+                st.markdown('<div class="status-error">Please enter your email address for secure access.</div>', unsafe_allow_html=True)
+            elif not question:
+                st.markdown('<div class="status-warning">Please enter a question to search documents.</div>', unsafe_allow_html=True)
+            elif engine_state is None or not engine.ready:
+                st.markdown('<div class="status-error">Search not initialized. Please contact admin or refresh documents.</div>', unsafe_allow_html=True)
+            else:
+                def get_user_accessible_file_ids(email):
+                    """Live Drive crawl for what the ACL index cannot answer (unknown users, group grants)."""
+                    return readable_file_ids(drive_metadata_service(), email)
 
-            try:
-                allowed_file_ids = get_user_accessible_file_ids(user_email)
-            except Exception as e:
-                st.markdown(f'<div class="status-error">Google Drive error: {e}</div>', unsafe_allow_html=True)
-                allowed_file_ids = set()
+                trace = telemetry.trace(user_email)
+                drive_error = False
+                with trace.stage('acl'):
+                    try:
+                        allowed_file_ids = access_checker.allowed_file_ids(user_email, get_user_accessible_file_ids)
+                    except Exception as e:
+                        st.markdown(f'<div class="status-error">Google Drive error: {e}</div>', unsafe_allow_html=True)
+                        allowed_file_ids = set()
+                        drive_error = True
 
-            # Record user query in session state
-            if 'recent_queries' not in st.session_state:
-                st.session_state.recent_queries = []
-            st.session_state.recent_queries.insert(0, {"question": question, "time": datetime.now().strftime("%Y-%m-%d %H:%M")})
-            st.session_state.recent_queries = st.session_state.recent_queries[:10]
+                # Record user query in session state
+                if 'recent_queries' not in st.session_state:
+                    st.session_state.recent_queries = []
+                st.session_state.recent_queries.insert(0, {"question": question, "time": datetime.now().strftime("%Y-%m-%d %H:%M")})
+                st.session_state.recent_queries = st.session_state.recent_queries[:10]
 
-            st.markdown(f'<div class="status-success">Searching for: <b>{question}</b></div>', unsafe_allow_html=True)
-            with st.spinner("🔎 Searching relevant documents..."):
-                query_embedding = model.encode([question]).astype("float32")
-                distances, indices = index.search(query_embedding, 10)
-                results = []
-                for i, idx in enumerate(indices[0]):
-                    chunk = text_chunks[idx].lower()
-                    score = distances[0][i]
-                    if exact_match and question.lower() not in chunk:
-                        continue
-                    if filter_by_file and filter_by_file.lower() not in sources[idx].lower():
-                        continue
-                    results.append((score, idx))
-                results.sort()
-                top_indices = [idx for _, idx in results[:3]]
+                st.markdown(f'<div class="status-success">Searching for: <b>{question}</b></div>', unsafe_allow_html=True)
+                with st.spinner("🔎 Searching relevant documents..."):
+                    try:
+                        results = engine.search(
+                            question,
+                            k=3,
+                            filename_keyword=filter_by_file,
+                            exact_phrase=question if exact_match else None,
+                            allowed_file_ids=allowed_file_ids,
+                            state=engine_state,
+                            trace=trace,
+                            max_per_folder=max_per_folder,
+                        )
+                    except Exception:
+                        trace.finish(error=True)
+                        raise
+                    top_indices = [idx for _, idx in results]
 
-            if not top_indices:
-                st.markdown('<div class="status-warning">No results. Try rewording or updating your filters.</div>', unsafe_allow_html=True)
-            else:
-                st.success(f"✅ Found {len(top_indices)} results.")
-                for idx in top_indices:
-                    file_name = sources[idx]
-                    chunk = text_chunks[idx][:500].replace("\n", " ")
-                    file_id = file_ids[idx]
-                    view_link = f"https://drive.google.com/file/d/{file_id}/view"
-                    if file_id in allowed_file_ids:
-                        st.markdown(f"""
-                        <div class="result-card">
-                            <h4>📄 {file_name}</h4>
-                            <p>{chunk}...</p>
-                            <a href="{view_link}" target="_blank">🔗 View Document</a>
-                            <br>
-                            <button onClick="alert('Thanks for your feedback!')" style="background:#f5f8fa;color:#15803d;border:none;padding:6px 12px;border-radius:5px;margin-top:9px;cursor:pointer;">👍 Helpful</button>
-                            <button onClick="alert('Thanks – your input helps improve results!')" style="background:#f5f8fa;color:#cd2222;border:none;padding:6px 12px;border-radius:5px;margin-top:9px;cursor:pointer;">👎 Not Relevant</button>
-                        </div>
-                        """, unsafe_allow_html=True)
+                with trace.stage('render'):
+                    if not top_indices:
+                        st.markdown('<div class="status-warning">No results. Try rewording or updating your filters.</div>', unsafe_allow_html=True)
                     else:
-                        st.markdown(f'<div class="status-error">🔒 No access to <b>{file_name}</b></div>', unsafe_allow_html=True)
+                        st.success(f"✅ Found {len(top_indices)} results.")
+                        for idx in top_indices:
+                            file_name = engine_state.source(idx)
+                            chunk = engine_state.chunk_text(idx)[:500].replace("\n", " ")
+                            file_id = engine_state.file_id(idx)
+                            view_link = f"https://drive.google.com/file/d/{file_id}/view"
+                            st.markdown(f"""
+                            <div class="result-card">
+                                <h4>📄 {file_name}</h4>
+                                <p>{chunk}...</p>
+                                <a href="{view_link}" target="_blank">🔗 View Document</a>
+                                <br>
+                                <button onClick="alert('Thanks for your feedback!')" style="background:#f5f8fa;color:#15803d;border:none;padding:6px 12px;border-radius:5px;margin-top:9px;cursor:pointer;">👍 Helpful</button>
+                                <button onClick="alert('Thanks – your input helps improve results!')" style="background:#f5f8fa;color:#cd2222;border:none;padding:6px 12px;border-radius:5px;margin-top:9px;cursor:pointer;">👎 Not Relevant</button>
+                            </div>
+                            """, unsafe_allow_html=True)
+                trace.finish(results=len(top_indices), error=drive_error)
 
 
 with tab_faq:
@@ -0,0 +1,70 @@
+"""Chunker throughput on our largest documents, legacy vs streaming.
+
+    python -m benchmarks.bench_chunking                 # largest docs in data/
+    python -m benchmarks.bench_chunking --top 5 --repeat 20
+    python -m benchmarks.bench_chunking --no-tokenizer  # whitespace token counts
+
+Documents are rebuilt by joining each file's chunks from the current snapshot;
+``--repeat`` concatenates each one with itself to show how the two chunkers
+scale with document length.
+"""
+import argparse
+import time
+from collections import defaultdict
+
+from chunking import CHUNK_TOKENS, TokenCounter, chunk_text, load_tokenizer
+from snapshot import open_current
+
+def legacy_chunk_text(text, max_tokens=200):
+    """The original update_embeddings.chunk_text, kept for comparison."""
+    sentences = text.split('. ')
+    chunks = []
+    chunk = ""
+    for sentence in sentences:
+        if len((chunk + sentence).split()) > max_tokens:
+            chunks.append(chunk.strip())
+            chunk = sentence + ". "
+        else:
+            chunk += sentence + ". "
+    if chunk:
+        chunks.append(chunk.strip())
+    return chunks
+
+def largest_documents(data_dir, top):
+    snapshot = open_current(data_dir)
+    if snapshot is None:
+        raise SystemExit("No snapshot published yet; run update_embeddings.py or snapshot.py migrate")
+    by_file = defaultdict(list)
+    for row, chunk in enumerate(snapshot.iter_chunk_texts()):
+        by_file[snapshot.file_codes[row]].append(chunk)
+    docs = ['\n'.join(chunks) for chunks in by_file.values()]
+    return sorted(docs, key=len, reverse=True)[:top]
+
+def measure(name, fn, docs, counter):
+    start = time.perf_counter()
+    chunks = [chunk for doc in docs for chunk in fn(doc)]
+    elapsed = time.perf_counter() - start
+    sizes = counter.count_many(chunks) if chunks else [0]
+    over = sum(size > CHUNK_TOKENS for size in sizes)
+    mb = sum(len(doc.encode('utf-8')) for doc in docs) / 2**20
+    print(f"  {name:<10} {elapsed:8.3f}s  {mb / elapsed if elapsed else float('inf'):8.2f} MB/s  "
+          f"{len(chunks):6d} chunks  max {max(sizes):5d} tokens  {over:5d} over {CHUNK_TOKENS} (truncated)")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data-dir', default='data')
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--no-tokenizer', action='store_true')
+    args = parser.parse_args()
+
+    tokenizer = None if args.no_tokenizer else load_tokenizer()
+    counter = TokenCounter(tokenizer)
+    docs = [' '.join([doc] * args.repeat) for doc in largest_documents(args.data_dir, args.top)]
+    print(f"✂️ {len(docs)} documents, {sum(map(len, docs)) / 2**20:.2f} MB, "
+          f"{'model tokenizer' if tokenizer else 'whitespace tokens'}")
+    measure('legacy', legacy_chunk_text, docs, counter)
+    measure('streaming', lambda doc: chunk_text(doc, tokenizer=tokenizer), docs, counter)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+"""In-process stand-in for the parts of the Drive v3 API that ingestion uses.
+
+Serves generated PDF, DOCX, PPTX, XLSX and Google Doc files from a local
+directory through ``files().list`` (with folder queries and nextPageToken
+paging), ``files().get_media``, ``files().export`` and
+``permissions().list``. Pass ``FakeMediaDownload`` as ``downloader_cls``
+wherever the code takes a ``MediaIoBaseDownload``.
+"""
+import os
+import re
+import time
+
+import numpy as np
+
+from benchmarks.synthetic import document_text, paragraph
+
+FOLDER_MIME = 'application/vnd.google-apps.folder'
+DOC_TYPES = {
+    'pdf': 'application/pdf',
+    'gdoc': 'application/vnd.google-apps.document',
+    'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'pptx': 'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+PAGE_SIZE = 100
+
+def _pdf_escape(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+def make_pdf(path, text, line_chars=90, lines_per_page=50):
+    """Minimal text PDF (Helvetica, one Tj per line) that PdfReader can extract."""
+    lines = []
+    for para in text.split('\n'):
+        while len(para) > line_chars:
+            cut = para.rfind(' ', 0, line_chars)
+            cut = cut if cut > 0 else line_chars
+            lines.append(para[:cut])
+            para = para[cut:].lstrip()
+        lines.append(para)
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)] or [[]]
+
+    objects = [None, None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]  # 1 catalog, 2 pages, 3 font
+    page_ids = []
+    for page in pages:
+        stream = "BT /F1 10 Tf 12 TL 50 780 Td " + " ".join(f"({_pdf_escape(line)}) Tj T*" for line in page) + " ET"
+        data = stream.encode('latin-1', 'replace')
+        objects.append(b"<< /Length %d >>\nstream\n" % len(data) + data + b"\nendstream")
+        content_id = len(objects)
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id)
+        page_ids.append(len(objects))
+    objects[0] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % i for i in page_ids), len(page_ids))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, 'wb') as f:
+        f.write(out)
+
+def make_docx(path, text):
+    from docx import Document
+    doc = Document()
+    for para in text.split('\n\n'):
+        doc.add_paragraph(para)
+    doc.save(path)
+
+def make_pptx(path, text):
+    from pptx import Presentation
+    from pptx.util import Inches
+    prs = Presentation()
+    for para in text.split('\n\n'):
+        slide = prs.slides.add_slide(prs.slide_layouts[5])
+        slide.shapes.title.text = para.split('.')[0][:60]
+        box = slide.shapes.add_textbox(Inches(0.5), Inches(1.5), Inches(9), Inches(5))
+        box.text_frame.text = para
+    prs.save(path)
+
+def make_xlsx(path, rng, rows=200):
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Data")
+    sheet.append(["Item", "Owner", "Amount", "Notes"])
+    for i in range(rows):
+        sheet.append([f"Item {i}", f"Team {rng.integers(1, 20)}", float(rng.integers(10, 5000)),
+                      paragraph(rng, 1)])
+    workbook.save(path)
+
+def generate_corpus(root, n_docs, n_folders=10, seed=0, mix=('pdf', 'gdoc', 'docx', 'pptx', 'xlsx'),
+                    paragraphs=8):
+    """Write ``n_docs`` files under ``root`` and return a FakeDrive serving them."""
+    rng = np.random.default_rng(seed)
+    os.makedirs(root, exist_ok=True)
+    folders = [{'id': f"folder{i}", 'name': f"Folder {i}", 'mimeType': FOLDER_MIME} for i in range(n_folders)]
+    files = []
+    for i in range(n_docs):
+        kind = mix[i % len(mix)]
+        file_id = f"doc{i:06d}"
+        name = f"Document {i}" + ('' if kind == 'gdoc' else f".{kind}")
+        path = os.path.join(root, f"{file_id}.{'txt' if kind == 'gdoc' else kind}")
+        if kind == 'xlsx':
+            make_xlsx(path, rng)
+        else:
+            text = document_text(rng, paragraphs)
+            if kind == 'pdf':
+                make_pdf(path, text)
+            elif kind == 'docx':
+                make_docx(path, text)
+            elif kind == 'pptx':
+                make_pptx(path, text)
+            else:
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(text)
+        files.append({
+            'id': file_id,
+            'name': name,
+            'mimeType': DOC_TYPES[kind],
+            'modifiedTime': '2024-01-01T00:00:00.000Z',
+            'md5Checksum': None if kind == 'gdoc' else f"{seed}-{i}",
+            'parents': ['root' if i % (n_folders + 1) == n_folders else folders[i % (n_folders + 1)]['id']],
+            'permissions': [{'type': 'user', 'role': 'reader', 'emailAddress': f"user{i % 25}@example.com"},
+                            {'type': 'domain', 'role': 'reader', 'domain': 'example.com'}],
+            '_path': path,
+        })
+    return FakeDrive(files, folders)
+
+class _Request:
+    def __init__(self, run):
+        self._run = run
+
+    def execute(self, num_retries=0):
+        return self._run()
+
+class _MediaRequest:
+    def __init__(self, path, latency):
+        self.path = path
+        self.latency = latency
+
+class _Files:
+    def __init__(self, drive):
+        self.drive = drive
+
+    def list(self, q='', pageToken=None, pageSize=PAGE_SIZE, fields=None, **kwargs):
+        def run():
+            self.drive.calls += 1
+            time.sleep(self.drive.latency)
+            items = self.drive.query(q)
+            start = int(pageToken or 0)
+            size = min(pageSize or PAGE_SIZE, PAGE_SIZE)
+            response = {'files': [{k: v for k, v in item.items() if not k.startswith('_')}
+                                  for item in items[start:start + size]]}
+            if start + size < len(items):
+                response['nextPageToken'] = str(start + size)
+            return response
+        return _Request(run)
+
+    def get_media(self, fileId):
+        return _MediaRequest(self.drive.by_id[fileId]['_path'], self.drive.latency)
+
+    def export(self, fileId, mimeType):
+        return _MediaRequest(self.drive.by_id[fileId]['_path'], self.drive.latency)
+
+class _Permissions:
+    def __init__(self, drive):
+        self.drive = drive
+
+    def list(self, fileId, fields=None, pageToken=None, **kwargs):
+        return _Request(lambda: {'permissions': self.drive.by_id[fileId]['permissions']})
+
+class FakeDrive:
+    """Answers the Drive queries list_drive_files() issues; ``latency`` seconds per call."""
+
+    def __init__(self, files, folders, latency=0.0):
+        self.files_list = files
+        self.folders = folders
+        self.by_id = {f['id']: f for f in files}
+        self.latency = latency
+        self.calls = 0
+
+    def files(self):
+        return _Files(self)
+
+    def permissions(self):
+        return _Permissions(self)
+
+    def query(self, q):
+        if "mimeType = 'application/vnd.google-apps.folder'" in q:
+            return self.folders
+        parent = re.search(r"'([^']+)' in parents", q)
+        if parent:
+            return [f for f in self.files_list if parent.group(1) in f['parents']]
+        return list(self.files_list)
+
+    def touch(self, fraction=0.1, seed=1):
+        """Mark a fraction of the files as modified, for incremental-sync runs."""
+        rng = np.random.default_rng(seed)
+        changed = rng.choice(len(self.files_list), size=max(1, int(len(self.files_list) * fraction)), replace=False)
+        for i in changed:
+            self.files_list[i]['modifiedTime'] = '2024-06-01T00:00:00.000Z'
+            if self.files_list[i]['md5Checksum']:
+                self.files_list[i]['md5Checksum'] += '-v2'
+        return len(changed)
+
+    def __call__(self):
+        # Usable directly as the authenticate_drive factory
+        return self
+
+class FakeMediaDownload:
+    """Drop-in for MediaIoBaseDownload that copies the served file in chunks."""
+
+    def __init__(self, fh, request, chunksize=4 * 1024 * 1024):
+        self.fh = fh
+        self.request = request
+        self.chunksize = chunksize
+        self._source = None
+
+    def next_chunk(self, num_retries=0):
+        if self._source is None:
+            time.sleep(self.request.latency)
+            self._source = open(self.request.path, 'rb')
+        data = self._source.read(self.chunksize)
+        if data:
+            self.fh.write(data)
+        if len(data) < self.chunksize:
+            self._source.close()
+            return None, True
+        return None, False
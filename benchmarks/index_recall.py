@@ -0,0 +1,91 @@
+"""Recall-vs-flat report for the FAISS index modes in faiss_utils.
+
+    python -m benchmarks.index_recall                      # current snapshot
+    python -m benchmarks.index_recall --synthetic 200000   # random corpus
+    python -m benchmarks.index_recall --json recall.json
+
+Queries are held out of the indexed vectors, so recall is not inflated by
+every query finding itself.
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from embeddings_utils import load_embeddings
+from faiss_utils import create_faiss_index, set_search_params
+from snapshot import open_current
+
+SWEEPS = {
+    'flat': [{}],
+    'hnsw': [{'ef_search': ef} for ef in (16, 32, 64, 128, 256)],
+    'ivf_flat': [{'nprobe': p} for p in (1, 4, 16, 64)],
+    'ivf_pq': [{'nprobe': p} for p in (1, 4, 16, 64)],
+}
+
+def recall_at_k(found, truth):
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+def run(embeddings, n_queries=500, k=10, kinds=None, seed=0):
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(len(embeddings))
+    queries = np.ascontiguousarray(embeddings[order[:n_queries]])
+    base = np.ascontiguousarray(embeddings[order[n_queries:]])
+    k = min(k, len(base))
+
+    flat = create_faiss_index(base, 'flat')
+    _, truth = flat.search(queries, k)
+
+    rows = []
+    for kind in kinds or SWEEPS:
+        start = time.perf_counter()
+        index = create_faiss_index(base, kind)
+        build_seconds = time.perf_counter() - start
+        for search_params in SWEEPS[kind]:
+            set_search_params(index, **search_params)
+            start = time.perf_counter()
+            _, found = index.search(queries, k)
+            elapsed = time.perf_counter() - start
+            rows.append({
+                'kind': kind,
+                **search_params,
+                f'recall@{k}': round(recall_at_k(found, truth), 4),
+                'ms_per_query': round(1000 * elapsed / len(queries), 4),
+                'build_seconds': round(build_seconds, 3),
+            })
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--embeddings', help="an .npy file instead of the current snapshot")
+    parser.add_argument('--synthetic', type=int, help="use N random 384-d vectors instead of real embeddings")
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--kinds', nargs='+', choices=list(SWEEPS))
+    parser.add_argument('--json', help="also write the rows to this JSON file")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        embeddings = np.random.default_rng(1).standard_normal((args.synthetic, 384)).astype('float32')
+    elif args.embeddings:
+        embeddings = load_embeddings(args.embeddings).astype('float32')
+    else:
+        snapshot = open_current()
+        if snapshot is None:
+            parser.error("no snapshot published yet; pass --embeddings or --synthetic")
+        embeddings = np.asarray(snapshot.embeddings, dtype='float32')
+    n_queries = min(args.queries, len(embeddings) // 5)
+    print(f"📐 {len(embeddings)} vectors, {n_queries} held-out queries, k={args.k}")
+
+    rows = run(embeddings, n_queries, args.k, args.kinds)
+    for row in rows:
+        print("  " + "  ".join(f"{key}={value}" for key, value in row.items()))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(rows, f, indent=2)
+        print(f"💾 Wrote {args.json}")
+
+if __name__ == '__main__':
+    main()
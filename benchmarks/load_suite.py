@@ -0,0 +1,466 @@
+"""Ingestion, index build and query-load benchmarks against synthetic data.
+
+    python -m benchmarks.load_suite                                  # everything, default sizes
+    python -m benchmarks.load_suite --stages index,query --sizes 10000,100000
+    python -m benchmarks.load_suite --stages ingest --docs 500 --encoder model
+    python -m benchmarks.load_suite --stages startup --encoder model
+    python -m benchmarks.load_suite --stages shards --sizes 1000000 --shards 1,2,4,8
+    python -m benchmarks.load_suite --compare benchmarks/results/<earlier>.json
+
+ingest  generates PDF/DOCX/PPTX/XLSX/Google Doc files, serves them through
+        the in-process fake Drive and times fetch_documents, chunking and a
+        full, an unchanged and a 10%-changed update_embeddings run
+index   builds each FAISS index kind over 10k/100k/1M synthetic embeddings
+query   publishes a synthetic snapshot per size, loads it in SearchEngine and
+        fires concurrent searches (unfiltered and ACL-filtered), reporting
+        p50/p95/p99 latency and throughput
+startup times a cold import of each module the app and API load (fresh
+        interpreter, best of 3), then how long SearchEngine.warm_up() takes
+        to return and until the engine is ready, as after a server restart
+shards  builds the index of a synthetic snapshot with each shard count
+        (see sharded_index.py) and reports build time, single-query p50/p95,
+        concurrent throughput, and the rebuild after one folder changes
+
+Results are written to benchmarks/results/<timestamp>.json; --compare prints
+the change of every timing against an earlier run. The random encoder (the
+default) keeps the model out of the query numbers; --encoder model measures
+the real all-MiniLM-L6-v2, and --encoder onnx / onnx-int8 its ONNX Runtime
+backends (see encoders.py).
+"""
+import argparse
+import functools
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from benchmarks.synthetic import RandomEncoder, synthetic_embeddings, write_synthetic_snapshot
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+ROOT_DIR = os.path.dirname(os.path.dirname(RESULTS_DIR))
+DEFAULT_SIZES = (10000, 100000, 1000000)
+DEFAULT_KINDS = ('flat', 'hnsw', 'ivf_flat', 'ivf_pq')
+# What the Streamlit app imports before it can render, plus the heavy modules it should not
+STARTUP_MODULES = ('streamlit', 'search_engine', 'acl_index', 'refresh_job', 'telemetry', 'search_api',
+                   'faiss', 'sentence_transformers', 'googleapiclient.discovery')
+
+def rss_bytes():
+    """Current resident set size (Linux), falling back to the peak."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return peak_rss_bytes()
+
+def peak_rss_bytes():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def percentiles(samples):
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    return {'p50_ms': round(p50 * 1000, 3), 'p95_ms': round(p95 * 1000, 3), 'p99_ms': round(p99 * 1000, 3),
+            'mean_ms': round(float(np.mean(samples)) * 1000, 3)}
+
+def make_encoder(name):
+    if name == 'random':
+        return RandomEncoder()
+    from encoders import load_encoder
+    return load_encoder(backend='torch' if name == 'model' else name)
+
+def bench_ingest(workdir, n_docs, encoder_name, use_tokenizer, latency, mix):
+    import drive_auth_test11
+    import update_embeddings
+    from benchmarks.fake_drive import FakeMediaDownload, generate_corpus
+    from chunking import chunk_text, load_tokenizer
+
+    start = time.perf_counter()
+    drive = generate_corpus(os.path.join(workdir, 'drive'), n_docs, mix=mix)
+    drive.latency = latency
+    corpus_bytes = sum(os.path.getsize(f['_path']) for f in drive.files_list)
+    result = {'docs': n_docs, 'corpus_mb': round(corpus_bytes / 2**20, 2),
+              'generate_seconds': round(time.perf_counter() - start, 2)}
+
+    previous_cwd = os.getcwd()
+    os.chdir(workdir)   # ingestion writes data/ and downloaded_files/ relative to the working directory
+    patched = {}
+    try:
+        start = time.perf_counter()
+        listing = drive_auth_test11.list_drive_files(drive)
+        result['list_seconds'] = round(time.perf_counter() - start, 3)
+
+        start = time.perf_counter()
+        docs, _, _, _ = drive_auth_test11.fetch_documents(drive, listing, downloader_cls=FakeMediaDownload)
+        elapsed = time.perf_counter() - start
+        result['fetch_seconds'] = round(elapsed, 3)
+        result['fetch_docs_per_second'] = round(len(docs) / elapsed, 1)
+        result['fetch_mb_per_second'] = round(corpus_bytes / 2**20 / elapsed, 2)
+
+        tokenizer = load_tokenizer() if use_tokenizer else None
+        start = time.perf_counter()
+        chunks = sum(len(chunk_text(doc, tokenizer=tokenizer)) for doc in docs)
+        elapsed = time.perf_counter() - start
+        result['chunks'] = chunks
+        result['chunk_seconds'] = round(elapsed, 3)
+        result['chunks_per_second'] = round(chunks / elapsed, 1)
+
+        encoder = make_encoder(encoder_name)
+        # Run the real pipeline end to end against the fake Drive
+        patched = {
+            'authenticate_drive': update_embeddings.authenticate_drive,
+            'iter_documents': update_embeddings.iter_documents,
+            'load_encoder': update_embeddings.load_encoder,
+            'load_tokenizer': update_embeddings.load_tokenizer,
+        }
+        update_embeddings.authenticate_drive = drive
+        update_embeddings.iter_documents = functools.partial(drive_auth_test11.iter_documents,
+                                                             downloader_cls=FakeMediaDownload)
+        update_embeddings.load_encoder = lambda name, backend: encoder
+        if not use_tokenizer:
+            update_embeddings.load_tokenizer = lambda: None
+        shutil.rmtree('data', ignore_errors=True)
+        for run, prepare in (('full', None), ('unchanged', None), ('changed_10pct', lambda: drive.touch(0.1))):
+            if prepare:
+                prepare()
+            start = time.perf_counter()
+            # One encoder process: the patched encoder only exists in this one
+            update_embeddings.main(incremental=run != 'full', encode_workers=1)
+            elapsed = time.perf_counter() - start
+            result[f'update_{run}_seconds'] = round(elapsed, 3)
+        result['update_full_chunks_per_second'] = round(chunks / result['update_full_seconds'], 1)
+        result['peak_rss_mb'] = round((peak_rss_bytes() or 0) / 2**20, 1)
+    finally:
+        for name, value in patched.items():
+            setattr(update_embeddings, name, value)
+        os.chdir(previous_cwd)
+    return result
+
+def _index_bytes(index, workdir):
+    import faiss
+    path = os.path.join(workdir, 'size.index')
+    faiss.write_index(index, path)
+    size = os.path.getsize(path)
+    os.remove(path)
+    return size
+
+def bench_index(workdir, sizes, kinds):
+    from faiss_utils import create_faiss_index
+    rows = []
+    for n in sizes:
+        embeddings = synthetic_embeddings(n)
+        for kind in kinds:
+            before = rss_bytes()
+            start = time.perf_counter()
+            index = create_faiss_index(embeddings, kind)
+            build_seconds = time.perf_counter() - start
+            rows.append({
+                'chunks': n,
+                'kind': kind,
+                'build_seconds': round(build_seconds, 3),
+                'index_mb': round(_index_bytes(index, workdir) / 2**20, 1),
+                'rss_delta_mb': round((rss_bytes() - before) / 2**20, 1),
+            })
+            print(f"   {kind:<8} {n:>9,} chunks: built in {build_seconds:.2f}s")
+            del index
+        del embeddings
+    return rows
+
+def bench_query(workdir, sizes, kinds, encoder_name, concurrency, n_queries, k):
+    import search_engine
+    from query_cache import LRUCache
+
+    encoder = make_encoder(encoder_name)
+    queries = [f"benchmark query {i} about leave policy" for i in range(n_queries)]
+    rows = []
+    for n in sizes:
+        data_dir = os.path.join(workdir, f"data-{n}")
+        start = time.perf_counter()
+        write_synthetic_snapshot(data_dir, n)
+        write_seconds = time.perf_counter() - start
+        for kind in kinds:
+            os.environ['FAISS_INDEX'] = kind
+            before = rss_bytes()
+            engine = search_engine.SearchEngine(data_dir)
+            engine.model = encoder
+            engine.model_space = engine.model_name
+            engine.refresh()
+            # Every query must reach the encoder and the index
+            engine.result_cache = LRUCache(0)
+            engine.query_cache = LRUCache(0)
+            load = {'load_seconds': round(engine.load_seconds, 3),
+                    'rss_delta_mb': round((rss_bytes() - before) / 2**20, 1)}
+            file_ids = engine.state.unique_file_ids
+            filters = {
+                'unfiltered': None,
+                'acl_50pct': set(file_ids[::2]),
+                'acl_1pct': set(file_ids[::100]),
+            }
+            for label, allowed in filters.items():
+                def one(question, engine=engine, allowed=allowed):
+                    t = time.perf_counter()
+                    engine.search(question, k, allowed_file_ids=allowed)
+                    return time.perf_counter() - t
+                engine.search(queries[0], k, allowed_file_ids=allowed)   # warm up
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                    latencies = list(pool.map(one, queries))
+                wall = time.perf_counter() - start
+
+                start = time.perf_counter()
+                engine.search_batch(queries, k, allowed_file_ids=allowed)
+                batch_wall = time.perf_counter() - start
+                rows.append({
+                    'chunks': n,
+                    'kind': kind,
+                    'filter': label,
+                    'concurrency': concurrency,
+                    'queries': n_queries,
+                    **percentiles(latencies),
+                    'qps': round(n_queries / wall, 1),
+                    'batch_qps': round(n_queries / batch_wall, 1),
+                    'snapshot_write_seconds': round(write_seconds, 3),
+                    **load,
+                })
+                print(f"   {kind:<8} {n:>9,} chunks {label:<10} p50 {rows[-1]['p50_ms']:.2f}ms "
+                      f"p99 {rows[-1]['p99_ms']:.2f}ms, {rows[-1]['qps']:.0f} q/s "
+                      f"({rows[-1]['batch_qps']:.0f} q/s batched)")
+            engine.close()
+            del engine
+        os.environ.pop('FAISS_INDEX', None)
+        shutil.rmtree(data_dir, ignore_errors=True)
+    return rows
+
+def _clear_shards(path):
+    from sharded_index import SHARDS_FILE
+    for name in os.listdir(path):
+        if name.startswith('shard_') or name == SHARDS_FILE:
+            os.remove(os.path.join(path, name))
+
+def bench_shards(workdir, sizes, shard_counts, n_queries, concurrency, k):
+    from sharded_index import load_or_create_index
+    from snapshot import Snapshot
+
+    queries = synthetic_embeddings(n_queries, seed=12345)
+    rows = []
+    for n in sizes:
+        data_dir = os.path.join(workdir, f"shards-{n}")
+        base = Snapshot(write_synthetic_snapshot(data_dir, n))
+        # The same corpus after an edit to every file of one folder
+        changed = Snapshot(write_synthetic_snapshot(data_dir, n, changed_folder=0))
+        for shards in shard_counts:
+            for snapshot in (base, changed):
+                _clear_shards(snapshot.path)
+            start = time.perf_counter()
+            index = load_or_create_index(base, shards=shards)
+            build_seconds = time.perf_counter() - start
+
+            latencies = []
+            for query in queries:
+                t = time.perf_counter()
+                index.search(query[None, :], k)
+                latencies.append(time.perf_counter() - t)
+            latencies.sort()
+
+            def one(query, index=index):
+                return index.search(query[None, :], k)
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                list(pool.map(one, queries))
+            wall = time.perf_counter() - start
+            del index
+
+            start = time.perf_counter()
+            index = load_or_create_index(changed, base, shards=shards)
+            rebuild_seconds = time.perf_counter() - start
+            rows.append({
+                'chunks': n,
+                'shards': shards,
+                'build_seconds': round(build_seconds, 3),
+                'p50_ms': round(1000 * latencies[len(latencies) // 2], 3),
+                'p95_ms': round(1000 * latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3),
+                'concurrency': concurrency,
+                'qps': round(n_queries / wall, 1),
+                'rebuild_seconds': round(rebuild_seconds, 3),
+                'rebuilt_shards': getattr(index, 'built', 1),
+                'reused_shards': getattr(index, 'reused', 0),
+            })
+            del index
+            print(f"   {shards:>2} shard(s) {n:>9,} chunks: built in {build_seconds:.2f}s, "
+                  f"p50 {rows[-1]['p50_ms']:.2f}ms p95 {rows[-1]['p95_ms']:.2f}ms, {rows[-1]['qps']:.0f} q/s, "
+                  f"one folder changed: {rebuild_seconds:.2f}s ({rows[-1]['rebuilt_shards']} rebuilt, "
+                  f"{rows[-1]['reused_shards']} reused)")
+        base.close()
+        changed.close()
+        shutil.rmtree(data_dir, ignore_errors=True)
+    return rows
+
+def _import_seconds(module, repeat=3):
+    """Best-of-``repeat`` cold import time in a fresh interpreter, or None if it cannot be imported."""
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    best = None
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, cwd=ROOT_DIR)
+        if proc.returncode:
+            return None
+        seconds = float(proc.stdout.strip().splitlines()[-1])
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+def bench_startup(workdir, n_chunks, encoder_name):
+    import search_engine
+
+    result = {'imports': {}}
+    for module in STARTUP_MODULES:
+        seconds = _import_seconds(module)
+        result['imports'][module] = None if seconds is None else round(seconds, 4)
+        print(f"   import {module:<26} " + ("not installed" if seconds is None else f"{seconds * 1000:.0f}ms"))
+
+    data_dir = os.path.join(workdir, 'data-startup')
+    write_synthetic_snapshot(data_dir, n_chunks)
+    for run in ('first_load', 'restart'):   # the first load also builds and persists the index
+        start = time.perf_counter()
+        engine = search_engine.SearchEngine(data_dir, backend='torch' if encoder_name == 'model' else encoder_name)
+        if encoder_name == 'random':
+            engine.model = make_encoder(encoder_name)
+            engine.model_space = engine.model_name
+        engine.warm_up()
+        returned = time.perf_counter() - start
+        while engine.warming:
+            time.sleep(0.005)
+        ready = time.perf_counter() - start
+        if not engine.ready:
+            raise RuntimeError(f"engine failed to warm up: {engine.last_error}")
+        result[f'{run}_warm_up_return_seconds'] = round(returned, 4)
+        result[f'{run}_ready_seconds'] = round(ready, 3)
+        result[f'{run}_model_load_seconds'] = round(engine.model_load_seconds, 3)
+        print(f"   {run:<10} {n_chunks:>9,} chunks: warm_up() returned in {returned * 1000:.1f}ms, "
+              f"ready in {ready:.2f}s (model {engine.model_load_seconds:.2f}s)")
+        engine.close()
+        del engine
+    result['chunks'] = n_chunks
+    shutil.rmtree(data_dir, ignore_errors=True)
+    return result
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(RESULTS_DIR)).stdout.strip() or None
+    except OSError:
+        commit = None
+    try:
+        import faiss
+        faiss_version = getattr(faiss, '__version__', None)
+    except ImportError:
+        faiss_version = None
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'numpy': np.__version__,
+        'faiss': faiss_version,
+    }
+
+def _timings(results):
+    """Flatten a results file to {key: value} for every latency/duration metric."""
+    flat = {}
+    for key, value in (results.get('ingest') or {}).items():
+        if key.endswith('_seconds'):
+            flat[f"ingest.{key}"] = value
+    for row in results.get('index') or []:
+        flat[f"index.{row['kind']}.{row['chunks']}.build_seconds"] = row['build_seconds']
+    for row in results.get('query') or []:
+        for metric in ('p50_ms', 'p99_ms'):
+            flat[f"query.{row['kind']}.{row['chunks']}.{row['filter']}.{metric}"] = row[metric]
+    for row in results.get('shards') or []:
+        for metric in ('build_seconds', 'p50_ms', 'p95_ms', 'rebuild_seconds'):
+            flat[f"shards.{row['shards']}.{row['chunks']}.{metric}"] = row[metric]
+    startup = results.get('startup') or {}
+    for module, seconds in (startup.get('imports') or {}).items():
+        if seconds is not None:
+            flat[f"startup.import.{module}_seconds"] = seconds
+    for key, value in startup.items():
+        if key.endswith('_seconds'):
+            flat[f"startup.{key}"] = value
+    return flat
+
+def compare(current, previous):
+    before, after = _timings(previous), _timings(current)
+    print(f"Compared with {previous.get('environment', {}).get('commit')} "
+          f"({previous.get('environment', {}).get('created')}):")
+    for key in sorted(after.keys() & before.keys()):
+        if before[key]:
+            change = (after[key] - before[key]) / before[key]
+            flag = '  ⚠️' if change > 0.2 else ''
+            print(f"   {key:<55} {before[key]:>10} -> {after[key]:>10} ({change:+.0%}){flag}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stages', default='ingest,index,query,startup')
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)), help="chunk counts, comma separated")
+    parser.add_argument('--kinds', default=','.join(DEFAULT_KINDS))
+    parser.add_argument('--query-kinds', default='flat,hnsw', help="index kinds used by the query stage")
+    parser.add_argument('--shards', default='1,2,4,8', help="shard counts compared by the shards stage")
+    parser.add_argument('--shard-queries', type=int, default=200, help="queries per shard count (shards stage)")
+    parser.add_argument('--startup-chunks', type=int, default=100000, help="snapshot size for the startup stage")
+    parser.add_argument('--docs', type=int, default=200, help="documents in the fake Drive (ingest stage)")
+    parser.add_argument('--mix', default='pdf,gdoc,docx,pptx,xlsx', help="document types in the fake Drive")
+    parser.add_argument('--drive-latency', type=float, default=0.0, help="seconds added to every fake Drive call")
+    parser.add_argument('--encoder', choices=('random', 'model', 'onnx', 'onnx-int8'), default='random')
+    parser.add_argument('--tokenizer', action='store_true', help="chunk with the model tokenizer (needs transformers)")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--k', type=int, default=3)
+    parser.add_argument('--output', help="results file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument('--compare', help="an earlier results file to compare against")
+    args = parser.parse_args()
+
+    stages = set(args.stages.split(','))
+    sizes = [int(s) for s in args.sizes.split(',') if s]
+    results = {'environment': environment(), 'args': vars(args)}
+    workdir = tempfile.mkdtemp(prefix='search-bench-')
+    try:
+        if 'ingest' in stages:
+            print(f"📥 Ingestion: {args.docs} documents")
+            results['ingest'] = bench_ingest(workdir, args.docs, args.encoder, args.tokenizer, args.drive_latency,
+                                             tuple(args.mix.split(',')))
+        if 'index' in stages:
+            print("🧭 Index build")
+            results['index'] = bench_index(workdir, sizes, args.kinds.split(','))
+        if 'query' in stages:
+            print(f"🔎 Query load: {args.queries} queries, concurrency {args.concurrency}")
+            results['query'] = bench_query(workdir, sizes, args.query_kinds.split(','), args.encoder,
+                                           args.concurrency, args.queries, args.k)
+        if 'shards' in stages:
+            print(f"🧩 Sharded index: {args.shard_queries} queries, concurrency {args.concurrency}")
+            results['shards'] = bench_shards(workdir, sizes, [int(s) for s in args.shards.split(',') if s],
+                                             args.shard_queries, args.concurrency, args.k)
+        if 'startup' in stages:
+            print("🚀 Startup")
+            results['startup'] = bench_startup(workdir, args.startup_chunks, args.encoder)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    results['peak_rss_mb'] = round((peak_rss_bytes() or 0) / 2**20, 1)
+
+    output = args.output or os.path.join(RESULTS_DIR, time.strftime('%Y%m%dT%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"✅ Results written to {output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+if __name__ == '__main__':
+    main()
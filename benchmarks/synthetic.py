@@ -0,0 +1,95 @@
+"""Synthetic text, embeddings and snapshots for the load benchmarks."""
+import hashlib
+
+import numpy as np
+
+from snapshot import SnapshotWriter
+
+VOCABULARY = (
+    "policy leave vacation sick employee manager training onboarding handbook remote work office "
+    "benefits payroll reimbursement travel expense security laptop password support ticket meeting "
+    "schedule holiday approval request form document review report quarterly annual budget team "
+    "client family child intake safety procedure compliance audit health insurance dental vision "
+    "retirement plan contribution eligibility deadline submit contact department director program"
+).split()
+EMBEDDING_DIM = 384
+WRITE_BATCH = 50000
+FOLDERS = 20
+
+def sentence(rng, min_words=6, max_words=18):
+    words = rng.choice(VOCABULARY, size=rng.integers(min_words, max_words + 1))
+    return ' '.join(words).capitalize() + '.'
+
+def paragraph(rng, sentences=5):
+    return ' '.join(sentence(rng) for _ in range(sentences))
+
+def document_text(rng, paragraphs=8):
+    return '\n\n'.join(paragraph(rng, int(rng.integers(3, 8))) for _ in range(paragraphs))
+
+def synthetic_embeddings(n, dim=EMBEDDING_DIM, clusters=256, seed=0):
+    """Clustered, unit-length vectors: closer to real sentence embeddings than
+    uniform noise, which makes every approximate index look worse than it is."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype('float32')
+    vectors = centers[rng.integers(0, clusters, size=n)]
+    vectors += 0.35 * rng.normal(size=(n, dim)).astype('float32')
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+def write_synthetic_snapshot(data_dir, n_chunks, n_files=None, dim=EMBEDDING_DIM, seed=0, storage=None,
+                             changed_folder=None):
+    """Publish an ``n_chunks`` snapshot into ``data_dir``, written in batches to bound memory.
+
+    ``changed_folder`` gives that folder's files new vectors and a newer
+    modifiedTime, as if they were edited after a call without it.
+    """
+    n_files = n_files or max(1, n_chunks // 50)
+    rng = np.random.default_rng(seed)
+    writer = SnapshotWriter(data_dir, storage=storage)
+    manifest = {}
+    try:
+        for start in range(0, n_chunks, WRITE_BATCH):
+            count = min(WRITE_BATCH, n_chunks - start)
+            rows = np.arange(start, start + count)
+            files = rows * n_files // n_chunks   # contiguous rows per file, as ingestion writes them
+            embeddings = synthetic_embeddings(count, dim, seed=seed + start)
+            if changed_folder is not None:
+                edited = files % FOLDERS == changed_folder
+                embeddings[edited] = synthetic_embeddings(int(edited.sum()), dim, seed=seed + start + 1)
+            texts = [sentence(rng) for _ in range(count)]
+            sources = [f"Folder {f % FOLDERS} / Document {f}.pdf" for f in files]
+            file_ids = [f"file{f:07d}" for f in files]
+            writer.append(embeddings, texts, sources, file_ids)
+            for f, first, size in zip(*np.unique(files, return_index=True, return_counts=True)):
+                entry = manifest.setdefault(file_ids[first], {
+                    'modifiedTime': '2024-06-01' if f % FOLDERS == changed_folder else '2024-01-01',
+                    'source': sources[first],
+                    'start': start + int(first),
+                    'end': start + int(first),
+                })
+                entry['end'] += int(size)
+        return writer.publish(manifest, dim=dim, extra_meta={'synthetic': True})
+    except BaseException:
+        writer.abort()
+        raise
+
+class RandomEncoder:
+    """Deterministic stand-in for SentenceTransformer: a unit vector seeded
+    by the text, so benchmarks can isolate the index path from the model."""
+
+    def __init__(self, dim=EMBEDDING_DIM):
+        self.dim = dim
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def nbytes(self):
+        return 0
+
+    def encode(self, texts, batch_size=64, show_progress_bar=False, **kwargs):
+        vectors = np.empty((len(texts), self.dim), dtype='float32')
+        for i, text in enumerate(texts):
+            seed = int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+            vectors[i] = np.random.default_rng(seed).normal(size=self.dim)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors
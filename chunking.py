@@ -0,0 +1,122 @@
+import re
+
+TOKENIZER_NAME = 'sentence-transformers/all-MiniLM-L6-v2'
+# all-MiniLM-L6-v2 truncates at 256 tokens, two of which are [CLS] and [SEP]
+CHUNK_TOKENS = 254
+CHUNK_OVERLAP = 32
+# Bump when chunk boundaries change so the incremental sync re-chunks every file
+CHUNKER_VERSION = 2
+
+_BULLET = re.compile(r'^\s*(?:[-*•▪‣◦·]|\(?\d{1,3}[.)]|\(?[a-zA-Z][.)])\s+')
+_SENTENCE_END = re.compile(r'(?<=[.!?;:])\s+')
+_PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+
+def load_tokenizer(name=TOKENIZER_NAME):
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(name)
+
+class TokenCounter:
+    """Counts model tokens; falls back to whitespace words when no tokenizer is given."""
+
+    def __init__(self, tokenizer=None):
+        self.tokenizer = tokenizer
+
+    def count(self, text):
+        if self.tokenizer is None:
+            return len(text.split())
+        return len(self.tokenizer(text, add_special_tokens=False)['input_ids'])
+
+    def count_many(self, texts):
+        if self.tokenizer is None:
+            return [len(text.split()) for text in texts]
+        return [len(ids) for ids in self.tokenizer(texts, add_special_tokens=False)['input_ids']]
+
+def _is_structural(line):
+    # Bullets and table rows (tab-separated cells or pipe tables) stand on their own
+    return bool(_BULLET.match(line)) or '\t' in line or line.count('|') >= 2
+
+def split_units(text):
+    """Yield the smallest pieces a chunk may end on: bullets, table rows and sentences,
+    with an empty string marking each paragraph break."""
+    for paragraph in _PARAGRAPH_BREAK.split(text):
+        prose = []
+        for line in paragraph.split('\n'):
+            stripped = line.strip()
+            if not stripped:
+                continue
+            if _is_structural(line):
+                if prose:
+                    yield from _SENTENCE_END.split(' '.join(prose))
+                    prose = []
+                yield stripped
+            else:
+                # Hard-wrapped prose (typical of PDFs) is rejoined before sentence splitting
+                prose.append(stripped)
+        if prose:
+            yield from _SENTENCE_END.split(' '.join(prose))
+        yield ''
+
+def _split_oversized(unit, max_tokens, counter):
+    """Break a unit longer than ``max_tokens`` at word boundaries."""
+    words = unit.split()
+    piece, piece_tokens = [], 0
+    for word, tokens in zip(words, counter.count_many(words)):
+        if piece and piece_tokens + tokens > max_tokens:
+            yield ' '.join(piece), piece_tokens
+            piece, piece_tokens = [], 0
+        piece.append(word)
+        piece_tokens += tokens
+    if piece:
+        yield ' '.join(piece), piece_tokens
+
+def iter_chunks(text, max_tokens=CHUNK_TOKENS, overlap=CHUNK_OVERLAP, tokenizer=None, counter=None):
+    """Stream chunks of at most ``max_tokens`` model tokens.
+
+    Each unit is tokenized once and a running total is kept, so the cost is
+    linear in the text length. Consecutive chunks share up to ``overlap``
+    tokens of whole trailing units.
+    """
+    counter = counter or TokenCounter(tokenizer)
+    overlap = min(overlap, max_tokens // 2)
+    units, total = [], 0   # (text, tokens, starts_line) for the chunk being built
+    new_paragraph = True
+    carried = 0            # leading units copied from the previous chunk
+
+    def flush():
+        parts = []
+        for i, (unit, _, starts_line) in enumerate(units):
+            if i and starts_line:
+                parts.append('\n')
+            elif i:
+                parts.append(' ')
+            parts.append(unit)
+        return ''.join(parts).strip()
+
+    for raw in split_units(text):
+        if not raw:
+            new_paragraph = True
+            continue
+        raw_tokens = counter.count(raw)
+        pieces = [(raw, raw_tokens)] if raw_tokens <= max_tokens else _split_oversized(raw, max_tokens, counter)
+        for unit, tokens in pieces:
+            if units and total + tokens > max_tokens:
+                if len(units) > carried:
+                    yield flush()
+                # Carry whole trailing units as overlap into the next chunk
+                tail, tail_tokens = [], 0
+                for item in reversed(units):
+                    if tail_tokens + item[1] > overlap or tail_tokens + item[1] + tokens > max_tokens:
+                        break
+                    tail.append(item)
+                    tail_tokens += item[1]
+                units, total = tail[::-1], tail_tokens
+                carried = len(units)
+            units.append((unit, tokens, new_paragraph or _is_structural(unit)))
+            total += tokens
+            new_paragraph = False
+    if len(units) > carried:
+        yield flush()
+
+def chunk_text(text, max_tokens=CHUNK_TOKENS, overlap=CHUNK_OVERLAP, tokenizer=None):
+    """Split text into chunks of at most max_tokens model tokens."""
+    return list(iter_chunks(text, max_tokens, overlap, tokenizer))
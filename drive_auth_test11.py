@@ -1,12 +1,35 @@
 import os
-import io
-import pandas as pd
-from PyPDF2 import PdfReader
-from pptx import Presentation
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from googleapiclient.http import MediaIoBaseDownload
 from googleapiclient.discovery import build
 from oauth2client.service_account import ServiceAccountCredentials
 
+from acl_index import PERMISSION_FIELDS
+from extractors import ExtractionPool, HashingWriter
+
+FILE_FIELDS = f"id, name, mimeType, modifiedTime, md5Checksum, {PERMISSION_FIELDS}"
+GOOGLE_DOC_MIME = 'application/vnd.google-apps.document'
+SUPPORTED_MIME_TYPES = (
+    'application/pdf',
+    GOOGLE_DOC_MIME,
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+)
+DOWNLOAD_DIR = 'downloaded_files'
+DOWNLOAD_WORKERS = int(os.environ.get('DRIVE_DOWNLOAD_WORKERS', 8))
+DOWNLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+# Files downloaded, and files extracted, ahead of whoever consumes iter_documents()
+PIPELINE_DEPTH = int(os.environ.get('INGEST_PIPELINE_DEPTH', 32))
+MAX_RETRIES = 5
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
+
 def authenticate_drive():
     scope = ['https://www.googleapis.com/auth/drive.readonly']
     creds = ServiceAccountCredentials.from_json_keyfile_name(
@@ -16,114 +39,165 @@ def authenticate_drive():
     service = build('drive', 'v3', credentials=creds)
     return service
 
-def extract_text_from_pptx(local_path):
-    try:
-        prs = Presentation(local_path)
-        slide_texts = []
-        for slide in prs.slides:
-            for shape in slide.shapes:
-                if hasattr(shape, "text") and shape.text:
-                    slide_texts.append(shape.text)
-        return '\n'.join(slide_texts)
-    except Exception as e:
-        print(f"⚠️ Could not extract PPTX text from {local_path}: {e}")
-        return ""
-
-def fetch_documents(authenticate_drive):
-    service = authenticate_drive()
-    docs, sources, file_ids, file_paths = [], [], [], []
-    os.makedirs('downloaded_files', exist_ok=True)
-
-    def process_file(file, folder_name):
-        file_id = file['id']
-        file_name = file['name']
-        mime_type = file['mimeType']
-        source_label = f"{folder_name} / {file_name}"
-        text = ""
-        local_path = None
+def _is_retryable(error):
+    status = getattr(getattr(error, 'resp', None), 'status', None)
+    if status is None:
+        return isinstance(error, (ConnectionError, TimeoutError))
+    status = int(status)
+    if status in RETRY_STATUSES:
+        return True
+    # Drive reports quota exhaustion as 403 with a rate-limit reason
+    return status == 403 and any(reason in str(error) for reason in RATE_LIMIT_REASONS)
 
+def with_retries(call, retries=MAX_RETRIES):
+    """Run ``call()`` retrying rate-limit and transient errors with exponential backoff."""
+    for attempt in range(retries + 1):
         try:
-            if mime_type == 'application/pdf':
-                request = service.files().get_media(fileId=file_id)
-                fh = io.BytesIO()
-                downloader = MediaIoBaseDownload(fh, request)
-                while not downloader.next_chunk()[1]:
-                    pass
-                fh.seek(0)
-                local_path = os.path.join('downloaded_files', file_name)
-                with open(local_path, 'wb') as f:
-                    f.write(fh.read())
-                fh.seek(0)
-                reader = PdfReader(fh)
-                for page in reader.pages:
-                    text += page.extract_text() or ""
-
-            elif mime_type == 'application/vnd.google-apps.document':
-                request = service.files().export(fileId=file_id, mimeType='text/plain')
-                fh = io.BytesIO()
-                downloader = MediaIoBaseDownload(fh, request)
-                while not downloader.next_chunk()[1]:
-                    pass
-                fh.seek(0)
-                text = fh.read().decode('utf-8')
-
-            elif mime_type in [
-                'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-                'application/vnd.openxmlformats-officedocument.presentationml.presentation',
-                'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-            ]:
-                request = service.files().get_media(fileId=file_id)
-                fh = io.BytesIO()
-                downloader = MediaIoBaseDownload(fh, request)
-                while not downloader.next_chunk()[1]:
-                    pass
-                fh.seek(0)
-                local_path = os.path.join('downloaded_files', file_name)
-                with open(local_path, 'wb') as f:
-                    f.write(fh.read())
-
-                if mime_type.endswith('spreadsheetml.sheet'):
-                    try:
-                        xls = pd.read_excel(local_path, sheet_name=None)
-                        text = '\n'.join(
-                            ' '.join(df.fillna('').astype(str).values.flatten())
-                            for df in xls.values()
-                        )
-                    except Exception as e:
-                        print(f"⚠️ Excel read error: {file_name} — {e}")
-                elif mime_type.endswith('presentationml.presentation'):
-                    text = extract_text_from_pptx(local_path)
-
-            else:
-                print(f"⚠️ Skipping unsupported type: {mime_type} ({file_name})")
-                return
-
-            if text.strip() or local_path:
-                docs.append(text)
-                sources.append(source_label)
-                file_ids.append(file_id)
-                file_paths.append(local_path)
-
+            return call()
         except Exception as e:
-            print(f"❌ Error processing {source_label}: {e}")
+            if attempt == retries or not _is_retryable(e):
+                raise
+            time.sleep(min(32, 2 ** attempt) + random.random())
+
+def list_all(service, **kwargs):
+    """Every page of a files().list query, following nextPageToken."""
+    files, page_token = [], None
+    fields = kwargs.pop('fields')
+    while True:
+        response = with_retries(lambda: service.files().list(
+            pageToken=page_token,
+            pageSize=1000,
+            fields=f"nextPageToken, {fields}",
+            **kwargs,
+        ).execute())
+        files.extend(response.get('files', []))
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            return files
 
-    # Process files in root
-    root_files = service.files().list(
-        q="'root' in parents and trashed = false",
-        fields="files(id, name, mimeType)"
-    ).execute().get('files', [])
+def list_drive_files(service):
+    """Metadata-only listing of every candidate file as (file, folder_name) pairs."""
+    listing = []
+    root_files = list_all(service, q="'root' in parents and trashed = false", fields=f"files({FILE_FIELDS})")
     for file in root_files:
-        process_file(file, "Root")
+        listing.append((file, "Root"))
 
-    # Process folders
     folder_query = "mimeType = 'application/vnd.google-apps.folder' and trashed = false"
-    folders = service.files().list(q=folder_query, fields="files(id, name)").execute().get('files', [])
+    folders = list_all(service, q=folder_query, fields="files(id, name)")
     for folder in folders:
         folder_id = folder['id']
         folder_name = folder['name']
         file_query = f"'{folder_id}' in parents and trashed = false"
-        files = service.files().list(q=file_query, fields="files(id, name, mimeType)").execute().get('files', [])
-        for file in files:
-            process_file(file, folder_name)
+        for file in list_all(service, q=file_query, fields=f"files({FILE_FIELDS})"):
+            listing.append((file, folder_name))
+    return listing
+
+def _download(request, fh, downloader_cls):
+    downloader = downloader_cls(fh, request, chunksize=DOWNLOAD_CHUNK_SIZE)
+    done = False
+    while not done:
+        _, done = downloader.next_chunk(num_retries=MAX_RETRIES)
+
+def download_to_file(request_factory, local_path, downloader_cls=MediaIoBaseDownload):
+    """Stream a media request straight to disk, restarting the file on retryable errors.
+    Returns the SHA-256 of the content, computed while writing."""
+    def attempt():
+        with open(local_path, 'wb') as fh:
+            writer = HashingWriter(fh)
+            _download(request_factory(), writer, downloader_cls)
+            return writer.hexdigest()
+    return with_retries(attempt)
 
+def download_file(service, file, folder_name, downloader_cls=MediaIoBaseDownload):
+    """Download one file to disk. Returns (source, file_id, mime_type, local_path, sha256) or None."""
+    file_id = file['id']
+    file_name = file['name']
+    mime_type = file['mimeType']
+    source_label = f"{folder_name} / {file_name}"
+
+    if mime_type not in SUPPORTED_MIME_TYPES:
+        print(f"⚠️ Skipping unsupported type: {mime_type} ({file_name})")
+        return None
+
+    # Prefix with the ID: the same file name can exist in several folders
+    local_path = os.path.join(DOWNLOAD_DIR, f"{file_id}_{file_name}")
+    try:
+        if mime_type == GOOGLE_DOC_MIME:
+            local_path += '.txt'
+            request_factory = lambda: service.files().export(fileId=file_id, mimeType='text/plain')
+        else:
+            request_factory = lambda: service.files().get_media(fileId=file_id)
+        content_hash = download_to_file(request_factory, local_path, downloader_cls)
+    except Exception as e:
+        print(f"❌ Error downloading {source_label}: {e}")
+        return None
+    return source_label, file_id, mime_type, local_path, content_hash
+
+def iter_documents(authenticate_drive, listing=None, max_workers=DOWNLOAD_WORKERS,
+                   downloader_cls=MediaIoBaseDownload, depth=PIPELINE_DEPTH):
+    """Download and extract ``listing`` (default: everything in the Drive),
+    yielding ``(text, source, file_id, local_path)`` in listing order.
+    Files that fail to download or extract are left out, so the caller
+    does not record them and the next run retries them; a file that was
+    extracted but holds no text is yielded with its empty text.
+
+    Files are fetched by a bounded thread pool. ``authenticate_drive`` is
+    called once per worker thread because Drive service objects are not
+    thread-safe; pass a factory returning a fake service to run offline.
+    Each finished download is handed straight to the ExtractionPool, which
+    parses it in a separate process unless its content hash is cached. At
+    most ``depth`` downloads and ``depth`` extractions are in flight, so only
+    that many documents' text is held while the consumer catches up.
+    """
+    if listing is None:
+        listing = list_drive_files(authenticate_drive())
+    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+
+    local = threading.local()
+
+    def worker(item):
+        if not hasattr(local, 'service'):
+            local.service = authenticate_drive()
+        file, folder_name = item
+        return download_file(local.service, file, folder_name, downloader_cls)
+
+    with ExtractionPool() as extraction, ThreadPoolExecutor(max_workers=max_workers) as pool:
+        items = iter(listing)
+        downloads = deque(pool.submit(worker, item) for item in islice(items, depth))
+        extracting = deque()
+        while downloads or extracting:
+            # Hand finished downloads to extraction, oldest first; only wait for
+            # one when there is nothing extracted to yield in the meantime
+            while downloads and len(extracting) < depth and (downloads[0].done() or not extracting):
+                downloaded = downloads.popleft().result()
+                downloads.extend(pool.submit(worker, item) for item in islice(items, 1))
+                if downloaded is None:
+                    continue
+                source_label, file_id, mime_type, local_path, content_hash = downloaded
+                extracting.append((extraction.submit(mime_type, local_path, content_hash), downloaded))
+            if not extracting:
+                continue
+            text_result, (source_label, file_id, mime_type, local_path, _) = extracting.popleft()
+            text = text_result()
+            if text is not None:
+                yield text, source_label, file_id, local_path
+        print(f"   Extracted {extraction.extracted} files, {extraction.cache_hits} from text cache, "
+              f"{extraction.failed} failed")
+
+def fetch_documents(authenticate_drive, listing=None, max_workers=DOWNLOAD_WORKERS,
+                    downloader_cls=MediaIoBaseDownload):
+    """iter_documents() collected into ``(docs, sources, file_ids, file_paths)`` lists,
+    leaving out empty Google Docs."""
+    if listing is None:
+        listing = list_drive_files(authenticate_drive())
+    google_docs = {file['id'] for file, _ in listing if file['mimeType'] == GOOGLE_DOC_MIME}
+    docs, sources, file_ids, file_paths = [], [], [], []
+    for text, source_label, file_id, local_path in iter_documents(authenticate_drive, listing, max_workers,
+                                                                  downloader_cls):
+        if file_id in google_docs and not text.strip():
+            continue
+        docs.append(text)
+        sources.append(source_label)
+        file_ids.append(file_id)
+        file_paths.append(local_path)
     return docs, sources, file_ids, file_paths
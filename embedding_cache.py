@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+
+EMBEDDING_CACHE_DIR = os.path.join('data', 'embedding_cache')
+ENCODE_BATCH_SIZE = 64
+
+def text_key(text):
+    """16-byte digest identifying a chunk's exact text."""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+def _append_file(path, data):
+    with open(path, 'ab') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+class EmbeddingCache:
+    """Persistent (model name, chunk text hash) -> embedding store.
+
+    Stored per model as two append-only files: 16-byte text digests
+    (``.keys.bin``) and the matching raw float32 rows (``.vectors.f32``), which
+    are memory-mapped rather than read into memory. save() appends only the
+    rows added since the last save, so ingestion can checkpoint it often.
+    Only chunks missing from the cache are sent to the model, deduplicated
+    and sorted by length so each batch pads little.
+    """
+
+    def __init__(self, model_name, cache_dir=EMBEDDING_CACHE_DIR):
+        self.model_name = model_name
+        safe_name = re.sub(r'[^A-Za-z0-9_.-]+', '_', model_name)
+        base = os.path.join(cache_dir, safe_name)
+        self.keys_path = f"{base}.keys.bin"
+        self.vectors_path = f"{base}.vectors.f32"
+        self.meta_path = f"{base}.json"
+        self.hits = 0
+        self.misses = 0
+        self.encoded = 0
+        self.dim = None
+        self._row = {}
+        self._stored = None         # memory-mapped rows already on disk
+        self._saved = 0
+        self._fresh = None          # rows added since the last save, with spare capacity
+        self._fresh_keys = []
+        self._open()
+        if not self._saved:
+            self._import_npy(f"{base}.keys.npy", f"{base}.vectors.npy")
+
+    def _open(self):
+        try:
+            with open(self.meta_path) as f:
+                self.dim = json.load(f)['dim']
+            keys = np.fromfile(self.keys_path, dtype='uint8')
+            rows = min(len(keys) // 16, os.path.getsize(self.vectors_path) // (4 * self.dim))
+        except (OSError, ValueError, KeyError):
+            return
+        # A save interrupted between the two appends leaves a tail that is cut off here
+        for path, size in ((self.keys_path, rows * 16), (self.vectors_path, rows * 4 * self.dim)):
+            if os.path.getsize(path) != size:
+                os.truncate(path, size)
+        self._row = {key.tobytes(): i for i, key in enumerate(keys[:rows * 16].reshape(-1, 16))}
+        self._saved = rows
+        self._stored = np.memmap(self.vectors_path, dtype='float32', mode='r', shape=(rows, self.dim)) if rows else None
+
+    def _import_npy(self, keys_path, vectors_path):
+        """Carry over a cache saved as .npy files by earlier versions."""
+        try:
+            keys, vectors = np.load(keys_path), np.load(vectors_path, mmap_mode='r')
+        except (OSError, ValueError):
+            return
+        if len(keys) == len(vectors) and len(keys):
+            self._append([key.tobytes() for key in keys], np.asarray(vectors, dtype='float32'))
+            self.save()
+        for path in (keys_path, vectors_path):
+            os.remove(path)
+
+    def __len__(self):
+        return len(self._row)
+
+    def encode(self, texts, load_model, batch_size=ENCODE_BATCH_SIZE, progress=True):
+        """Embeddings for ``texts``; ``load_model()`` is only called if something is missing."""
+        keys = [text_key(text) for text in texts]
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key in self._row:
+                self.hits += 1
+            else:
+                self.misses += 1
+                missing.setdefault(key, text)
+
+        if missing:
+            order = sorted(missing, key=lambda key: len(missing[key]))
+            model = load_model()
+            vectors = model.encode([missing[key] for key in order], batch_size=batch_size,
+                                   show_progress_bar=progress and len(order) > batch_size).astype('float32')
+            self._append(order, vectors)
+            self.encoded += len(order)
+
+        if not keys:
+            return np.zeros((0, self.dim or 0), dtype='float32')
+        rows = np.fromiter((self._row[key] for key in keys), dtype='int64', count=len(keys))
+        return self._lookup(rows)
+
+    def _lookup(self, rows):
+        vectors = np.empty((len(rows), self.dim), dtype='float32')
+        stored = rows < self._saved
+        if stored.any():
+            vectors[stored] = self._stored[rows[stored]]
+        if not stored.all():
+            vectors[~stored] = self._fresh[rows[~stored] - self._saved]
+        return vectors
+
+    def _append(self, keys, vectors):
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        fresh = len(self._fresh_keys)
+        if self._fresh is None or fresh + len(vectors) > len(self._fresh):
+            # Grown geometrically so a long ingest does not copy the new rows over and over
+            grown = np.empty((max(2 * (fresh + len(vectors)), 1024), self.dim), dtype='float32')
+            if fresh:
+                grown[:fresh] = self._fresh[:fresh]
+            self._fresh = grown
+        self._fresh[fresh:fresh + len(vectors)] = vectors
+        for i, key in enumerate(keys, self._saved + fresh):
+            self._row[key] = i
+        self._fresh_keys.extend(keys)
+
+    def save(self):
+        """Append the rows added since the last save; vectors are written before their keys."""
+        fresh = len(self._fresh_keys)
+        if not fresh:
+            return
+        os.makedirs(os.path.dirname(self.keys_path), exist_ok=True)
+        if not os.path.exists(self.meta_path):
+            with open(self.meta_path + '.tmp', 'w') as f:
+                json.dump({'dim': self.dim}, f)
+            os.replace(self.meta_path + '.tmp', self.meta_path)
+        _append_file(self.vectors_path, self._fresh[:fresh].tobytes())
+        _append_file(self.keys_path, b''.join(self._fresh_keys))
+        self._saved += fresh
+        self._stored = np.memmap(self.vectors_path, dtype='float32', mode='r', shape=(self._saved, self.dim))
+        self._fresh, self._fresh_keys = None, []
+
+    def stats_line(self):
+        total = self.hits + self.misses
+        rate = 100 * self.hits / total if total else 0.0
+        return (f"Embedding cache: {self.hits} hits / {self.misses} misses ({rate:.1f}% hit rate), "
+                f"{self.encoded} chunks encoded, {len(self)} cached for {self.model_name}")
@@ -0,0 +1,328 @@
+"""Selectable sentence encoder backends for all-MiniLM-L6-v2.
+
+    ENCODER_BACKEND=torch        SentenceTransformer in eager PyTorch (default)
+    ENCODER_BACKEND=onnx         ONNX Runtime, fp32
+    ENCODER_BACKEND=onnx-int8    ONNX Runtime with int8 dynamic quantization
+    ENCODER_THREADS=4            intra-op threads (default: the runtime's choice)
+    ENCODE_WORKERS=2             encoder processes used by ingestion (default: half the cores, at most 4)
+
+The ONNX models are exported once into data/onnx/ on first use. Before a
+backend is used against embeddings produced by another one, check that it
+agrees with them:
+
+    python encoders.py validate --backend onnx-int8
+    python encoders.py export --backend onnx-int8
+
+A backend that passes is recorded in data/encoder_validation.json and then
+shares the existing embeddings, snapshot and embedding cache. One that has
+not passed gets its own embedding space, so the next ingest re-embeds
+everything with it and the search engine will not mix it with older vectors.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+MODEL_NAME = 'all-MiniLM-L6-v2'
+HF_MODEL_ID = f"sentence-transformers/{MODEL_NAME}"
+BACKENDS = ('torch', 'onnx', 'onnx-int8')
+ENCODER_BACKEND = os.environ.get('ENCODER_BACKEND', 'torch').lower()
+ENCODER_THREADS = int(os.environ.get('ENCODER_THREADS', 0))
+ENCODE_WORKERS = int(os.environ.get('ENCODE_WORKERS', max(1, min(4, (os.cpu_count() or 2) // 2))))
+ONNX_DIR = os.path.join('data', 'onnx')
+VALIDATION_PATH = os.path.join('data', 'encoder_validation.json')
+MAX_SEQ_LENGTH = 256
+# Embeddings from two backends are interchangeable when the 5th percentile
+# cosine between them is at least this
+AGREEMENT_TOLERANCE = 0.98
+
+def _check_backend(backend):
+    if backend not in BACKENDS:
+        raise ValueError(f"ENCODER_BACKEND must be one of {BACKENDS}, got {backend!r}")
+
+class TorchEncoder:
+    """The SentenceTransformer model as shipped."""
+
+    backend = 'torch'
+
+    def __init__(self, model_name=MODEL_NAME, threads=ENCODER_THREADS):
+        from sentence_transformers import SentenceTransformer
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        self.model = SentenceTransformer(model_name)
+
+    def encode(self, texts, batch_size=64, show_progress_bar=False, **kwargs):
+        return self.model.encode(texts, batch_size=batch_size, show_progress_bar=show_progress_bar, **kwargs)
+
+    def get_sentence_embedding_dimension(self):
+        return self.model.get_sentence_embedding_dimension()
+
+    def nbytes(self):
+        return sum(p.numel() * p.element_size() for p in self.model.parameters())
+
+def _onnx_paths(model_name):
+    directory = os.path.join(ONNX_DIR, model_name)
+    return directory, os.path.join(directory, 'model.onnx'), os.path.join(directory, 'model.int8.onnx')
+
+def export_onnx(model_name=MODEL_NAME, quantize=True):
+    """Export the transformer to ONNX (and an int8 copy) unless already done. Returns the model path."""
+    directory, fp32_path, int8_path = _onnx_paths(model_name)
+    if not os.path.exists(fp32_path):
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+        os.makedirs(directory, exist_ok=True)
+        tokenizer = AutoTokenizer.from_pretrained(HF_MODEL_ID)
+        model = AutoModel.from_pretrained(HF_MODEL_ID).eval()
+        sample = tokenizer(["an example sentence"], return_tensors='pt')
+        names = ['input_ids', 'attention_mask', 'token_type_ids']
+        axes = {name: {0: 'batch', 1: 'sequence'} for name in names}
+        axes['last_hidden_state'] = {0: 'batch', 1: 'sequence'}
+        with torch.no_grad():
+            torch.onnx.export(model, tuple(sample[name] for name in names), fp32_path + '.tmp',
+                              input_names=names, output_names=['last_hidden_state'],
+                              dynamic_axes=axes, opset_version=14)
+        os.replace(fp32_path + '.tmp', fp32_path)
+        tokenizer.save_pretrained(directory)
+        print(f"✅ Exported {HF_MODEL_ID} to {fp32_path}")
+    if quantize and not os.path.exists(int8_path):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(fp32_path, int8_path + '.tmp', weight_type=QuantType.QInt8)
+        os.replace(int8_path + '.tmp', int8_path)
+        print(f"✅ Quantized to {int8_path}")
+    return int8_path if quantize else fp32_path
+
+class OnnxEncoder:
+    """Transformer in ONNX Runtime plus the model's mean pooling and L2 normalisation in numpy."""
+
+    def __init__(self, model_name=MODEL_NAME, quantize=True, threads=ENCODER_THREADS):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+        self.backend = 'onnx-int8' if quantize else 'onnx'
+        self.path = export_onnx(model_name, quantize)
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(self.path, options, providers=['CPUExecutionProvider'])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(os.path.dirname(self.path))
+        self.dim = self.session.get_outputs()[0].shape[-1]
+
+    def encode(self, texts, batch_size=64, show_progress_bar=False, **kwargs):
+        if isinstance(texts, str):
+            texts = [texts]
+        out = np.empty((len(texts), self.dim), dtype='float32')
+        # Length-sorted batches pad less
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        for start in range(0, len(order), batch_size):
+            rows = order[start:start + batch_size]
+            tokens = self.tokenizer([texts[i] for i in rows], padding=True, truncation=True,
+                                    max_length=MAX_SEQ_LENGTH, return_tensors='np')
+            feed = {name: tokens[name].astype('int64') for name in self.input_names}
+            hidden = self.session.run(None, feed)[0]
+            mask = tokens['attention_mask'][..., None].astype('float32')
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            out[rows] = pooled
+        return out
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def nbytes(self):
+        return os.path.getsize(self.path)
+
+def load_encoder(model_name=MODEL_NAME, backend=None, threads=None):
+    backend = (backend or ENCODER_BACKEND).lower()
+    threads = ENCODER_THREADS if threads is None else threads
+    _check_backend(backend)
+    if backend == 'torch':
+        return TorchEncoder(model_name, threads)
+    return OnnxEncoder(model_name, quantize=backend == 'onnx-int8', threads=threads)
+
+def encoder_nbytes(encoder):
+    nbytes = getattr(encoder, 'nbytes', None)
+    return nbytes() if nbytes else 0
+
+_worker_encoder = None
+
+def _init_encode_worker(model_name, backend, threads):
+    global _worker_encoder
+    _worker_encoder = load_encoder(model_name, backend, threads)
+
+def _encode_in_worker(texts, batch_size):
+    return np.asarray(_worker_encoder.encode(texts, batch_size=batch_size), dtype='float32')
+
+class EncoderPool:
+    """``workers`` processes that each load the encoder once; encode() splits
+    the texts between them and keeps their order. Use as a context manager.
+
+    Workers are spawned, not forked, so none inherits the parent's threads or
+    tokenizer state, and the cores are split between them unless ``threads``
+    is given.
+    """
+
+    def __init__(self, model_name=MODEL_NAME, backend=None, workers=ENCODE_WORKERS, threads=None):
+        self.workers = workers
+        threads = threads or ENCODER_THREADS or max(1, (os.cpu_count() or 1) // workers)
+        self._pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                         initializer=_init_encode_worker,
+                                         initargs=(model_name, backend or ENCODER_BACKEND, threads))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+    def encode(self, texts, batch_size=64, show_progress_bar=False, **kwargs):
+        # A few batches per task: small enough to spread, large enough to amortise the pickling
+        step = batch_size * 4
+        parts = [texts[start:start + step] for start in range(0, len(texts), step)]
+        vectors = list(self._pool.map(_encode_in_worker, parts, [batch_size] * len(parts)))
+        return np.concatenate(vectors) if vectors else np.zeros((0, 0), dtype='float32')
+
+def load_validations(path=VALIDATION_PATH):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def embedding_space(model_name=MODEL_NAME, backend=None, path=VALIDATION_PATH):
+    """Name of the vector space a backend's embeddings live in.
+
+    The reference (torch) backend and every backend validated against it share
+    ``model_name``; anything else is kept apart so vectors are never mixed.
+    """
+    backend = (backend or ENCODER_BACKEND).lower()
+    _check_backend(backend)
+    if backend == 'torch':
+        return model_name
+    record = load_validations(path).get(f"{model_name}:{backend}")
+    if record and record.get('passed'):
+        return model_name
+    return f"{model_name}@{backend}"
+
+def backend_for_space(space, model_name=MODEL_NAME):
+    """The backend whose queries match vectors in ``space``."""
+    if space.startswith(f"{model_name}@"):
+        return space.split('@', 1)[1]
+    if embedding_space(model_name) == model_name:
+        return ENCODER_BACKEND
+    return 'torch'
+
+def agreement(candidate, reference):
+    """Cosine statistics between two (n, dim) embedding matrices, row by row."""
+    a = candidate / np.linalg.norm(candidate, axis=1, keepdims=True)
+    b = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    cosines = np.einsum('ij,ij->i', a, b)
+    return {
+        'mean': float(cosines.mean()),
+        'p5': float(np.percentile(cosines, 5)),
+        'min': float(cosines.min()),
+    }
+
+def _cosine_top_k(corpus, queries, k, block=65536):
+    """Top-k rows of ``corpus`` by cosine, read in blocks so a mapped corpus is never loaded whole."""
+    queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    scores, ids = [], []
+    for start in range(0, len(corpus), block):
+        rows = np.asarray(corpus[start:start + block], dtype='float32')
+        rows = rows / np.clip(np.linalg.norm(rows, axis=1, keepdims=True), 1e-12, None)
+        block_scores = queries @ rows.T
+        kk = min(k, rows.shape[0])
+        top = np.argpartition(-block_scores, kk - 1, axis=1)[:, :kk]
+        scores.append(np.take_along_axis(block_scores, top, axis=1))
+        ids.append(top + start)
+    scores, ids = np.hstack(scores), np.hstack(ids)
+    order = np.argsort(-scores, axis=1)[:, :k]
+    return np.take_along_axis(ids, order, axis=1)
+
+def neighbour_overlap(corpus, reference_queries, candidate_queries, k=10):
+    """How much of the top-k over ``corpus`` survives swapping the query encoder."""
+    truth = _cosine_top_k(corpus, reference_queries, k)
+    found = _cosine_top_k(corpus, candidate_queries, k)
+    return float(np.mean([len(set(t) & set(f)) / len(t) for t, f in zip(truth, found)]))
+
+def validate(backend, samples=500, tolerance=AGREEMENT_TOLERANCE, model_name=MODEL_NAME, data_dir='data',
+             seed=0):
+    """Encode sampled chunks of the current snapshot with ``backend`` and with the
+    reference (torch) backend, both to float32, and compare the two.
+
+    The stored vectors are not compared directly: float16/int8 storage would
+    count as disagreement. They only serve as the corpus for the top-10
+    overlap, so the snapshot must hold ``model_name`` embeddings.
+    """
+    from snapshot import open_current
+    snapshot = open_current(data_dir)
+    if snapshot is None or not len(snapshot):
+        raise RuntimeError("no snapshot to validate against; run update_embeddings.py first")
+    space = snapshot.meta.get('embedding_space', MODEL_NAME)
+    if space != model_name:
+        raise RuntimeError(f"the current snapshot holds {space} embeddings, not {model_name}; "
+                           f"re-ingest with the reference encoder before validating")
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(len(snapshot), size=min(samples, len(snapshot)), replace=False))
+    texts = list(snapshot.iter_chunk_texts(rows))
+
+    reference = np.asarray(load_encoder(model_name, 'torch').encode(texts), dtype='float32')
+    encoder = load_encoder(model_name, backend)
+    start = time.perf_counter()
+    encoded = np.asarray(encoder.encode(texts), dtype='float32')
+    seconds = time.perf_counter() - start
+    stats = agreement(encoded, reference)
+    stats['overlap@10'] = neighbour_overlap(snapshot.embeddings, reference, encoded)
+    return {
+        'model': model_name,
+        'backend': backend,
+        'reference': 'torch',
+        'snapshot': snapshot.version,
+        'samples': len(rows),
+        'tolerance': tolerance,
+        'passed': stats['p5'] >= tolerance,
+        'ms_per_chunk': round(1000 * seconds / len(rows), 3),
+        'validated_at': time.time(),
+        **{key: round(value, 5) for key, value in stats.items()},
+    }
+
+def save_validation(result, path=VALIDATION_PATH):
+    records = load_validations(path)
+    records[f"{result['model']}:{result['backend']}"] = result
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(records, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=('validate', 'export'))
+    parser.add_argument('--backend', default=ENCODER_BACKEND, choices=BACKENDS)
+    parser.add_argument('--samples', type=int, default=500)
+    parser.add_argument('--tolerance', type=float, default=AGREEMENT_TOLERANCE)
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        if args.backend == 'torch':
+            print("Nothing to export for the torch backend.")
+        else:
+            export_onnx(quantize=args.backend == 'onnx-int8')
+        return
+    result = validate(args.backend, args.samples, args.tolerance)
+    save_validation(result)
+    verdict = "✅ within tolerance, can share the existing embeddings" if result['passed'] else \
+        "❌ outside tolerance, the next ingest will re-embed everything with this backend"
+    print(f"{args.backend}: cosine mean {result['mean']:.4f}, p5 {result['p5']:.4f}, min {result['min']:.4f}, "
+          f"top-10 overlap {result['overlap@10']:.1%}, {result['ms_per_chunk']:.2f} ms/chunk")
+    print(verdict)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+import hashlib
+import os
+import signal
+from concurrent.futures import CancelledError, ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from docx import Document
+from openpyxl import load_workbook
+from pptx import Presentation
+from PyPDF2 import PdfReader
+
+TEXT_CACHE_DIR = os.path.join('data', 'text_cache')
+EXTRACT_WORKERS = int(os.environ.get('EXTRACT_WORKERS', os.cpu_count() or 2))
+EXTRACT_TIMEOUT = int(os.environ.get('EXTRACT_TIMEOUT', 120))
+# Bump when an extractor changes so cached text is re-extracted
+EXTRACTOR_VERSION = 2
+
+def extract_text_plain(local_path):
+    with open(local_path, encoding='utf-8', errors='replace') as f:
+        return f.read()
+
+def extract_text_pdf(local_path):
+    reader = PdfReader(local_path)
+    return "".join(page.extract_text() or "" for page in reader.pages)
+
+def extract_text_docx(local_path):
+    """Extract all text from a .docx file."""
+    doc = Document(local_path)
+    return "\n".join([para.text for para in doc.paragraphs])
+
+def extract_text_pptx(local_path):
+    """Extract all text from a .pptx file."""
+    prs = Presentation(local_path)
+    texts = []
+    for slide in prs.slides:
+        for shape in slide.shapes:
+            if hasattr(shape, "text") and shape.text:
+                texts.append(shape.text)
+    return "\n".join(texts)
+
+def extract_text_xlsx(local_path):
+    """One tab-separated line per non-empty row, streamed so whole sheets are never held as DataFrames."""
+    workbook = load_workbook(local_path, read_only=True, data_only=True)
+    try:
+        lines = []
+        for sheet in workbook.worksheets:
+            for row in sheet.iter_rows(values_only=True):
+                cells = [str(value) for value in row if value is not None and str(value).strip()]
+                if cells:
+                    lines.append('\t'.join(cells))
+        return '\n'.join(lines)
+    finally:
+        workbook.close()
+
+# One extractor per Drive MIME type; Google Docs are exported to plain text first
+EXTRACTORS = {
+    'application/pdf': extract_text_pdf,
+    'application/vnd.google-apps.document': extract_text_plain,
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document': extract_text_docx,
+    'application/vnd.openxmlformats-officedocument.presentationml.presentation': extract_text_pptx,
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet': extract_text_xlsx,
+}
+
+class HashingWriter:
+    """File-like wrapper that hashes bytes as they are written, so downloads
+    get a content hash without being read back."""
+
+    def __init__(self, fh):
+        self.fh = fh
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.sha256.update(data)
+        return self.fh.write(data)
+
+    def hexdigest(self):
+        return self.sha256.hexdigest()
+
+def _cache_path(content_hash, cache_dir):
+    return os.path.join(cache_dir, f"{content_hash}-v{EXTRACTOR_VERSION}.txt")
+
+def read_cached_text(content_hash, cache_dir=TEXT_CACHE_DIR):
+    if not content_hash:
+        return None
+    try:
+        with open(_cache_path(content_hash, cache_dir), encoding='utf-8') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+def write_cached_text(content_hash, text, cache_dir=TEXT_CACHE_DIR):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = _cache_path(content_hash, cache_dir)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(path + '.tmp', path)
+
+def _on_alarm(signum, frame):
+    raise TimeoutError("extraction timed out")
+
+def _extract_worker(mime_type, local_path, timeout):
+    # SIGALRM interrupts the pure-Python parsers; the parent also waits with a timeout
+    use_alarm = hasattr(signal, 'SIGALRM')
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _on_alarm)
+        signal.alarm(timeout)
+    try:
+        return EXTRACTORS[mime_type](local_path)
+    finally:
+        if use_alarm:
+            signal.alarm(0)
+
+def _terminate(pool):
+    # ProcessPoolExecutor cannot cancel a running task; terminating its
+    # processes is the only way to stop one
+    for process in list((pool._processes or {}).values()):
+        process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+class ExtractionPool:
+    """Process pool for CPU-bound text extraction with per-file timeouts and a
+    content-hash text cache. Use as a context manager.
+
+    A worker stuck outside Python code (where SIGALRM cannot interrupt it)
+    is killed when the outer timeout expires: the whole pool is replaced,
+    and extractions the other workers were running are resubmitted once.
+    """
+
+    def __init__(self, max_workers=EXTRACT_WORKERS, timeout=EXTRACT_TIMEOUT, cache_dir=TEXT_CACHE_DIR):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.cache_dir = cache_dir
+        self.cache_hits = 0
+        self.extracted = 0
+        self.failed = 0
+        self.recycled = 0
+        self._pool = ProcessPoolExecutor(max_workers=max_workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+        else:
+            # Nothing will collect the results, and a stuck worker must not hold up the error
+            _terminate(self._pool)
+
+    def _recycle(self, pool):
+        """Kill ``pool``'s workers and start a fresh pool, unless that already happened."""
+        if pool is self._pool:
+            _terminate(pool)
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+            self.recycled += 1
+
+    def submit(self, mime_type, local_path, content_hash=None):
+        """Returns a zero-argument callable that yields the text, or None if extraction failed."""
+        cached = read_cached_text(content_hash, self.cache_dir)
+        if cached is not None:
+            self.cache_hits += 1
+            return lambda: cached
+        pool = self._pool
+        future = pool.submit(_extract_worker, mime_type, local_path, self.timeout)
+
+        def result():
+            nonlocal pool, future
+            try:
+                try:
+                    # Generous outer bound in case the worker is stuck outside Python code
+                    text = future.result(timeout=self.timeout * 2)
+                except (BrokenProcessPool, CancelledError):
+                    if pool is self._pool:
+                        raise
+                    # Lost when the pool was recycled for another file's timeout
+                    pool = self._pool
+                    future = pool.submit(_extract_worker, mime_type, local_path, self.timeout)
+                    text = future.result(timeout=self.timeout * 2)
+            except (FutureTimeout, TimeoutError):
+                if future.done():
+                    print(f"⏱️ Extraction timed out after {self.timeout}s: {local_path}")
+                else:
+                    print(f"⏱️ Extraction stuck for {self.timeout * 2}s, restarting the workers: {local_path}")
+                    self._recycle(pool)
+                self.failed += 1
+                return None
+            except Exception as e:
+                print(f"⚠️ Could not extract text from {local_path}: {e}")
+                self.failed += 1
+                return None
+            self.extracted += 1
+            if content_hash:
+                write_cached_text(content_hash, text, self.cache_dir)
+            return text
+        return result
@@ -1,6 +1,171 @@
-import faiss
+import json
+import math
+import os
 
-def create_faiss_index(embedding_matrix):
-    index = faiss.IndexFlatL2(embedding_matrix.shape[1])
-    index.add(embedding_matrix)
+import numpy as np
+
+# faiss is imported inside the functions that need it so importing this module
+# (and the search engine) stays cheap until an index is actually loaded.
+
+# Persisted inside each snapshot directory, next to embeddings.f32
+INDEX_FILE = 'faiss.index'
+
+# Index type and recall/latency knobs, overridable from the environment:
+#   FAISS_INDEX=flat|hnsw|ivf_flat|ivf_pq, FAISS_NPROBE, FAISS_EF_SEARCH, ...
+INDEX_KINDS = ('flat', 'hnsw', 'ivf_flat', 'ivf_pq')
+# Rows converted and added at a time, so a memory-mapped matrix is never copied whole
+ADD_BATCH = 65536
+DEFAULT_INDEX_PARAMS = {
+    'hnsw_m': 32,
+    'ef_construction': 80,
+    'ef_search': 64,
+    'nlist': None,      # None -> derived from the corpus size
+    'nprobe': 16,
+    'pq_m': 48,         # sub-quantizers; must divide the embedding dimension
+    'pq_nbits': 8,
+}
+
+def index_config_from_env():
+    kind = os.environ.get('FAISS_INDEX', 'flat').lower()
+    if kind not in INDEX_KINDS:
+        raise ValueError(f"FAISS_INDEX must be one of {INDEX_KINDS}, got {kind!r}")
+    params = dict(DEFAULT_INDEX_PARAMS)
+    for name in params:
+        value = os.environ.get(f"FAISS_{name.upper()}")
+        if value:
+            params[name] = int(value)
+    return kind, params
+
+def _ivf_nlist(n, nlist=None):
+    # ~4*sqrt(n) lists, but keep >= 39 training points per list as faiss recommends
+    if nlist is None:
+        nlist = int(4 * math.sqrt(n))
+    return max(1, min(nlist, n // 39))
+
+def create_faiss_index(embedding_matrix, kind='flat', metric='l2', storage='float32', **params):
+    """Build a ``kind`` index. ``metric`` is l2 or ip (inner product, for normalised
+    vectors); float16/int8 ``storage`` keeps the vectors in a scalar quantizer.
+    ``embedding_matrix`` may be memory-mapped: it is added in ADD_BATCH blocks,
+    and only read whole to train IVF indexes."""
+    import faiss
+    params = {**DEFAULT_INDEX_PARAMS, **params}
+    n, d = embedding_matrix.shape
+    faiss_metric = faiss.METRIC_INNER_PRODUCT if metric == 'ip' else faiss.METRIC_L2
+    qtype = {'float16': faiss.ScalarQuantizer.QT_fp16, 'int8': faiss.ScalarQuantizer.QT_8bit}.get(storage)
+    if kind == 'flat':
+        if qtype is not None:
+            index = faiss.IndexScalarQuantizer(d, qtype, faiss_metric)
+        else:
+            index = faiss.IndexFlatIP(d) if metric == 'ip' else faiss.IndexFlatL2(d)
+    elif kind == 'hnsw':
+        if qtype is not None:
+            index = faiss.IndexHNSWSQ(d, qtype, params['hnsw_m'], faiss_metric)
+        else:
+            index = faiss.IndexHNSWFlat(d, params['hnsw_m'], faiss_metric)
+        index.hnsw.efConstruction = params['ef_construction']
+    elif kind in ('ivf_flat', 'ivf_pq'):
+        nlist = _ivf_nlist(n, params['nlist'])
+        quantizer = faiss.IndexFlatIP(d) if metric == 'ip' else faiss.IndexFlatL2(d)
+        if kind == 'ivf_flat' and qtype is not None:
+            index = faiss.IndexIVFScalarQuantizer(quantizer, d, nlist, qtype, faiss_metric)
+        elif kind == 'ivf_flat':
+            index = faiss.IndexIVFFlat(quantizer, d, nlist, faiss_metric)
+        else:
+            pq_m = params['pq_m'] if d % params['pq_m'] == 0 else d // 8
+            # PQ training wants ~39 points per centroid, i.e. n >= 39 * 2**nbits
+            nbits = max(1, min(params['pq_nbits'], int(math.log2(max(n // 39, 2)))))
+            index = faiss.IndexIVFPQ(quantizer, d, nlist, pq_m, nbits, faiss_metric)
+    else:
+        raise ValueError(f"Unknown index kind {kind!r}; expected one of {INDEX_KINDS}")
+    if not index.is_trained:
+        index.train(np.ascontiguousarray(embedding_matrix[:], dtype='float32'))
+    for start in range(0, n, ADD_BATCH):
+        index.add(np.ascontiguousarray(embedding_matrix[start:start + ADD_BATCH], dtype='float32'))
+    set_search_params(index, nprobe=params['nprobe'], ef_search=params['ef_search'])
+    return index
+
+def set_search_params(index, nprobe=None, ef_search=None):
+    """Apply the query-time recall/latency knobs that make sense for ``index``."""
+    import faiss
+    if nprobe is not None:
+        try:
+            ivf = faiss.extract_index_ivf(index)
+        except RuntimeError:
+            ivf = None
+        if ivf is not None:
+            ivf.nprobe = min(nprobe, ivf.nlist)
+    if ef_search is not None and hasattr(index, 'hnsw'):
+        index.hnsw.efSearch = ef_search
+
+def _search_parameters(index, selector):
+    import faiss
+    if hasattr(index, 'hnsw'):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    try:
+        ivf = faiss.extract_index_ivf(index)
+    except RuntimeError:
+        ivf = None
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    return faiss.SearchParameters(sel=selector)
+
+def search_subset(index, query_embedding, k, ids):
+    """Search only the vectors in ``ids`` (int64 array). Returns None if this
+    faiss build or index type cannot apply an ID selector."""
+    import faiss
+    if hasattr(index, 'search_ids'):
+        return index.search_ids(query_embedding, k, ids)   # a ShardedIndex filters shard by shard
+    if not hasattr(faiss, "SearchParameters"):
+        return None
+    selector = faiss.IDSelectorBatch(ids.size, faiss.swig_ptr(ids))
+    try:
+        params = _search_parameters(index, selector)
+        return index.search(query_embedding, k, params=params)
+    except (TypeError, RuntimeError):
+        return None
+
+def save_faiss_index(index, path, meta):
+    """Write the index and a JSON sidecar describing how and from what it was built."""
+    import faiss
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    faiss.write_index(index, path + '.tmp')
+    os.replace(path + '.tmp', path)
+    with open(path + '.json.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.replace(path + '.json.tmp', path + '.json')
+
+def load_or_create_faiss_index(embedding_matrix, path, data_version=None, kind=None, params=None, metric='l2',
+                               storage='float32'):
+    """Load the persisted index if it matches the data and config, otherwise build and persist it."""
+    import faiss
+    if kind is None:
+        kind, env_params = index_config_from_env()
+        params = {**env_params, **(params or {})}
+    params = {**DEFAULT_INDEX_PARAMS, **(params or {})}
+    build_params = {k: v for k, v in params.items() if k not in ('nprobe', 'ef_search')}
+    meta = {
+        'kind': kind,
+        'params': build_params,
+        'ntotal': int(embedding_matrix.shape[0]),
+        'data_version': data_version,
+    }
+    # Only recorded when not the default, so indexes persisted before these options still match
+    if metric != 'l2':
+        meta['metric'] = metric
+    if storage != 'float32':
+        meta['storage'] = storage
+    try:
+        with open(path + '.json') as f:
+            stored = json.load(f)
+        if stored == meta:
+            index = faiss.read_index(path)
+            set_search_params(index, nprobe=params['nprobe'], ef_search=params['ef_search'])
+            return index
+    except (FileNotFoundError, ValueError, RuntimeError):
+        pass
+    index = create_faiss_index(embedding_matrix, kind, metric, storage, **params)
+    try:
+        save_faiss_index(index, path, meta)
+    except OSError as e:
+        print(f"⚠️ Could not persist FAISS index to {path}: {e}")
     return index
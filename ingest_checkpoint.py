@@ -0,0 +1,96 @@
+import json
+import os
+import time
+
+CHECKPOINT_PATH = os.path.join('data', 'ingest_checkpoint.jsonl')
+CHECKPOINT_SECONDS = int(os.environ.get('INGEST_CHECKPOINT_SECONDS', 60))
+
+class IngestCheckpoint:
+    """Journal of the files an unfinished ingest has already chunked and embedded.
+
+    One JSON line per file: its ID, signature, source label and chunks. The
+    vectors are not repeated here; they are in the EmbeddingCache, which is
+    saved at the same checkpoints, so a run that resumes after a crash takes
+    those files from the journal without downloading, extracting or (usually)
+    encoding them again. An entry whose signature no longer matches the file
+    in Drive is ignored, and the journal is removed once a snapshot is
+    published.
+    """
+
+    def __init__(self, path=CHECKPOINT_PATH, interval=CHECKPOINT_SECONDS):
+        self.path = path
+        self.interval = interval
+        self._entries = {}      # file ID -> (byte offset of its latest line, signature)
+        self._file = None
+        self._last = time.monotonic()
+        self._scan()
+
+    def _scan(self):
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            offset = 0
+            for line in f:
+                try:
+                    entry = json.loads(line) if line.endswith(b'\n') else None
+                except ValueError:
+                    entry = None
+                if entry is None:
+                    break   # a line torn by the crash; everything before it is intact
+                self._entries[entry['id']] = (offset, entry['signature'])
+                offset += len(line)
+        if offset != os.path.getsize(self.path):
+            os.truncate(self.path, offset)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def resumable(self, signatures):
+        """IDs of journaled files whose signature still matches ``signatures``."""
+        return {file_id for file_id, (_, signature) in self._entries.items() if signatures.get(file_id) == signature}
+
+    def replay(self, file_ids):
+        """``(file_id, source, chunks)`` for each of ``file_ids``, read back one at a time."""
+        if not file_ids:
+            return
+        with open(self.path, 'rb') as f:
+            for offset in sorted(self._entries[file_id][0] for file_id in file_ids):
+                f.seek(offset)
+                entry = json.loads(f.readline())
+                yield entry['id'], entry['source'], entry['chunks']
+
+    def record(self, file_id, signature, source, chunks):
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._file = open(self.path, 'ab')
+        line = json.dumps({'id': file_id, 'signature': signature, 'source': source, 'chunks': chunks},
+                          ensure_ascii=False) + '\n'
+        self._entries[file_id] = (self._file.tell(), signature)
+        self._file.write(line.encode('utf-8'))
+
+    def due(self):
+        return time.monotonic() - self._last >= self.interval
+
+    def commit(self):
+        """Make everything recorded so far durable."""
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._last = time.monotonic()
+
+    def close(self):
+        if self._file is not None:
+            self.commit()
+            self._file.close()
+            self._file = None
+
+    def clear(self):
+        """Forget the journal once its files are in a published snapshot."""
+        self.close()
+        self._entries = {}
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
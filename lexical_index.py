@@ -0,0 +1,208 @@
+"""BM25 inverted index over chunk text and source labels, stored with a snapshot.
+
+Each chunk is indexed as its text plus its "Folder / File name" source, so
+keyword, form-number and file-name queries find chunks the embedding ranks
+poorly. Files written next to the snapshot's other columns:
+
+    bm25_terms.json     vocabulary; a term's position is its id
+    bm25_offsets.npy    int64 (terms + 1) start of each term's postings
+    bm25_rows.npy       int32 chunk rows, sorted by term then row
+    bm25_weights.npy    float32 BM25 term-frequency weight of each posting
+    bm25.json           build parameters; written last, marks the index complete
+
+Scoring a query only touches the postings of its terms, and exact-phrase
+filters intersect postings before checking the few candidate chunks'
+text, so neither scans the whole corpus.
+"""
+import json
+import math
+import os
+import re
+from array import array
+from collections import Counter
+
+import numpy as np
+
+META_FILE = 'bm25.json'
+FORMAT_VERSION = 1
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Words, numbers, and joined forms like "hr-104", "w-4" or "policy_v2.pdf"
+_TOKEN_RE = re.compile(r"[^\W_]+(?:[-_./'][^\W_]+)*")
+_WORD_RE = re.compile(r"[^\W_]+")
+
+def tokenize(text):
+    """Lower-cased tokens; joined forms are kept whole and also split into their words."""
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(_WORD_RE.findall(token))
+    return tokens
+
+def _paths(directory):
+    return {name: os.path.join(directory, f"bm25_{name}")
+            for name in ('terms.json', 'offsets.npy', 'rows.npy', 'weights.npy')}
+
+class LexicalIndexBuilder:
+    """Collects postings chunk by chunk, in snapshot row order."""
+
+    def __init__(self):
+        self.vocab = {}
+        self._terms = array('i')
+        self._rows = array('i')
+        self._tfs = array('f')
+        self.lengths = array('i')
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def add(self, text_chunks, sources):
+        for text, source in zip(text_chunks, sources):
+            row = len(self.lengths)
+            counts = Counter(tokenize(text))
+            counts.update(tokenize(source))
+            for term, tf in counts.items():
+                self._terms.append(self.vocab.setdefault(term, len(self.vocab)))
+                self._rows.append(row)
+                self._tfs.append(tf)
+            self.lengths.append(sum(counts.values()))
+
+    def save(self, directory, data_version=None, k1=BM25_K1, b=BM25_B):
+        terms = np.frombuffer(self._terms, dtype='int32') if self._terms else np.zeros(0, dtype='int32')
+        rows = np.frombuffer(self._rows, dtype='int32') if self._rows else np.zeros(0, dtype='int32')
+        tfs = np.frombuffer(self._tfs, dtype='float32') if self._tfs else np.zeros(0, dtype='float32')
+        lengths = np.frombuffer(self.lengths, dtype='int32') if self.lengths else np.zeros(0, dtype='int32')
+        order = np.lexsort((rows, terms))
+        terms, rows, tfs = terms[order], rows[order], tfs[order]
+        offsets = np.zeros(len(self.vocab) + 1, dtype='int64')
+        np.cumsum(np.bincount(terms, minlength=len(self.vocab)), out=offsets[1:])
+        avgdl = float(lengths.mean()) if len(lengths) else 0.0
+        norms = k1 * (1 - b + b * lengths[rows] / max(avgdl, 1e-9))
+        weights = (tfs * (k1 + 1) / (tfs + norms)).astype('float32')
+
+        paths = _paths(directory)
+        with open(paths['terms.json'] + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(list(self.vocab), f, ensure_ascii=False)
+        for name, array_ in (('offsets.npy', offsets), ('rows.npy', rows), ('weights.npy', weights)):
+            with open(paths[name] + '.tmp', 'wb') as f:
+                np.save(f, array_)
+        for path in paths.values():
+            os.replace(path + '.tmp', path)
+        meta = {
+            'format': FORMAT_VERSION,
+            'data_version': data_version,
+            'count': len(lengths),
+            'terms': len(self.vocab),
+            'postings': int(rows.size),
+            'avgdl': avgdl,
+            'k1': k1,
+            'b': b,
+        }
+        with open(os.path.join(directory, META_FILE + '.tmp'), 'w') as f:
+            json.dump(meta, f)
+        os.replace(os.path.join(directory, META_FILE + '.tmp'), os.path.join(directory, META_FILE))
+        return meta
+
+class LexicalIndex:
+    """Read side of a saved index; postings are memory-mapped."""
+
+    def __init__(self, snapshot, meta):
+        self.snapshot = snapshot
+        self.meta = meta
+        self.count = meta['count']
+        paths = _paths(snapshot.path)
+        with open(paths['terms.json'], encoding='utf-8') as f:
+            self.terms = json.load(f)
+        self.term_ids = {term: i for i, term in enumerate(self.terms)}
+        self.offsets = np.load(paths['offsets.npy'], mmap_mode='r')
+        self.rows = np.load(paths['rows.npy'], mmap_mode='r')
+        self.weights = np.load(paths['weights.npy'], mmap_mode='r')
+
+    def _postings(self, term_id):
+        start, end = self.offsets[term_id], self.offsets[term_id + 1]
+        return self.rows[start:end], self.weights[start:end]
+
+    def idf(self, df):
+        return math.log(1 + (self.count - df + 0.5) / (df + 0.5))
+
+    def search(self, query, k, mask=None):
+        """Top ``k`` ``(score, row)`` pairs by BM25, best first, restricted to ``mask`` (None: all rows)."""
+        all_rows, all_scores = [], []
+        for term in set(tokenize(query)):
+            term_id = self.term_ids.get(term)
+            if term_id is None:
+                continue
+            rows, weights = self._postings(term_id)
+            scores = weights * self.idf(len(rows))
+            if mask is not None:
+                keep = mask[rows]
+                rows, scores = rows[keep], scores[keep]
+            all_rows.append(rows)
+            all_scores.append(scores)
+        if not all_rows:
+            return []
+        rows, inverse = np.unique(np.concatenate(all_rows), return_inverse=True)
+        if not rows.size:
+            return []
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores))
+        kk = min(k, rows.size)
+        top = np.argpartition(-scores, kk - 1)[:kk]
+        top = top[np.lexsort((rows[top], -scores[top]))]
+        return [(float(scores[i]), int(rows[i])) for i in top]
+
+    def _rows_for_word(self, word, at_start, at_end):
+        """Rows with a token that can hold ``word`` where it sits in the phrase."""
+        if not (at_start or at_end):
+            term_id = self.term_ids.get(word)
+            return self._postings(term_id)[0] if term_id is not None else np.zeros(0, dtype='int32')
+        if at_start and at_end:
+            matches = [i for i, term in enumerate(self.terms) if word in term]
+        elif at_start:
+            matches = [i for i, term in enumerate(self.terms) if term.endswith(word)]
+        else:
+            matches = [i for i, term in enumerate(self.terms) if term.startswith(word)]
+        if not matches:
+            return np.zeros(0, dtype='int32')
+        return np.unique(np.concatenate([self._postings(i)[0] for i in matches]))
+
+    def phrase_rows(self, phrase, rows=None):
+        """Rows whose chunk text contains ``phrase`` (case-insensitive), or None if the
+        phrase has no words to look up. ``rows`` limits the candidates."""
+        phrase = phrase.lower()
+        words = list(_WORD_RE.finditer(phrase))
+        if not words:
+            return None
+        candidates = None
+        # Words inside the phrase are whole tokens of any matching chunk; the first
+        # and last may be cut off mid-token, so those match by suffix and prefix
+        ordered = sorted(words, key=lambda m: m.start() == 0 or m.end() == len(phrase))
+        for match in ordered:
+            found = self._rows_for_word(match.group(), match.start() == 0, match.end() == len(phrase))
+            candidates = found if candidates is None else np.intersect1d(candidates, found, assume_unique=True)
+            if not candidates.size:
+                break
+        if rows is not None:
+            candidates = np.intersect1d(candidates, rows)
+        return np.array([row for row in candidates if phrase in self.snapshot.chunk_text(row).lower()],
+                        dtype='int64')
+
+def build_lexical_index(snapshot):
+    """Index an already published snapshot in place."""
+    builder = LexicalIndexBuilder()
+    batch = 10000
+    for start in range(0, len(snapshot), batch):
+        rows = range(start, min(start + batch, len(snapshot)))
+        builder.add(snapshot.iter_chunk_texts(rows), [snapshot.source(row) for row in rows])
+    return builder.save(snapshot.path, data_version=snapshot.version)
+
+def load_or_create_lexical_index(snapshot):
+    """The snapshot's BM25 index; built and saved next to it if missing or from another build."""
+    try:
+        with open(os.path.join(snapshot.path, META_FILE)) as f:
+            meta = json.load(f)
+        if meta.get('format') != FORMAT_VERSION or meta.get('count') != len(snapshot):
+            raise ValueError("stale BM25 index")
+    except (FileNotFoundError, ValueError):
+        meta = build_lexical_index(snapshot)
+    return LexicalIndex(snapshot, meta)
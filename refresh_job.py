@@ -0,0 +1,116 @@
+import collections
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from snapshot import current_version
+
+UPDATE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'update_embeddings.py')
+LOG_LINES = 200
+
+class RefreshJob:
+    """Runs update_embeddings.py in the background and hot-swaps the engine afterwards.
+
+    The ingest runs as a child process, so the server keeps answering searches
+    from the current snapshot while the next one is built off to the side.
+    Once it is published the engine loads it on this thread and swaps it in;
+    sessions never wait for either step. Only one run exists at a time:
+    ``start()`` while a run is in flight joins that run instead of starting another.
+    """
+
+    def __init__(self, engine, script=UPDATE_SCRIPT):
+        self.engine = engine
+        self.script = script
+        self.state = 'idle'          # idle -> running -> loading -> succeeded | failed
+        self.message = ''
+        self.started_at = None
+        self.finished_at = None
+        self.returncode = None
+        self.error = None
+        self.runs = 0
+        self._log = collections.deque(maxlen=LOG_LINES)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self.state in ('running', 'loading')
+
+    def start(self, full=False):
+        """Start a refresh unless one is already running. Returns True if this call started it."""
+        with self._lock:
+            if self.running:
+                return False
+            self.state = 'running'
+            self.message = "Starting document refresh..."
+            self.started_at = time.time()
+            self.finished_at = None
+            self.returncode = None
+            self.error = None
+            self.runs += 1
+            self._log.clear()
+            self._thread = threading.Thread(target=self._run, args=(full,), name="document-refresh", daemon=True)
+            self._thread.start()
+            return True
+
+    def _run(self, full):
+        command = [sys.executable, '-u', self.script] + (['--full'] if full else [])
+        try:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                       text=True, encoding='utf-8', errors='replace', bufsize=1)
+            for line in process.stdout:
+                line = line.rstrip()
+                if line:
+                    self._log.append(line)
+                    if not line.startswith(' '):
+                        self.message = line   # indented lines are details of the current step
+            self.returncode = process.wait()
+            if self.returncode != 0:
+                last = self._log[-1] if self._log else ''
+                raise RuntimeError(f"update_embeddings.py exited with status {self.returncode}: {last}")
+
+            self.state = 'loading'
+            self.message = "Loading the new snapshot..."
+            self.engine.refresh()
+            state = self.engine.state
+            if current_version(self.engine.data_dir) != (state.version if state else None):
+                raise RuntimeError(f"Could not load the new snapshot: {self.engine.last_error}")
+            stats = self.engine.stats()
+            self._finish('succeeded', f"Serving {stats['documents']} documents ({stats['chunks']} chunks)")
+        except Exception as e:
+            self.error = e
+            self._finish('failed', str(e))
+
+    def _finish(self, state, message):
+        with self._lock:
+            self.finished_at = time.time()
+            self.message = message
+            self.state = state
+
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    def log(self):
+        return list(self._log)
+
+    def wait(self, timeout=None):
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        return not self.running
+
+_job = None
+_job_lock = threading.Lock()
+
+def get_refresh_job(engine):
+    """Process-wide refresh job, so every session sees (and shares) the same run."""
+    global _job
+    if _job is None:
+        with _job_lock:
+            if _job is None:
+                _job = RefreshJob(engine)
+    return _job
@@ -0,0 +1,226 @@
+"""Headless search: the app's pipeline (ACL check, encode, filter, FAISS search)
+without Streamlit, for batch evaluations and other tools.
+
+    python search_api.py query --email you@familytlc.com "sick leave" "vacation policy"
+    python search_api.py query --email you@familytlc.com --file queries.txt --k 5 > results.jsonl
+    python search_api.py serve --port 8765
+
+HTTP endpoints (JSON in, JSON out):
+
+    POST /search   {"queries": ["..."], "email": "...", "k": 3, "filename": "...", "exact_match": false,
+                    "documents": true, "aggregate": "max", "max_per_folder": 0}
+    GET  /health   GET /stats   GET /metrics (Prometheus text)
+
+A batch is embedded in one model call and searched with one index search,
+so throughput is far above one-query-per-rerun in the UI.
+"""
+import argparse
+import json
+import sys
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from acl_index import get_access_checker, readable_file_ids
+from search_engine import SearchNotReady, get_search_engine
+from telemetry import get_telemetry
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+MAX_BATCH = 1000
+SNIPPET_CHARS = 500
+
+def drive_service():
+    """Drive client with the ingestion credentials, for permission refreshes and live lookups."""
+    from drive_auth_test11 import authenticate_drive
+    return authenticate_drive()
+
+def drive_live_lookup(email):
+    """Live Drive crawl for users and group grants the ACL index cannot answer."""
+    return readable_file_ids(drive_service(), email)
+
+class SearchService:
+    """Batch search with the same access rules as the app.
+
+    Every request must name the user whose Drive permissions filter the
+    results, unless the service was created with ``require_email=False``
+    (trusted, offline evaluation only). Each call is recorded in the search
+    telemetry as one search, with the same stages as the app.
+    """
+
+    def __init__(self, engine=None, checker=None, live_lookup=drive_live_lookup, require_email=True,
+                 telemetry=None):
+        self.engine = engine or get_search_engine()
+        self.checker = checker or get_access_checker(service_factory=drive_service)
+        self.live_lookup = live_lookup
+        self.require_email = require_email
+        self.telemetry = telemetry or get_telemetry()
+
+    def allowed_file_ids(self, email):
+        if not email:
+            if self.require_email:
+                raise ValueError("an email is required to apply Drive permissions")
+            return None
+        return self.checker.allowed_file_ids(email, self.live_lookup)
+
+    def search(self, queries, email=None, k=3, filename=None, exact_match=False, documents=None, aggregate=None,
+               max_per_folder=None):
+        """One ``{"query", "results"}`` dict per query, in order.
+
+        ``documents``, ``aggregate`` and ``max_per_folder`` default to the engine's
+        DOCUMENT_RESULTS, DOCUMENT_AGGREGATE and MAX_PER_FOLDER settings.
+        """
+        if isinstance(queries, str):
+            queries = [queries]
+        queries = [str(query) for query in queries]
+        if len(queries) > MAX_BATCH:
+            raise ValueError(f"at most {MAX_BATCH} queries per request")
+        k = int(k)
+        if k < 1:
+            raise ValueError("k must be at least 1")
+        if not email and self.require_email:
+            raise ValueError("an email is required to apply Drive permissions")
+        trace = self.telemetry.trace(email)
+        try:
+            with trace.stage('acl'):
+                allowed_file_ids = self.allowed_file_ids(email)
+            with self.engine.acquire() as state:
+                self.engine.check_ready(state)
+                found = self.engine.search_batch(
+                    queries, k,
+                    filename_keyword=filename,
+                    exact_phrases=queries if exact_match else None,
+                    allowed_file_ids=allowed_file_ids,
+                    state=state,
+                    trace=trace,
+                    documents=documents,
+                    aggregate=aggregate,
+                    max_per_folder=max_per_folder,
+                )
+                with trace.stage('render'):
+                    results = [{'query': query, 'results': [self._hit(state, rank, distance, row)
+                                                            for rank, (distance, row) in enumerate(hits, 1)]}
+                               for query, hits in zip(queries, found)]
+        except Exception:
+            trace.finish(error=True)
+            raise
+        trace.finish(results=sum(len(hits) for hits in found))
+        return results
+
+    @staticmethod
+    def _hit(state, rank, distance, row):
+        file_id = state.file_id(row)
+        return {
+            'rank': rank,
+            'distance': distance,
+            'file_id': file_id,
+            'source': state.source(row),
+            'text': state.chunk_text(row)[:SNIPPET_CHARS],
+            'link': f"https://drive.google.com/file/d/{file_id}/view",
+        }
+
+class _Handler(BaseHTTPRequestHandler):
+    service = None   # set by make_server
+
+    def _send(self, status, body, content_type='application/json'):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        engine = self.service.engine
+        engine.refresh(wait=False)
+        if self.path == '/health':
+            self._send(200 if engine.ready else 503, {'ready': engine.ready, 'version': engine.stats()['version']})
+        elif self.path == '/stats':
+            self._send(200, engine.stats())
+        elif self.path == '/metrics':
+            self._send(200, self.service.telemetry.prometheus().encode('utf-8'), 'text/plain; version=0.0.4')
+        else:
+            self._send(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != '/search':
+            self._send(404, {'error': 'not found'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            request = json.loads(self.rfile.read(length) or b'{}')
+            self.service.engine.refresh(wait=False)
+            results = self.service.search(
+                request.get('queries') or request.get('query') or [],
+                email=request.get('email'),
+                k=request.get('k', 3),
+                filename=request.get('filename'),
+                exact_match=bool(request.get('exact_match')),
+                documents=request.get('documents'),
+                aggregate=request.get('aggregate'),
+                max_per_folder=request.get('max_per_folder'),
+            )
+        except (ValueError, TypeError) as e:
+            self._send(400, {'error': str(e)})
+        except SearchNotReady as e:
+            self._send(503, {'error': str(e)})
+        except Exception as e:
+            # A Drive HttpError from the live ACL lookup or any engine (e.g. FAISS) failure: answer, don't drop the connection
+            print(f"❌ Search request failed: {e!r}", file=sys.stderr)
+            traceback.print_exc()
+            self._send(500, {'error': f"internal error ({type(e).__name__})"})
+        else:
+            self._send(200, {'results': results})
+
+    def log_message(self, format, *args):
+        pass   # keep stdout for the ingestion-style progress lines
+
+def make_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    handler = type('SearchHandler', (_Handler,), {'service': service})
+    return ThreadingHTTPServer((host, port), handler)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve = commands.add_parser('serve', help="run the HTTP service")
+    serve.add_argument('--host', default=DEFAULT_HOST)
+    serve.add_argument('--port', type=int, default=DEFAULT_PORT)
+    query = commands.add_parser('query', help="search once and print JSON lines")
+    query.add_argument('queries', nargs='*')
+    query.add_argument('--file', help="read one query per line from this file ('-' for stdin)")
+    query.add_argument('--email')
+    query.add_argument('--k', type=int, default=3)
+    query.add_argument('--filename')
+    query.add_argument('--exact-match', action='store_true')
+    query.add_argument('--chunks', action='store_true', help="return raw chunk hits instead of distinct documents")
+    query.add_argument('--aggregate', help="document score from its chunks: max, sum or topN")
+    query.add_argument('--max-per-folder', type=int)
+    for sub in (serve, query):
+        sub.add_argument('--no-acl', action='store_true',
+                         help="allow requests without an email to search every document (trusted use only)")
+    args = parser.parse_args(argv)
+
+    service = SearchService(require_email=not args.no_acl)
+    if args.command == 'serve':
+        server = make_server(service, args.host, args.port)
+        print(f"🔎 Search API listening on http://{args.host}:{args.port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return
+
+    queries = list(args.queries)
+    if args.file:
+        with (sys.stdin if args.file == '-' else open(args.file, encoding='utf-8')) as f:
+            queries.extend(line.strip() for line in f if line.strip())
+    for start in range(0, len(queries), MAX_BATCH):
+        for result in service.search(queries[start:start + MAX_BATCH], args.email, args.k,
+                                     args.filename, args.exact_match, False if args.chunks else None,
+                                     args.aggregate, args.max_per_folder):
+            print(json.dumps(result, ensure_ascii=False))
+    service.telemetry.flush()   # the writer thread is a daemon; record these searches before exiting
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,616 @@
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+
+from encoders import ENCODER_BACKEND, backend_for_space, embedding_space, encoder_nbytes, load_encoder
+from faiss_utils import search_subset
+from lexical_index import load_or_create_lexical_index
+from sharded_index import load_or_create_index
+from query_cache import (QUERY_CACHE_SIZE, QUERY_CACHE_TTL, RESULT_CACHE_SIZE, RESULT_CACHE_TTL, LRUCache,
+                         normalize_query)
+from snapshot import Snapshot, current_version, has_legacy_data, migrate_legacy, read_current
+from vector_storage import normalize_rows
+
+DATA_DIR = 'data'
+MODEL_NAME = 'all-MiniLM-L6-v2'
+# Filtered searches over at most this many chunks are scored exactly with numpy
+BRUTE_FORCE_LIMIT = 20000
+# Fuse BM25 keyword hits with the vector hits (HYBRID_SEARCH=0: vectors only)
+HYBRID_SEARCH = os.environ.get('HYBRID_SEARCH', '1') != '0'
+# Reciprocal-rank fusion: each list contributes 1 / (RRF_K + rank) for its top RRF_DEPTH hits
+RRF_K = 60
+RRF_DEPTH = 50
+# Return distinct documents rather than raw chunks (DOCUMENT_RESULTS=0: chunks), ranking
+# each by its chunks' rank scores: max, sum, or topN (sum of its N best chunks)
+DOCUMENT_RESULTS = os.environ.get('DOCUMENT_RESULTS', '1') != '0'
+DOCUMENT_AGGREGATE = os.environ.get('DOCUMENT_AGGREGATE', 'max').lower()
+# At most this many documents from one folder (0: no limit)
+MAX_PER_FOLDER = int(os.environ.get('MAX_PER_FOLDER', 0))
+# Chunk candidates fetched per requested document, multiplied by 4 until enough documents are found
+DOCUMENT_FETCH_FACTOR = 4
+MAX_DOCUMENT_CANDIDATES = 2000
+
+def data_version(data_dir=DATA_DIR):
+    """Version of the published snapshot; a single small file read."""
+    return current_version(data_dir)
+
+class SearchNotReady(RuntimeError):
+    """The model or the search data has not been loaded yet."""
+
+def _untimed(name):
+    return nullcontext()
+
+def _pairs(distances, indices):
+    return [(float(d), int(i)) for d, i in zip(distances, indices) if i >= 0]
+
+def aggregate_scores(scores, aggregate):
+    """One document score from its chunks' scores, best first."""
+    if aggregate == 'max':
+        return scores[0]
+    if aggregate == 'sum':
+        return sum(scores)
+    if aggregate.startswith('top') and aggregate[3:].isdigit():
+        return sum(scores[:int(aggregate[3:])])
+    raise ValueError(f"DOCUMENT_AGGREGATE must be max, sum or topN, got {aggregate!r}")
+
+def reciprocal_rank_fusion(rankings, k, rrf_k=RRF_K):
+    """Rows ordered by summed 1 / (rrf_k + rank) over ``rankings`` (lists of rows, best first)."""
+    scores = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking, 1):
+            scores[row] = scores.get(row, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(scores, key=lambda row: (-scores[row], row))[:k]
+
+class _EngineState:
+    """One loaded snapshot plus its FAISS and BM25 indexes. Columns are
+    memory-mapped and chunk text is decoded on demand."""
+
+    def __init__(self, snapshot, index, lexical=None):
+        self.snapshot = snapshot
+        self.version = snapshot.version
+        self.index = index
+        self.lexical = lexical
+        self.embedding_matrix = snapshot.embeddings
+        # Integer-coded columns so filters become vectorised mask operations
+        self.file_codes = snapshot.file_codes
+        self.source_codes = snapshot.source_codes
+        self.unique_file_ids = snapshot.file_ids
+        self.unique_sources = snapshot.sources
+        self.chunk_count = len(snapshot)
+        self.document_count = len(snapshot.file_ids)
+        # Normalised snapshots are searched by inner product and report cosine distance, 1 - cos
+        self.metric = snapshot.metric
+        # Searches in flight on this version; it is closed once retired and unused
+        self.refs = 0
+        self.retired = False
+
+    def close(self):
+        """Drop the index and every mapping so the memory goes back to the OS."""
+        self.index = self.lexical = None
+        self.embedding_matrix = self.file_codes = self.source_codes = None
+        self.snapshot.close()
+
+    def chunk_text(self, row):
+        return self.snapshot.chunk_text(row)
+
+    def source(self, row):
+        return self.snapshot.source(row)
+
+    def file_id(self, row):
+        return self.snapshot.file_id(row)
+
+    def prepare_queries(self, query_embeddings):
+        return normalize_rows(query_embeddings) if self.metric == 'ip' else query_embeddings
+
+    def as_distances(self, scores):
+        """Index scores as distances: inner products become cosine distances."""
+        return 1 - scores if self.metric == 'ip' else scores
+
+    def vector_distances(self, query_embeddings, vectors):
+        """(queries x vectors) distances, as the index would report them."""
+        if self.metric == 'ip':
+            return 1 - query_embeddings @ vectors.T
+        # ||x - q||^2 = ||x||^2 - 2 x.q + ||q||^2: one matrix product for the whole batch
+        distances = (np.einsum('ij,ij->i', vectors, vectors)[None, :] - 2 * query_embeddings @ vectors.T
+                     + np.einsum('ij,ij->i', query_embeddings, query_embeddings)[:, None])
+        return np.maximum(distances, 0, out=distances)
+
+    def folder(self, row):
+        source = self.source(row)
+        return source.split(" / ", 1)[0] if " / " in source else ""
+
+    def is_name_chunk(self, row):
+        """True for the file-name and folder-name pseudo-chunks ingestion adds to every file."""
+        folder_name, _, file_name = self.source(row).rpartition(" / ")
+        text = self.chunk_text(row)
+        return text == file_name or (bool(folder_name) and text == folder_name)
+
+    def phrase_mask(self, phrase, rows=None):
+        matching = np.zeros(self.chunk_count, dtype=bool)
+        found = self.lexical.phrase_rows(phrase, rows) if self.lexical is not None else None
+        if found is not None:
+            matching[found] = True
+            return matching
+        # No words to look up in the inverted index: check every candidate's text
+        phrase = phrase.lower()
+        for row in (range(self.chunk_count) if rows is None else rows):
+            if phrase in self.chunk_text(row).lower():
+                matching[row] = True
+        return matching
+
+    def candidate_mask(self, filename_keyword=None, exact_phrase=None, allowed_file_ids=None):
+        """Boolean row mask for the given filters, or None when nothing is filtered."""
+        mask = None
+        if allowed_file_ids is not None:
+            allowed = np.fromiter((f in allowed_file_ids for f in self.unique_file_ids), bool, len(self.unique_file_ids))
+            mask = allowed[self.file_codes]
+        if filename_keyword:
+            keyword = filename_keyword.lower()
+            matching = np.fromiter((keyword in s.lower() for s in self.unique_sources), bool, len(self.unique_sources))
+            mask = matching[self.source_codes] if mask is None else mask & matching[self.source_codes]
+        if exact_phrase:
+            mask = self.phrase_mask(exact_phrase, None if mask is None else np.flatnonzero(mask))
+        return mask
+
+class SearchEngine:
+    """Model, chunk data and FAISS index shared by every Streamlit session.
+
+    The data is loaded once per server process and reloaded only when a new
+    snapshot is published (``data_version()`` changes). A new version is loaded
+    next to the current one and swapped in atomically. Readers hold a version
+    with ``acquire()``, so in-flight searches finish on the version they started
+    on and an old version is closed as soon as its last reader lets go.
+
+    Query embeddings are cached by normalized text, and results by (version,
+    query, filters), so repeated searches skip the model and the index. Result
+    entries for a version are dropped when it is swapped out.
+
+    ``warm_up()`` does the first load on a background thread, so a page can
+    render before the model and index are in memory.
+    """
+
+    def __init__(self, data_dir=DATA_DIR, model_name=MODEL_NAME, backend=ENCODER_BACKEND):
+        self.data_dir = data_dir
+        self.model_name = model_name
+        self.backend = backend
+        self.model = None
+        self.model_space = None
+        self.state = None
+        self.load_seconds = 0.0
+        self.model_load_seconds = 0.0
+        self.warmup_seconds = None
+        self.memory_bytes = 0
+        self.last_error = None
+        self._failed_version = None
+        self.swaps = 0
+        self.query_cache = LRUCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL)
+        self.result_cache = LRUCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL)
+        self.warm_queries = ()
+        self._lock = threading.Lock()        # one load at a time
+        self._refs_lock = threading.Lock()   # guards self.state and every state's refs
+        self._warm_lock = threading.Lock()
+        self._warm_thread = None
+
+    @property
+    def ready(self):
+        return self.model is not None and self.state is not None and self.state.index is not None
+
+    def check_ready(self, state):
+        """Raise SearchNotReady unless ``state`` (from ``acquire()``) can answer searches."""
+        if state is None or not self.ready:
+            raise SearchNotReady("search data is not loaded")
+
+    @property
+    def warming(self):
+        thread = self._warm_thread
+        return thread is not None and thread.is_alive()
+
+    def warm_up(self):
+        """Start the first load on a background thread and return at once.
+
+        ``ready`` turns True when it finishes. Once data is loaded this is
+        ``refresh(wait=False)``.
+        """
+        if self.state is not None:
+            return self.refresh(wait=False)
+        with self._warm_lock:
+            if self.warming or (self._failed_version is not None
+                                and self._failed_version == data_version(self.data_dir)):
+                return False
+            self._warm_thread = threading.Thread(target=self._warm, name='search-warm-up', daemon=True)
+            self._warm_thread.start()
+        return False
+
+    def _warm(self):
+        start = time.perf_counter()
+        self.refresh()
+        if self.ready:
+            self.warmup_seconds = time.perf_counter() - start
+            print(f"🔥 Search engine warmed up in {self.warmup_seconds:.2f}s")
+
+    @contextmanager
+    def acquire(self):
+        """Pin the current state (or None) for the duration of the block."""
+        with self._refs_lock:
+            state = self.state
+            if state is not None:
+                state.refs += 1
+        try:
+            yield state
+        finally:
+            if state is not None:
+                self._release(state)
+
+    def _release(self, state):
+        with self._refs_lock:
+            state.refs -= 1
+            close = state.retired and state.refs == 0
+        if close:
+            state.close()
+
+    def _swap(self, new_state):
+        with self._refs_lock:
+            old, self.state = self.state, new_state
+            self.swaps += 1
+            # Cached rows refer to the old version
+            self.result_cache.clear()
+            close = False
+            if old is not None:
+                old.retired = True
+                close = old.refs == 0
+        if close:
+            old.close()
+        if new_state is not None:
+            self._prewarm(new_state)
+
+    def set_warm_queries(self, queries):
+        """Queries to keep cached: embedded now and again after every swap."""
+        queries = tuple(queries)
+        if queries == self.warm_queries:
+            return
+        self.warm_queries = queries
+        with self.acquire() as state:
+            if state is not None:
+                self._prewarm(state)
+
+    def _prewarm(self, state):
+        # Only the embeddings: cached results are keyed by each user's ACL filter and k,
+        # which are not known until someone searches
+        if self.model is None or state.index is None or not self.warm_queries:
+            return
+        queries = list(dict.fromkeys(map(normalize_query, self.warm_queries)))
+        # Peeked so warming does not count towards the hit rates
+        missing = [query for query in queries if self.query_cache.peek(query) is None]
+        if missing:
+            for query, embedding in zip(missing, self.model.encode(missing).astype('float32')):
+                self.query_cache.put(query, embedding)
+
+    def embed_queries(self, questions):
+        """(n, dim) query embeddings; cache misses are encoded in one model call."""
+        keys = [normalize_query(question) for question in questions]
+        embeddings = {}
+        missing = {}
+        for key, question in zip(keys, questions):
+            embedding = self.query_cache.get(key)
+            if embedding is None:
+                missing.setdefault(key, question)
+            else:
+                embeddings[key] = embedding
+        if missing:
+            encoded = self.model.encode(list(missing.values())).astype('float32')
+            for key, embedding in zip(missing, encoded):
+                embeddings[key] = embedding
+                self.query_cache.put(key, embedding)
+        if not keys:
+            return np.zeros((0, self.model.get_sentence_embedding_dimension()), dtype='float32')
+        return np.stack([embeddings[key] for key in keys])
+
+    def embed_query(self, question):
+        return self.embed_queries([question])
+
+    @staticmethod
+    def _result_key(state, question, k, filename_keyword, exact_phrase, allowed_file_ids, grouping=None):
+        return (
+            state.version,
+            normalize_query(question),
+            k,
+            filename_keyword.lower() if filename_keyword else None,
+            exact_phrase.lower() if exact_phrase else None,
+            None if allowed_file_ids is None else frozenset(allowed_file_ids),   # no copy if already frozen
+            grouping,
+        )
+
+    @staticmethod
+    def _grouping(documents, aggregate, max_per_folder):
+        """``(aggregate, max_per_folder)`` for document results, or None for raw chunks."""
+        if not (DOCUMENT_RESULTS if documents is None else documents):
+            return None
+        aggregate = (aggregate or DOCUMENT_AGGREGATE).lower()
+        aggregate_scores([1.0], aggregate)   # reject unknown modes before searching
+        return aggregate, int(MAX_PER_FOLDER if max_per_folder is None else max_per_folder)
+
+    def close(self):
+        """Stop serving; the current version is released once in-flight searches finish."""
+        with self._lock:
+            self._swap(None)
+            self.memory_bytes = 0
+
+    def refresh(self, wait=True):
+        """Reload the data if it changed on disk. Returns True when a reload happened.
+
+        With ``wait=False`` a caller that already has data to serve returns
+        immediately while another thread is loading, instead of queueing behind it.
+        """
+        version = data_version(self.data_dir)
+        if self.state is not None and version in (self.state.version, self._failed_version):
+            return False
+        if not self._lock.acquire(blocking=wait or self.state is None):
+            return False
+        try:
+            if version is None and has_legacy_data(self.data_dir):
+                try:
+                    migrate_legacy(self.data_dir)
+                    print("✅ Migrated legacy pickles to a snapshot")
+                except Exception as e:
+                    print(f"❌ Could not migrate legacy data: {e}")
+                version = data_version(self.data_dir)
+            if self.state is not None and version == self.state.version:
+                return False
+            if version is None:
+                self._swap(None)
+                self.memory_bytes = 0
+                return True
+            try:
+                self._load(version)
+                self.last_error = None
+                self._failed_version = None
+            except Exception as e:
+                # Keep serving the previous version rather than retrying this one on every rerun
+                print(f"❌ Could not load search data: {e}")
+                self.last_error = e
+                self._failed_version = version
+                return False
+            return True
+        finally:
+            self._lock.release()
+
+    def _load(self, version):
+        start = time.perf_counter()
+        snapshot = Snapshot(os.path.join(self.data_dir, read_current(self.data_dir)['path']))
+        space = snapshot.meta.get('embedding_space', self.model_name)
+        if self.model is None or self.model_space != space:
+            backend = self.backend
+            if embedding_space(self.model_name, backend) != space:
+                # Queries must be embedded in the snapshot's space; never compare across encoders
+                backend = backend_for_space(space, self.model_name)
+                print(f"⚠️ {self.backend} encoder has not been validated for {space} embeddings, using {backend}")
+            self.model = load_encoder(self.model_name, backend)
+            self.model_space = space
+            self.query_cache.clear()
+            self.model_load_seconds = time.perf_counter() - start
+        index = lexical = None
+        if len(snapshot):
+            # Normally prebuilt by update_embeddings.py; only built here if missing or stale
+            index = load_or_create_index(snapshot)
+            lexical = load_or_create_lexical_index(snapshot)
+        state = _EngineState(snapshot, index, lexical)
+        self.memory_bytes = self._estimate_memory(state)
+        self._swap(state)
+        self.load_seconds = time.perf_counter() - start
+        print(f"✅ Search data loaded in {self.load_seconds:.2f}s "
+              f"({len(snapshot)} chunks, ~{self.memory_bytes / 2**20:.1f} MB)")
+
+    def search(self, question, k=3, filename_keyword=None, exact_phrase=None, allowed_file_ids=None, state=None,
+               trace=None, documents=None, aggregate=None, max_per_folder=None):
+        """Top ``k`` chunks as ``(distance, row)`` pairs, with every filter applied inside the search.
+
+        Small filtered subsets are scored exactly with numpy; larger ones use a
+        FAISS ID selector, or an adaptively widened k when the index cannot take one.
+        Vector hits are fused with BM25 keyword hits by reciprocal rank, and exact
+        phrases are looked up in the inverted index; distances stay vector distances.
+        Pass ``state`` (from ``acquire()``) to pin the search to the data version
+        the caller renders from; otherwise the current version is held for the call.
+        ``trace`` (a telemetry SearchTrace) receives encode/filter/search timings.
+
+        With ``documents`` (default: DOCUMENT_RESULTS) the ``k`` results are distinct
+        files: chunks are grouped by file, each file is ranked by ``aggregate``
+        (max, sum or topN of its chunks' rank scores) and represented by its best
+        content chunk, and at most ``max_per_folder`` files come from one folder.
+        """
+        return self.search_batch([question], k, filename_keyword, None if exact_phrase is None else [exact_phrase],
+                                 allowed_file_ids, state, trace, documents, aggregate, max_per_folder)[0]
+
+    def search_batch(self, questions, k=3, filename_keyword=None, exact_phrases=None, allowed_file_ids=None,
+                     state=None, trace=None, documents=None, aggregate=None, max_per_folder=None):
+        """``search()`` for many queries sharing the same filters; one result list per query.
+
+        Queries missing from the result cache are encoded in one model call
+        and scored with one index (or matrix) search per distinct exact phrase.
+        ``exact_phrases`` is None or one phrase (or None) per query.
+        """
+        if state is None:
+            with self.acquire() as state:
+                if state is None:
+                    return [[] for _ in questions]
+                return self.search_batch(questions, k, filename_keyword, exact_phrases, allowed_file_ids, state, trace,
+                                         documents, aggregate, max_per_folder)
+        if self.model is None or state.index is None:
+            return [[] for _ in questions]
+        grouping = self._grouping(documents, aggregate, max_per_folder)
+        phrases = list(exact_phrases) if exact_phrases is not None else [None] * len(questions)
+        if allowed_file_ids is not None:
+            allowed_file_ids = frozenset(allowed_file_ids)
+        keys = [self._result_key(state, question, k, filename_keyword, phrase, allowed_file_ids, grouping)
+                for question, phrase in zip(questions, phrases)]
+        results = [self.result_cache.get(key) for key in keys]
+        pending = [i for i, found in enumerate(results) if found is None]
+        if pending:
+            stage = trace.stage if trace is not None else _untimed
+            with stage('encode'):
+                query_embeddings = state.prepare_queries(self.embed_queries([questions[i] for i in pending]))
+            with stage('filter'):
+                base_mask = state.candidate_mask(filename_keyword, None, allowed_file_ids)
+            by_phrase = {}
+            for j, i in enumerate(pending):
+                by_phrase.setdefault(phrases[i].lower() if phrases[i] else None, []).append(j)
+            for phrase, members in by_phrase.items():
+                mask = base_mask
+                if phrase:
+                    with stage('filter'):
+                        mask = state.phrase_mask(phrase, None if base_mask is None else np.flatnonzero(base_mask))
+                with stage('search'):
+                    found = self._search_ranked(state, [questions[pending[j]] for j in members],
+                                                query_embeddings[members], k, mask, grouping)
+                for j, hits in zip(members, found):
+                    results[pending[j]] = hits
+                    self.result_cache.put(keys[pending[j]], hits)
+        return [list(hits) for hits in results]
+
+    def _search_ranked(self, state, questions, query_embeddings, k, mask, grouping):
+        """``k`` chunk hits per query, or ``k`` document hits when ``grouping`` is set."""
+        if grouping is None:
+            return self._search_hybrid(state, questions, query_embeddings, k, mask)
+        aggregate, max_per_folder = grouping
+        available = state.chunk_count if mask is None else int(np.count_nonzero(mask))
+        results = [None] * len(questions)
+        todo = list(range(len(questions)))
+        limit = min(available, max(MAX_DOCUMENT_CANDIDATES, k))
+        depth = k * DOCUMENT_FETCH_FACTOR
+        # Widen the chunk candidates only for queries that have not reached k documents yet
+        while todo:
+            depth = min(depth, limit)
+            found = self._search_hybrid(state, [questions[i] for i in todo], query_embeddings[todo], depth, mask)
+            remaining = []
+            for i, hits in zip(todo, found):
+                results[i] = self._group_documents(state, hits, k, aggregate, max_per_folder)
+                exhausted = len(hits) < depth or depth >= limit
+                if len(results[i]) < k and not exhausted:
+                    remaining.append(i)
+            todo = remaining
+            depth *= 4
+        return results
+
+    @staticmethod
+    def _group_documents(state, hits, k, aggregate, max_per_folder):
+        """Best ``k`` files among ranked chunk ``hits``, each as its best content chunk's ``(distance, row)``."""
+        documents = {}
+        for rank, (distance, row) in enumerate(hits, 1):
+            document = documents.setdefault(int(state.file_codes[row]), {'scores': [], 'hit': None, 'named': True})
+            document['scores'].append(1.0 / (RRF_K + rank))
+            if document['named']:
+                # Prefer showing a content chunk over the file-name and folder-name pseudo-chunks
+                named = state.is_name_chunk(row)
+                if document['hit'] is None or not named:
+                    document['named'] = named
+                    document['hit'] = (distance, row)
+        ranked = sorted(documents.values(), key=lambda d: (-aggregate_scores(d['scores'], aggregate), -d['scores'][0]))
+        results, per_folder = [], {}
+        for document in ranked:
+            folder = state.folder(document['hit'][1])
+            if max_per_folder and per_folder.get(folder, 0) >= max_per_folder:
+                continue
+            per_folder[folder] = per_folder.get(folder, 0) + 1
+            results.append(document['hit'])
+            if len(results) == k:
+                break
+        return results
+
+    def _search_hybrid(self, state, questions, query_embeddings, k, mask):
+        """Vector hits fused with BM25 keyword hits; ``(distance, row)`` lists in fused order."""
+        if not HYBRID_SEARCH or state.lexical is None:
+            return self._search_masked(state, query_embeddings, k, mask)
+        depth = max(k, RRF_DEPTH)
+        dense = self._search_masked(state, query_embeddings, depth, mask)
+        results = []
+        for question, embedding, hits in zip(questions, query_embeddings, dense):
+            keyword_rows = [row for _, row in state.lexical.search(question, depth, mask)]
+            rows = reciprocal_rank_fusion([[row for _, row in hits], keyword_rows], k)
+            distances = {row: distance for distance, row in hits}
+            missing = [row for row in rows if row not in distances]
+            if missing:
+                # Keyword-only hits still report their vector distance
+                vectors = np.asarray(state.embedding_matrix[missing])
+                for row, distance in zip(missing, state.vector_distances(embedding[None, :], vectors)[0]):
+                    distances[row] = float(distance)
+            results.append([(distances[row], row) for row in rows])
+        return results
+
+    def _search_masked(self, state, query_embeddings, k, mask):
+        """Top-k ``(distance, row)`` lists for each query row, restricted to ``mask`` (None: all rows)."""
+        ntotal = state.index.ntotal
+        if mask is None:
+            distances, indices = state.index.search(query_embeddings, min(k, ntotal))
+            return [_pairs(d, i) for d, i in zip(state.as_distances(distances), indices)]
+
+        ids = np.flatnonzero(mask).astype('int64')
+        if not ids.size:
+            return [[] for _ in query_embeddings]
+        if ids.size <= BRUTE_FORCE_LIMIT:
+            distances = state.vector_distances(query_embeddings, np.asarray(state.embedding_matrix[ids]))
+            kk = min(k, ids.size)
+            top = np.argpartition(distances, kk - 1, axis=1)[:, :kk]
+            results = []
+            for row, candidates in zip(distances, top):
+                candidates = candidates[np.argsort(row[candidates])]
+                results.append([(float(row[j]), int(ids[j])) for j in candidates])
+            return results
+
+        found = search_subset(state.index, query_embeddings, min(k, ids.size), ids)
+        if found is not None:
+            distances, indices = found
+            return [_pairs(d, i) for d, i in zip(state.as_distances(distances), indices)]
+
+        fetch = k * 4
+        while True:
+            fetch = min(fetch, ntotal)
+            distances, indices = state.index.search(query_embeddings, fetch)
+            distances = state.as_distances(distances)
+            results = [[(float(d), int(i)) for d, i in zip(drow, irow) if i >= 0 and mask[i]][:k]
+                       for drow, irow in zip(distances, indices)]
+            if fetch >= ntotal or all(len(hits) >= k for hits in results):
+                return results
+            fetch *= 4
+
+    def _estimate_memory(self, state):
+        # Mapped snapshot files (including the persisted index) plus model weights
+        return state.snapshot.nbytes() + encoder_nbytes(self.model)
+
+    def stats(self):
+        state = self.state
+        return {
+            "version": state.version if state else None,
+            "chunks": state.chunk_count if state else 0,
+            "documents": state.document_count if state else 0,
+            "load_seconds": self.load_seconds,
+            "model_load_seconds": self.model_load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "encoder": getattr(self.model, 'backend', None),
+            "memory_bytes": self.memory_bytes,
+            "swaps": self.swaps,
+            "query_cache": self.query_cache.stats(),
+            "result_cache": self.result_cache.stats(),
+        }
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_search_engine(data_dir=DATA_DIR, background=False):
+    """Process-wide engine; cheap to call on every Streamlit rerun.
+
+    With ``background=True`` the first load happens on a warm-up thread instead
+    of blocking the caller; check ``ready`` before searching.
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = SearchEngine(data_dir)
+    if background:
+        _engine.warm_up()
+    else:
+        # Sessions keep serving the current version while another thread loads the next
+        _engine.refresh(wait=False)
+    return _engine
@@ -0,0 +1,230 @@
+"""Optional sharded vector index: a snapshot's rows split over several FAISS
+indexes that are searched in parallel and merged.
+
+    INDEX_SHARDS=8        number of shards (0 or 1: one index; unset: whatever the snapshot was built with)
+    SHARD_BY=folder       rows are assigned by a hash of their folder (default) or of their Drive file ID (file)
+    SHARD_WORKERS=8       threads searching shards at once (default: one per core)
+
+Each shard is an index of the usual FAISS_INDEX kind over its own rows,
+saved in the snapshot as shard_<i>.index and listed in shards.json. A query
+goes to every shard on a thread pool (FAISS releases the GIL while it
+scans), each shard returns its top k, and those are merged by distance.
+
+shards.json records a digest of every shard's files (their manifest
+signatures, in row order) and of the index settings. When ingestion builds
+a new snapshot, a shard whose digest matches the previous snapshot's is
+linked from it instead of rebuilt; sharded by folder, an edit in one folder
+rebuilds only that folder's shard. Only one shard's vectors are in memory
+while it is built.
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from faiss_utils import (DEFAULT_INDEX_PARAMS, INDEX_FILE, create_faiss_index, index_config_from_env,
+                         load_or_create_faiss_index, save_faiss_index, search_subset, set_search_params)
+
+_shards_env = os.environ.get('INDEX_SHARDS')
+SHARD_COUNT = int(_shards_env) if _shards_env else None
+SHARD_BY = os.environ.get('SHARD_BY', 'folder').lower()
+SHARD_KEYS = ('folder', 'file')
+SHARD_WORKERS = int(os.environ.get('SHARD_WORKERS', 0))
+SHARDS_FILE = 'shards.json'
+FORMAT_VERSION = 1
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _search_pool():
+    """Threads shared by every ShardedIndex in the process."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=SHARD_WORKERS or os.cpu_count() or 1,
+                                       thread_name_prefix='shard-search')
+        return _pool
+
+def _shard_of(key, shards):
+    return zlib.crc32(key.encode('utf-8')) % shards
+
+def assign_shards(snapshot, shards, by=SHARD_BY):
+    """Shard number of every row. All rows of a file land in the same shard either way."""
+    if by not in SHARD_KEYS:
+        raise ValueError(f"SHARD_BY must be one of {SHARD_KEYS}, got {by!r}")
+    if by == 'folder':
+        keys = [source.split(" / ", 1)[0] if " / " in source else "" for source in snapshot.sources]
+        codes = snapshot.source_codes
+    else:
+        keys, codes = snapshot.file_ids, snapshot.file_codes
+    per_code = np.fromiter((_shard_of(key, shards) for key in keys), dtype='int32', count=len(keys))
+    return per_code[np.asarray(codes)]
+
+def _read_shards(path, config):
+    """``{shard: entry}`` from ``path``'s shards.json if it was built with ``config``."""
+    try:
+        with open(os.path.join(path, SHARDS_FILE)) as f:
+            meta = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+    if meta.get('format') != FORMAT_VERSION or meta.get('config') != config:
+        return {}
+    return {entry['shard']: entry for entry in meta['shards']}
+
+def _shard_digest(snapshot, rows, config):
+    """Identifies the exact vectors of a shard: the same files with the same
+    signatures, in the same order, under the same index settings."""
+    digest = hashlib.blake2b(json.dumps(config, sort_keys=True).encode('utf-8'), digest_size=16)
+    codes = np.asarray(snapshot.file_codes[rows])
+    starts = np.flatnonzero(np.diff(codes, prepend=-1))
+    ends = np.append(starts[1:], len(codes))
+    files = snapshot.files
+    for start, end in zip(starts, ends):
+        file_id = snapshot.file_ids[codes[start]]
+        entry = files.get(file_id)
+        if entry is None:
+            # No manifest to compare with (synthetic or migrated data): only this snapshot matches
+            digest.update(snapshot.version.encode('utf-8'))
+            entry = {}
+        signature = {key: value for key, value in entry.items() if key not in ('start', 'end')}
+        digest.update(json.dumps([file_id, signature, int(end - start)], sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+def _link(source, target):
+    # Index files are never modified in place, so snapshots can share them
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+class ShardedIndex:
+    """Shard indexes over disjoint rows. search() has faiss's signature and
+    returns global rows, so the search engine uses it like a single index."""
+
+    def __init__(self, indexes, rows, metric='l2'):
+        self.indexes = indexes      # None for a shard without rows
+        self.rows = rows            # sorted global row of each shard vector
+        self.metric = metric
+        self.ntotal = sum(len(r) for r in rows)
+        self.built = self.reused = 0
+
+    def __len__(self):
+        return len(self.indexes)
+
+    def _search_shard(self, shard, queries, k, ids=None):
+        index, rows = self.indexes[shard], self.rows[shard]
+        if ids is None:
+            distances, local = index.search(queries, min(k, index.ntotal))
+        else:
+            # Global ids to this shard's positions; rows and ids are both sorted
+            positions = np.searchsorted(rows, ids)
+            inside = positions < len(rows)
+            positions, candidates = positions[inside], ids[inside]
+            positions = positions[rows[positions] == candidates]
+            if not positions.size:
+                return None
+            found = search_subset(index, queries, min(k, positions.size), positions.astype('int64'))
+            if found is None:
+                raise NotImplementedError
+            distances, local = found
+        return distances, np.where(local >= 0, rows[np.maximum(local, 0)], -1)
+
+    def _fan_out(self, queries, k, ids=None):
+        shards = [i for i, index in enumerate(self.indexes) if index is not None]
+        parts = [part for part in _search_pool().map(lambda i: self._search_shard(i, queries, k, ids), shards)
+                 if part is not None]
+        if not parts:
+            return np.zeros((len(queries), 0), dtype='float32'), np.zeros((len(queries), 0), dtype='int64')
+        distances = np.concatenate([d for d, _ in parts], axis=1)
+        rows = np.concatenate([r for _, r in parts], axis=1)
+        # Inner-product scores are best when largest
+        order_key = -distances if self.metric == 'ip' else distances.copy()
+        order_key[rows < 0] = np.inf
+        kk = min(k, distances.shape[1])
+        top = np.argpartition(order_key, kk - 1, axis=1)[:, :kk]
+        top = np.take_along_axis(top, np.argsort(np.take_along_axis(order_key, top, axis=1), axis=1), axis=1)
+        return np.take_along_axis(distances, top, axis=1), np.take_along_axis(rows, top, axis=1)
+
+    def search(self, queries, k):
+        return self._fan_out(np.ascontiguousarray(queries, dtype='float32'), k)
+
+    def search_ids(self, queries, k, ids):
+        """Search only global rows ``ids`` (sorted int64); None if a shard cannot apply an ID selector."""
+        try:
+            return self._fan_out(np.ascontiguousarray(queries, dtype='float32'), k, ids)
+        except NotImplementedError:
+            return None
+
+def configured_shards(snapshot):
+    """INDEX_SHARDS if set, otherwise the shard count the snapshot was built with (0 if none)."""
+    if SHARD_COUNT is not None:
+        return SHARD_COUNT
+    try:
+        with open(os.path.join(snapshot.path, SHARDS_FILE)) as f:
+            return json.load(f)['config']['shards']
+    except (FileNotFoundError, ValueError, KeyError):
+        return 0
+
+def load_or_create_sharded_index(snapshot, shards, by=SHARD_BY, previous=None):
+    """Load the snapshot's shards, linking unchanged ones from ``previous`` and building the rest."""
+    import faiss
+    kind, params = index_config_from_env()
+    params = {**DEFAULT_INDEX_PARAMS, **params}
+    config = {
+        'shards': shards,
+        'by': by,
+        'kind': kind,
+        'params': {k: v for k, v in params.items() if k not in ('nprobe', 'ef_search')},
+        'metric': snapshot.metric,
+        'storage': snapshot.storage,
+        'embedding_space': snapshot.meta.get('embedding_space'),
+    }
+    existing = _read_shards(snapshot.path, config)
+    earlier = _read_shards(previous.path, config) if previous is not None else {}
+    assignment = assign_shards(snapshot, shards, by)
+    sharded = ShardedIndex([], [], snapshot.metric)
+    entries = []
+    for shard in range(shards):
+        rows = np.flatnonzero(assignment == shard).astype('int64')
+        name = f"shard_{shard:03d}.index"
+        path = os.path.join(snapshot.path, name)
+        entry = {'shard': shard, 'index': name, 'ntotal': int(rows.size),
+                 'digest': _shard_digest(snapshot, rows, config) if rows.size else None}
+        index = None
+        if rows.size:
+            if existing.get(shard, {}).get('digest') == entry['digest'] and os.path.exists(path):
+                index = faiss.read_index(path)
+            elif earlier.get(shard, {}).get('digest') == entry['digest']:
+                _link(os.path.join(previous.path, name), path)
+                index = faiss.read_index(path)
+                sharded.reused += 1
+            else:
+                index = create_faiss_index(snapshot.embeddings[rows], kind, snapshot.metric, snapshot.storage,
+                                           **params)
+                save_faiss_index(index, path, entry)
+                sharded.built += 1
+            set_search_params(index, nprobe=params['nprobe'], ef_search=params['ef_search'])
+        sharded.indexes.append(index)
+        sharded.rows.append(rows)
+        entries.append(entry)
+    sharded.ntotal = len(snapshot)
+    if sharded.built or sharded.reused or not existing:
+        tmp = os.path.join(snapshot.path, SHARDS_FILE + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump({'format': FORMAT_VERSION, 'config': config, 'shards': entries}, f)
+        os.replace(tmp, os.path.join(snapshot.path, SHARDS_FILE))
+    return sharded
+
+def load_or_create_index(snapshot, previous=None, shards=None):
+    """The snapshot's vector index: one FAISS index, or a ShardedIndex when sharding is on."""
+    shards = configured_shards(snapshot) if shards is None else shards
+    if shards > 1:
+        return load_or_create_sharded_index(snapshot, shards, previous=previous)
+    return load_or_create_faiss_index(snapshot.embeddings, os.path.join(snapshot.path, INDEX_FILE),
+                                      data_version=snapshot.version, metric=snapshot.metric,
+                                      storage=snapshot.storage)
@@ -0,0 +1,363 @@
+"""Versioned, memory-mapped index snapshots.
+
+A snapshot is one directory under ``data/snapshots/<version>/``:
+
+    embeddings.f32      raw row-major float32 matrix (n x dim), memory-mapped
+                        (embeddings.f16, or embeddings.i8 + embedding_scales.f32,
+                        for the compact storages in vector_storage.py)
+    text.bin            every chunk's UTF-8 text, concatenated
+    text_offsets.npy    int64 (n + 1) byte offsets into text.bin
+    source_codes.npy    int32 (n) index into sources.json
+    file_codes.npy      int32 (n) index into file_ids.json
+    sources.json        distinct source labels
+    file_ids.json       distinct Drive file IDs
+    files.json          per-file ingestion manifest (signature + row range)
+    meta.json           version, row count, dimension, dtype, metric
+
+Snapshots are written into a temporary directory, fsynced and renamed into
+place; ``data/CURRENT`` is then atomically replaced to publish the new
+version. Readers open files lazily, so opening a snapshot costs almost
+nothing and chunk text is decoded on demand.
+
+    python snapshot.py migrate     # convert legacy data/*.pkl + embeddings.npy
+    python snapshot.py info        # describe the current snapshot
+"""
+import json
+import os
+import pickle
+import shutil
+import sys
+import time
+import uuid
+from array import array
+
+import numpy as np
+
+from vector_storage import (EMBEDDING_FILES, EMBEDDING_STORAGE, SCALES_FILE, StoredEmbeddings, check_storage,
+                            encode_rows, normalize_rows, normalizes)
+
+DATA_DIR = 'data'
+SNAPSHOTS_DIR = 'snapshots'
+CURRENT_FILE = 'CURRENT'
+KEEP_SNAPSHOTS = 3
+FORMAT_VERSION = 1
+
+def new_version():
+    return time.strftime('%Y%m%dT%H%M%S') + '-' + uuid.uuid4().hex[:6]
+
+def _fsync_dir(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return  # directories cannot be opened on Windows
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _write_json(path, data):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+
+def _save_npy(path, array):
+    with open(path, 'wb') as f:
+        np.save(f, array)
+        f.flush()
+        os.fsync(f.fileno())
+
+def _open_embeddings(path, storage, count, dim):
+    """Memory-mapped embeddings of a snapshot directory; compact storages read back as float32."""
+    if not count:
+        return np.zeros((0, dim), dtype='float32')
+    codes = np.memmap(os.path.join(path, EMBEDDING_FILES[storage]), dtype=storage, mode='r', shape=(count, dim))
+    if storage == 'float32':
+        return codes
+    scales = None
+    if storage == 'int8':
+        scales = np.memmap(os.path.join(path, SCALES_FILE), dtype='float32', mode='r', shape=(count,))
+    return StoredEmbeddings(codes, scales)
+
+def read_current(data_dir=DATA_DIR):
+    """The published manifest ({'version', 'path'}) or None. Cheap enough to call per rerun."""
+    try:
+        with open(os.path.join(data_dir, CURRENT_FILE), encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def current_version(data_dir=DATA_DIR):
+    current = read_current(data_dir)
+    return current['version'] if current else None
+
+class SnapshotWriter:
+    """Builds a snapshot incrementally; nothing is visible to readers until publish().
+
+    ``storage`` is float32, float16 or int8 (default: EMBEDDING_STORAGE). Compact
+    storages, and float32 with ``normalize``, keep L2-normalised vectors and
+    are searched by inner product.
+    """
+
+    def __init__(self, data_dir=DATA_DIR, version=None, storage=None, normalize=None):
+        self.data_dir = data_dir
+        self.version = version or new_version()
+        self.storage = check_storage(storage or EMBEDDING_STORAGE)
+        self.normalize = normalizes(self.storage, normalize)
+        self.metric = 'ip' if self.normalize else 'l2'
+        self.snapshots_dir = os.path.join(data_dir, SNAPSHOTS_DIR)
+        self.tmp_path = os.path.join(self.snapshots_dir, f".tmp-{self.version}")
+        self.path = os.path.join(self.snapshots_dir, self.version)
+        os.makedirs(self.tmp_path, exist_ok=True)
+        self._embeddings = open(os.path.join(self.tmp_path, EMBEDDING_FILES[self.storage]), 'wb')
+        self._scales = open(os.path.join(self.tmp_path, SCALES_FILE), 'wb') if self.storage == 'int8' else None
+        self._text = open(os.path.join(self.tmp_path, 'text.bin'), 'wb')
+        # Compact typed arrays: these grow by one entry per chunk for the whole ingest
+        self._offsets = array('q', [0])
+        self._source_codes, self._file_codes = array('i'), array('i')
+        self._source_vocab, self._file_vocab = {}, {}
+        self.dim = None
+        self.count = 0
+        self.finished = False
+
+    def append(self, embeddings, text_chunks, sources, file_ids):
+        embeddings = np.ascontiguousarray(embeddings, dtype='float32')
+        if not (len(embeddings) == len(text_chunks) == len(sources) == len(file_ids)):
+            raise ValueError("embeddings, text_chunks, sources and file_ids must have the same length")
+        if len(embeddings):
+            if self.dim is None:
+                self.dim = embeddings.shape[1]
+            elif embeddings.shape[1] != self.dim:
+                raise ValueError(f"expected {self.dim}-d embeddings, got {embeddings.shape[1]}")
+        codes, scales = encode_rows(normalize_rows(embeddings) if self.normalize else embeddings, self.storage)
+        self._embeddings.write(codes.tobytes())
+        if self._scales is not None:
+            self._scales.write(scales.tobytes())
+        for chunk, source, file_id in zip(text_chunks, sources, file_ids):
+            data = chunk.encode('utf-8')
+            self._text.write(data)
+            self._offsets.append(self._offsets[-1] + len(data))
+            self._source_codes.append(self._source_vocab.setdefault(source, len(self._source_vocab)))
+            self._file_codes.append(self._file_vocab.setdefault(file_id, len(self._file_vocab)))
+        self.count += len(embeddings)
+
+    def finish(self, files=None, dim=None, extra_meta=None):
+        """Write the remaining columns and meta.json. The snapshot is then complete
+        but unpublished; the returned Snapshot reads it so indexes can be built into it."""
+        for f in self._files():
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+        tmp = self.tmp_path
+        _save_npy(os.path.join(tmp, 'text_offsets.npy'), np.asarray(self._offsets, dtype='int64'))
+        _save_npy(os.path.join(tmp, 'source_codes.npy'), np.asarray(self._source_codes, dtype='int32'))
+        _save_npy(os.path.join(tmp, 'file_codes.npy'), np.asarray(self._file_codes, dtype='int32'))
+        _write_json(os.path.join(tmp, 'sources.json'), list(self._source_vocab))
+        _write_json(os.path.join(tmp, 'file_ids.json'), list(self._file_vocab))
+        _write_json(os.path.join(tmp, 'files.json'), files or {})
+        _write_json(os.path.join(tmp, 'meta.json'), {
+            'format': FORMAT_VERSION,
+            'version': self.version,
+            'created': time.time(),
+            'count': self.count,
+            'dim': self.dim or dim or 0,
+            'dtype': self.storage,
+            'normalized': self.normalize,
+            'metric': self.metric,
+            **(extra_meta or {}),
+        })
+        self.finished = True
+        return Snapshot(tmp)
+
+    def publish(self, files=None, dim=None, extra_meta=None):
+        """Finish writing (unless finish() was called), move the snapshot into place and point CURRENT at it."""
+        if not self.finished:
+            self.finish(files, dim, extra_meta)
+        tmp = self.tmp_path
+        # Publish order, for pruning: version names only sort by creation, to the second
+        meta_path = os.path.join(tmp, 'meta.json')
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+        _write_json(meta_path + '.tmp', {**meta, 'published': time.time()})
+        os.replace(meta_path + '.tmp', meta_path)
+        _fsync_dir(tmp)
+        os.replace(tmp, self.path)
+        _fsync_dir(self.snapshots_dir)
+
+        current_tmp = os.path.join(self.data_dir, CURRENT_FILE + '.tmp')
+        _write_json(current_tmp, {'version': self.version, 'path': os.path.join(SNAPSHOTS_DIR, self.version)})
+        os.replace(current_tmp, os.path.join(self.data_dir, CURRENT_FILE))
+        _fsync_dir(self.data_dir)
+        prune_snapshots(self.data_dir)
+        return self.path
+
+    def _files(self):
+        return [f for f in (self._embeddings, self._scales, self._text) if f is not None]
+
+    def abort(self):
+        for f in self._files():
+            if not f.closed:
+                f.close()
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+class Snapshot:
+    """Read-only, lazily opened view of one snapshot directory."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.version = self.meta['version']
+        self.count = self.meta['count']
+        self.dim = self.meta['dim']
+        self.storage = self.meta.get('dtype', 'float32')
+        # Older snapshots hold float32 as produced, searched by L2 distance
+        self.metric = self.meta.get('metric', 'l2')
+        self._cache = {}
+
+    def __len__(self):
+        return self.count
+
+    def _lazy(self, name, load):
+        if name not in self._cache:
+            self._cache[name] = load()
+        return self._cache[name]
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    @property
+    def embeddings(self):
+        return self._lazy('embeddings', lambda: _open_embeddings(self.path, self.storage, self.count, self.dim))
+
+    @property
+    def text_offsets(self):
+        return self._lazy('text_offsets', lambda: np.load(self._file('text_offsets.npy'), mmap_mode='r'))
+
+    @property
+    def text_blob(self):
+        def load():
+            if os.path.getsize(self._file('text.bin')) == 0:
+                return b''
+            return np.memmap(self._file('text.bin'), dtype='uint8', mode='r')
+        return self._lazy('text_blob', load)
+
+    @property
+    def source_codes(self):
+        return self._lazy('source_codes', lambda: np.load(self._file('source_codes.npy'), mmap_mode='r'))
+
+    @property
+    def file_codes(self):
+        return self._lazy('file_codes', lambda: np.load(self._file('file_codes.npy'), mmap_mode='r'))
+
+    def _json(self, name):
+        def load():
+            with open(self._file(name), encoding='utf-8') as f:
+                return json.load(f)
+        return self._lazy(name, load)
+
+    @property
+    def sources(self):
+        """Distinct source labels; index with source_codes."""
+        return self._json('sources.json')
+
+    @property
+    def file_ids(self):
+        """Distinct file IDs; index with file_codes."""
+        return self._json('file_ids.json')
+
+    @property
+    def files(self):
+        return self._json('files.json')
+
+    def chunk_text(self, row):
+        start, end = self.text_offsets[row], self.text_offsets[row + 1]
+        return bytes(self.text_blob[start:end]).decode('utf-8')
+
+    def iter_chunk_texts(self, rows=None):
+        for row in (range(self.count) if rows is None else rows):
+            yield self.chunk_text(row)
+
+    def source(self, row):
+        return self.sources[self.source_codes[row]]
+
+    def file_id(self, row):
+        return self.file_ids[self.file_codes[row]]
+
+    def close(self):
+        """Forget every mapped file; the mappings are released once no array refers to them."""
+        self._cache.clear()
+
+    def nbytes(self):
+        """On-disk size of the snapshot, roughly what it maps into memory."""
+        return sum(os.path.getsize(os.path.join(self.path, name)) for name in os.listdir(self.path))
+
+def open_current(data_dir=DATA_DIR):
+    current = read_current(data_dir)
+    if current is None:
+        return None
+    return Snapshot(os.path.join(data_dir, current['path']))
+
+def _published(path):
+    try:
+        with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return 0.0
+    # Snapshots from before publish times were recorded fall back to when they were written
+    return meta.get('published', meta.get('created', 0.0))
+
+def prune_snapshots(data_dir=DATA_DIR, keep=KEEP_SNAPSHOTS):
+    """Delete all but the ``keep`` most recently published snapshots (never the current one)."""
+    snapshots_dir = os.path.join(data_dir, SNAPSHOTS_DIR)
+    current = current_version(data_dir)
+    versions = sorted((name for name in os.listdir(snapshots_dir) if not name.startswith('.')),
+                      key=lambda name: (_published(os.path.join(snapshots_dir, name)), name))
+    for name in versions[:-keep] if keep else versions:
+        if name != current:
+            shutil.rmtree(os.path.join(snapshots_dir, name), ignore_errors=True)
+
+LEGACY_FILES = ('embeddings.npy', 'sources.pkl', 'text_chunks.pkl', 'file_ids.pkl')
+
+def has_legacy_data(data_dir=DATA_DIR):
+    return all(os.path.exists(os.path.join(data_dir, name)) for name in LEGACY_FILES)
+
+def migrate_legacy(data_dir=DATA_DIR):
+    """Publish a snapshot from the old embeddings.npy + pickles (+ manifest.json)."""
+    embeddings = np.load(os.path.join(data_dir, 'embeddings.npy'))
+    with open(os.path.join(data_dir, 'text_chunks.pkl'), 'rb') as f:
+        text_chunks = pickle.load(f)
+    with open(os.path.join(data_dir, 'sources.pkl'), 'rb') as f:
+        sources = pickle.load(f)
+    with open(os.path.join(data_dir, 'file_ids.pkl'), 'rb') as f:
+        file_ids = pickle.load(f)
+    try:
+        with open(os.path.join(data_dir, 'manifest.json'), encoding='utf-8') as f:
+            files = json.load(f)
+    except (FileNotFoundError, ValueError):
+        files = {}
+    writer = SnapshotWriter(data_dir)
+    try:
+        writer.append(embeddings, text_chunks, sources, file_ids)
+        return writer.publish(files, dim=embeddings.shape[1], extra_meta={'migrated_from': 'legacy'})
+    except BaseException:
+        writer.abort()
+        raise
+
+def main(argv):
+    command = argv[0] if argv else 'info'
+    if command == 'migrate':
+        path = migrate_legacy()
+        print(f"✅ Migrated legacy data to {path}")
+    elif command == 'info':
+        snapshot = open_current()
+        if snapshot is None:
+            print("No snapshot published yet.")
+            return
+        print(f"📦 {snapshot.path}: {len(snapshot)} chunks x {snapshot.dim} dims {snapshot.storage} "
+              f"({snapshot.metric}), {len(snapshot.file_ids)} files, {snapshot.nbytes() / 2**20:.1f} MB")
+    else:
+        print(__doc__)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
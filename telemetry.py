@@ -0,0 +1,231 @@
+"""Search telemetry: per-stage latencies in a local SQLite file.
+
+Every search records how long each stage took (ACL check, query encode,
+filtering, FAISS search, render). Writes go through a queue to a background
+thread so the search path never waits on disk. The store feeds the dashboard
+(searches, users and success rate today, p50/p95/p99 per stage) and can be
+exported in Prometheus text format:
+
+    python telemetry.py summary
+    python telemetry.py prometheus [--output data/metrics.prom]
+"""
+import hashlib
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import closing, contextmanager
+from datetime import datetime
+
+import numpy as np
+
+TELEMETRY_DB = os.path.join('data', 'telemetry.db')
+STAGES = ('acl', 'encode', 'filter', 'search', 'render', 'total')
+# Histogram bucket upper bounds in seconds, as exported to Prometheus
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PERCENTILE_WINDOW = 50000   # most recent samples per stage used for percentiles
+SUMMARY_TTL = 5             # seconds a dashboard summary is reused across reruns
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS searches (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    user TEXT,
+    results INTEGER NOT NULL,
+    error INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS searches_ts ON searches (ts);
+CREATE TABLE IF NOT EXISTS stage_timings (
+    search_id INTEGER NOT NULL,
+    ts REAL NOT NULL,
+    stage TEXT NOT NULL,
+    seconds REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS stage_timings_stage_ts ON stage_timings (stage, ts);
+"""
+
+def user_key(email):
+    """Users are counted by a short hash, so the store never holds addresses."""
+    if not email:
+        return None
+    return hashlib.sha256(email.strip().lower().encode('utf-8')).hexdigest()[:16]
+
+def start_of_today():
+    return datetime.combine(datetime.now().date(), datetime.min.time()).timestamp()
+
+class SearchTrace:
+    """Timings for one search. Use ``stage(name)`` blocks, then ``finish()``."""
+
+    def __init__(self, telemetry, user=None):
+        self.telemetry = telemetry
+        self.user = user
+        self.timings = {}
+        self._start = time.perf_counter()
+        self.finished = False
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+
+    def finish(self, results=0, error=False):
+        if self.finished:
+            return
+        self.finished = True
+        self.timings['total'] = time.perf_counter() - self._start
+        self.telemetry.record(self.user, self.timings, results, error)
+
+class Telemetry:
+    """Append-only SQLite store of search timings with a background writer."""
+
+    def __init__(self, path=TELEMETRY_DB):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.executescript(SCHEMA)
+        self._summary = (None, 0.0, None)   # (since, computed at, summary)
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._write_loop, name="telemetry-writer", daemon=True)
+        self._thread.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def trace(self, email=None):
+        return SearchTrace(self, user_key(email))
+
+    def record(self, user, timings, results=0, error=False):
+        self._queue.put((time.time(), user, dict(timings), int(results), int(bool(error))))
+
+    def _write_loop(self):
+        conn = self._connect()
+        while True:
+            batch = [self._queue.get()]
+            # Drain whatever else is waiting so bursts become one transaction
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with conn:
+                    for ts, user, timings, results, error in batch:
+                        search_id = conn.execute(
+                            "INSERT INTO searches (ts, user, results, error) VALUES (?, ?, ?, ?)",
+                            (ts, user, results, error)).lastrowid
+                        conn.executemany(
+                            "INSERT INTO stage_timings (search_id, ts, stage, seconds) VALUES (?, ?, ?, ?)",
+                            [(search_id, ts, stage, seconds) for stage, seconds in timings.items()])
+            except sqlite3.Error as e:
+                print(f"⚠️ Could not write telemetry: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def flush(self):
+        """Block until everything recorded so far is on disk."""
+        self._queue.join()
+
+    def summary(self, since=None):
+        """Dashboard numbers for searches since ``since`` (default: midnight today)."""
+        since = start_of_today() if since is None else since
+        cached_since, computed_at, cached = self._summary
+        if cached_since == since and time.monotonic() - computed_at < SUMMARY_TTL:
+            return cached
+        with closing(self._connect()) as conn:
+            searches, users, successes, errors = conn.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT user), COALESCE(SUM(results > 0 AND NOT error), 0), "
+                "COALESCE(SUM(error), 0) FROM searches WHERE ts >= ?", (since,)).fetchone()
+            stages = {}
+            for stage in STAGES:
+                rows = conn.execute(
+                    "SELECT seconds FROM stage_timings WHERE stage = ? AND ts >= ? ORDER BY ts DESC LIMIT ?",
+                    (stage, since, PERCENTILE_WINDOW)).fetchall()
+                if rows:
+                    p50, p95, p99 = np.percentile([r[0] for r in rows], [50, 95, 99])
+                    stages[stage] = {'count': len(rows), 'p50': p50, 'p95': p95, 'p99': p99}
+        summary = {
+            'searches': searches,
+            'users': users,
+            'errors': errors,
+            'success_rate': successes / searches if searches else None,
+            'stages': stages,
+        }
+        self._summary = (since, time.monotonic(), summary)
+        return summary
+
+    def prometheus(self):
+        """All-time counters and latency histograms in Prometheus text exposition format."""
+        bucket_sums = ", ".join(f"SUM(seconds <= {bound})" for bound in LATENCY_BUCKETS)
+        with closing(self._connect()) as conn:
+            outcomes = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(error), 0), COALESCE(SUM(results = 0 AND NOT error), 0) "
+                "FROM searches").fetchone()
+            histograms = conn.execute(
+                f"SELECT stage, COUNT(*), SUM(seconds), {bucket_sums} FROM stage_timings GROUP BY stage").fetchall()
+
+        total, errors, empty = outcomes
+        lines = [
+            "# HELP search_requests_total Searches by outcome.",
+            "# TYPE search_requests_total counter",
+            f'search_requests_total{{outcome="ok"}} {total - errors - empty}',
+            f'search_requests_total{{outcome="no_results"}} {empty}',
+            f'search_requests_total{{outcome="error"}} {errors}',
+            "# HELP search_stage_seconds Search latency by stage.",
+            "# TYPE search_stage_seconds histogram",
+        ]
+        for stage, count, seconds, *buckets in histograms:
+            for bound, cumulative in zip(LATENCY_BUCKETS, buckets):
+                lines.append(f'search_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'search_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {count}')
+            lines.append(f'search_stage_seconds_sum{{stage="{stage}"}} {seconds}')
+            lines.append(f'search_stage_seconds_count{{stage="{stage}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """Write the export atomically, e.g. for node_exporter's textfile collector."""
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(self.prometheus())
+        os.replace(path + '.tmp', path)
+
+_telemetry = None
+_telemetry_lock = threading.Lock()
+
+def get_telemetry(path=TELEMETRY_DB):
+    global _telemetry
+    if _telemetry is None:
+        with _telemetry_lock:
+            if _telemetry is None:
+                _telemetry = Telemetry(path)
+    return _telemetry
+
+def main(argv):
+    command = argv[0] if argv else 'summary'
+    telemetry = Telemetry()
+    if command == 'prometheus':
+        if '--output' in argv:
+            path = argv[argv.index('--output') + 1]
+            telemetry.write_prometheus(path)
+            print(f"✅ Wrote {path}")
+        else:
+            sys.stdout.write(telemetry.prometheus())
+    elif command == 'summary':
+        summary = telemetry.summary()
+        rate = summary['success_rate']
+        print(f"Today: {summary['searches']} searches, {summary['users']} users, "
+              f"success rate {'n/a' if rate is None else f'{rate:.1%}'}")
+        for stage, s in summary['stages'].items():
+            print(f"  {stage:<7} n={s['count']:<6} p50={s['p50'] * 1000:8.1f}ms  "
+                  f"p95={s['p95'] * 1000:8.1f}ms  p99={s['p99'] * 1000:8.1f}ms")
+    else:
+        print(__doc__)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
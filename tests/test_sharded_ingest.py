@@ -0,0 +1,41 @@
+"""An incremental ingest keeps the previous snapshot's shard count when INDEX_SHARDS is unset."""
+import functools
+import json
+import os
+
+import pytest
+
+pytest.importorskip('faiss')
+pytest.importorskip('googleapiclient')
+pytest.importorskip('oauth2client')
+
+import drive_auth_test11
+import sharded_index
+import update_embeddings
+from benchmarks.fake_drive import FakeMediaDownload, generate_corpus
+from benchmarks.synthetic import RandomEncoder
+from snapshot import open_current
+
+def _shards(data_dir='data'):
+    with open(os.path.join(open_current(data_dir).path, sharded_index.SHARDS_FILE)) as f:
+        return json.load(f)
+
+def test_incremental_ingest_keeps_shard_count(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    drive = generate_corpus('drive', 40, mix=('gdoc',))
+    monkeypatch.setattr(update_embeddings, 'authenticate_drive', drive)
+    monkeypatch.setattr(update_embeddings, 'iter_documents',
+                        functools.partial(drive_auth_test11.iter_documents, downloader_cls=FakeMediaDownload))
+    monkeypatch.setattr(update_embeddings, 'load_encoder', lambda name, backend: RandomEncoder())
+    monkeypatch.setattr(update_embeddings, 'load_tokenizer', lambda: None)
+
+    monkeypatch.setattr(sharded_index, 'SHARD_COUNT', 4)
+    update_embeddings.main(incremental=False, encode_workers=1)
+    assert _shards()['config']['shards'] == 4
+
+    monkeypatch.setattr(sharded_index, 'SHARD_COUNT', None)   # INDEX_SHARDS unset
+    drive.files_list[0]['modifiedTime'] = '2024-06-01T00:00:00.000Z'
+    update_embeddings.main(incremental=True, encode_workers=1)
+    shards = _shards()
+    assert shards['config']['shards'] == 4
+    assert len(shards['shards']) == 4
@@ -1,63 +1,35 @@
-from drive_auth_test11 import authenticate_drive, fetch_documents
-from sentence_transformers import SentenceTransformer
-import numpy as np
-import pickle
+from drive_auth_test11 import (GOOGLE_DOC_MIME, SUPPORTED_MIME_TYPES, authenticate_drive, iter_documents,
+                               list_drive_files)
+from acl_index import build_access_index
+from chunking import CHUNKER_VERSION, chunk_text, load_tokenizer
+from embedding_cache import EmbeddingCache
+from encoders import ENCODE_WORKERS, ENCODER_BACKEND, EncoderPool, embedding_space, load_encoder
+from ingest_checkpoint import IngestCheckpoint
+from lexical_index import LexicalIndexBuilder
+from sharded_index import configured_shards, load_or_create_index
+from snapshot import SnapshotWriter, current_version, has_legacy_data, migrate_legacy, open_current
+from vector_storage import EMBEDDING_STORAGE, normalizes
+from contextlib import closing
 import os
-from docx import Document
-from pptx import Presentation
-
-def extract_text_docx(file_path):
-    """Extract all text from a .docx file."""
-    doc = Document(file_path)
-    return "\n".join([para.text for para in doc.paragraphs])
-
-def extract_text_pptx(file_path):
-    """Extract all text from a .pptx file."""
-    prs = Presentation(file_path)
-    texts = []
-    for slide in prs.slides:
-        for shape in slide.shapes:
-            if hasattr(shape, "text") and shape.text:
-                texts.append(shape.text)
-    return "\n".join(texts)
-
-def chunk_text(text, max_tokens=200):
-    """Split text into chunks of max_tokens words."""
-    sentences = text.split('. ')  # Basic sentence split; consider nltk for better splits
-    chunks = []
-    chunk = ""
-    for sentence in sentences:
-        # +1 because sentence will add one period
-        if len((chunk + sentence).split()) > max_tokens:
-            chunks.append(chunk.strip())
-            chunk = sentence + ". "
-        else:
-            chunk += sentence + ". "
-    if chunk:
-        chunks.append(chunk.strip())
-    return chunks
-
-print("🔄 Fetching documents from Google Drive...")
-docs, sources_raw, file_ids_raw, file_paths = fetch_documents(authenticate_drive)
-
-print("✂️ Extracting text, chunking and labeling...")
-
-text_chunks = []
-sources = []
-file_ids = []
-
-for doc, source, file_id, file_path in zip(docs, sources_raw, file_ids_raw, file_paths):
-    ext = os.path.splitext(file_path or "")[1].lower()  # Handle None paths safely
-
-    if ext == ".docx" and file_path and os.path.exists(file_path):
-        text = extract_text_docx(file_path)
-    elif ext == ".pptx" and file_path and os.path.exists(file_path):
-        text = extract_text_pptx(file_path)
-    else:
-        # fallback to raw text extracted from Google Docs or PDFs
-        text = doc
-
-    chunks = chunk_text(text)
+import sys
+import time
+
+MODEL_NAME = 'all-MiniLM-L6-v2'
+# Chunks gathered across files before they are encoded together and appended
+INGEST_BATCH_CHUNKS = int(os.environ.get('INGEST_BATCH_CHUNKS', 2048))
+
+def file_signature(file, folder_name):
+    """What has to stay the same for a file's chunks to be reused."""
+    return {
+        'modifiedTime': file.get('modifiedTime'),
+        'md5Checksum': file.get('md5Checksum'),
+        'source': f"{folder_name} / {file['name']}",
+        'chunker': CHUNKER_VERSION,
+    }
+
+def build_chunks(text, source, tokenizer=None):
+    """Text chunks for one document plus its file and folder name pseudo-chunks."""
+    chunks = chunk_text(text, tokenizer=tokenizer)
 
     # Add file name and folder name as searchable chunks for better matching
     if " / " in source:
@@ -69,26 +41,196 @@ for doc, source, file_id, file_path in zip(docs, sources_raw, file_ids_raw, file
     chunks.append(file_name)
     if folder_name:
         chunks.append(folder_name)
+    return chunks
 
-    text_chunks.extend(chunks)
-    sources.extend([source] * len(chunks))
-    file_ids.extend([file_id] * len(chunks))
-
-print("🔍 Embedding chunks...")
-model = SentenceTransformer('all-MiniLM-L6-v2')
-embeddings = model.encode(text_chunks, show_progress_bar=True).astype('float32')
-
-print("💾 Saving data...")
-os.makedirs('data', exist_ok=True)
-np.save('data/embeddings.npy', embeddings)
-
-with open('data/text_chunks.pkl', 'wb') as f:
-    pickle.dump(text_chunks, f)
-
-with open('data/sources.pkl', 'wb') as f:
-    pickle.dump(sources, f)
-
-with open('data/file_ids.pkl', 'wb') as f:
-    pickle.dump(file_ids, f)
-
-print("✅ Embedding update complete!")
+def load_previous(space=MODEL_NAME, normalize=None):
+    """The published snapshot to reuse rows from, or None if there is nothing to reuse.
+
+    ``normalize`` is whether the new snapshot stores normalised vectors
+    (default: what EMBEDDING_STORAGE and NORMALIZE_EMBEDDINGS give).
+    """
+    if current_version() is None and has_legacy_data():
+        print("ℹ️ Migrating legacy pickles to a snapshot...")
+        migrate_legacy()
+    try:
+        previous = open_current()
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Could not open the current snapshot: {e}")
+        return None
+    if previous is not None and previous.meta.get('embedding_space', MODEL_NAME) != space:
+        # Vectors from an encoder that has not been validated against this one are never mixed
+        print(f"ℹ️ Snapshot embeddings are from {previous.meta.get('embedding_space', MODEL_NAME)}, "
+              f"re-embedding everything with {space}.")
+        return None
+    normalize = normalizes(EMBEDDING_STORAGE) if normalize is None else normalize
+    if previous is not None and previous.meta.get('normalized', previous.metric == 'ip') and not normalize:
+        # Normalised rows cannot be turned back into raw ones, and mixing them with raw
+        # rows in one L2 index skews the ranking; normalised targets re-normalise on append
+        print("ℹ️ Snapshot embeddings are normalised but the new snapshot stores raw float32, "
+              "re-embedding everything.")
+        return None
+    return previous
+
+def save_access_index(service, listing):
+    print("🔒 Building access index...")
+    acl_index = build_access_index(service, listing)
+    acl_index.save('data/acl_index.pkl')
+    print(f"   {len(acl_index.file_ids)} files, {len(acl_index.user_bits)} users, {len(acl_index.group_bits)} groups")
+
+def main(incremental=True, encode_workers=ENCODE_WORKERS):
+    start = time.perf_counter()
+    print("🔄 Listing documents in Google Drive...")
+    service = authenticate_drive()
+    listing, seen = [], set()
+    for file, folder_name in list_drive_files(service):
+        if file['id'] not in seen:  # files with several parents are listed once per folder
+            seen.add(file['id'])
+            listing.append((file, folder_name))
+    signatures = {file['id']: file_signature(file, folder_name) for file, folder_name in listing}
+    mime_types = {file['id']: file['mimeType'] for file, _ in listing}
+
+    space = embedding_space(MODEL_NAME, ENCODER_BACKEND)
+    previous = load_previous(space) if incremental else None
+    if previous is None:
+        manifest = {}
+        if incremental:
+            print("ℹ️ No usable snapshot found, running a full ingest.")
+    else:
+        manifest = previous.files
+
+    unchanged = [
+        file_id for file_id, signature in signatures.items()
+        if file_id in manifest and all(manifest[file_id].get(key) == value for key, value in signature.items())
+    ]
+    unchanged_set = set(unchanged)
+    changed = [(file, folder_name) for file, folder_name in listing if file['id'] not in unchanged_set]
+    deleted = [file_id for file_id in manifest if file_id not in signatures]
+    print(f"   {len(listing)} files: {len(unchanged)} unchanged, {len(changed)} new/changed, {len(deleted)} deleted")
+
+    save_access_index(service, listing)
+
+    if previous is not None and not changed and not deleted:
+        print(f"✅ No document changes, finished in {time.perf_counter() - start:.1f}s")
+        return
+
+    checkpoint = IngestCheckpoint()
+    resumed = checkpoint.resumable({file['id']: signatures[file['id']] for file, _ in changed})
+    if resumed:
+        print(f"♻️ Resuming an interrupted ingest: {len(resumed)} files already chunked and embedded")
+    to_fetch = [(file, folder_name) for file, folder_name in changed if file['id'] not in resumed]
+
+    tokenizer = load_tokenizer()
+    embedding_cache = EmbeddingCache(space)
+    encoder = None
+
+    def load_model():
+        nonlocal encoder
+        if encoder is None:
+            encoder = (EncoderPool(MODEL_NAME, ENCODER_BACKEND, encode_workers) if encode_workers > 1
+                       else load_encoder(MODEL_NAME, ENCODER_BACKEND))
+        return encoder
+
+    dim = previous.dim if previous is not None else 384
+    writer = SnapshotWriter()
+    lexical = LexicalIndexBuilder()
+    new_manifest, batch = {}, []
+    progress = {'files': 0, 'chunks': 0, 'batched': 0}
+
+    def append_batch():
+        """Encode the batched files' chunks together and append them to the snapshot."""
+        vectors = embedding_cache.encode([chunk for _, _, chunks, _ in batch for chunk in chunks], load_model,
+                                         progress=False)
+        position = 0
+        for file_id, source, chunks, record in batch:
+            new_manifest[file_id] = {**signatures[file_id], 'start': writer.count, 'end': writer.count + len(chunks)}
+            writer.append(vectors[position:position + len(chunks)], chunks, [source] * len(chunks),
+                          [file_id] * len(chunks))
+            lexical.add(chunks, [source] * len(chunks))
+            position += len(chunks)
+            if record:
+                checkpoint.record(file_id, signatures[file_id], source, chunks)
+        progress['files'] += len(batch)
+        progress['chunks'] += position
+        progress['batched'] = 0
+        batch.clear()
+        if checkpoint.due():
+            embedding_cache.save()
+            checkpoint.commit()
+            print(f"   {progress['files']}/{len(changed)} files, {progress['chunks']} chunks embedded "
+                  f"({time.perf_counter() - start:.0f}s, checkpoint saved)")
+
+    def add_file(file_id, source, chunks, record=True):
+        batch.append((file_id, source, chunks, record))
+        progress['batched'] += len(chunks)
+        if progress['batched'] >= INGEST_BATCH_CHUNKS:
+            append_batch()
+
+    try:
+        print("💾 Writing snapshot...")
+        # Unchanged files keep their rows; changed and new files are appended after them
+        for file_id in unchanged:
+            begin, end = manifest[file_id]['start'], manifest[file_id]['end']
+            new_manifest[file_id] = {**signatures[file_id], 'start': writer.count, 'end': writer.count + end - begin}
+            rows = range(begin, end)
+            kept_chunks, kept_sources = list(previous.iter_chunk_texts(rows)), [previous.source(row) for row in rows]
+            writer.append(previous.embeddings[begin:end], kept_chunks, kept_sources,
+                          [previous.file_id(row) for row in rows])
+            lexical.add(kept_chunks, kept_sources)
+
+        print(f"🔄 Streaming {len(to_fetch)} changed documents: download → extract → chunk → embed "
+              f"({encode_workers} encoder process{'es' if encode_workers > 1 else ''})...")
+        for file_id, source, chunks in checkpoint.replay(resumed):
+            add_file(file_id, source, chunks, record=False)
+        with closing(iter_documents(authenticate_drive, to_fetch)) as documents:
+            for text, source, file_id, _ in documents:
+                if not text.strip() and mime_types[file_id] == GOOGLE_DOC_MIME:
+                    # Nothing to index, but recorded (with no rows) so it is not fetched again
+                    add_file(file_id, source, [])
+                else:
+                    add_file(file_id, source, build_chunks(text, source, tokenizer))
+        if batch:
+            append_batch()
+        for file, _ in changed:
+            # Unsupported types are recorded with no rows. iter_documents yields nothing for a
+            # failed download or extraction, so only those stay out and the next run retries them
+            if file['id'] not in new_manifest and file['mimeType'] not in SUPPORTED_MIME_TYPES:
+                new_manifest[file['id']] = {**signatures[file['id']], 'start': writer.count, 'end': writer.count}
+        print(f"   {progress['files']} files, {progress['chunks']} new chunks embedded")
+
+        snapshot = writer.finish(new_manifest, dim=dim,
+                                 extra_meta={'embedding_space': space, 'encoder_backend': ENCODER_BACKEND})
+
+        print("🧭 Building FAISS index...")
+        # Read back from the snapshot being written rather than held in memory
+        # The new snapshot has no shards.json yet: keep the previous one's sharding unless INDEX_SHARDS says otherwise
+        index = load_or_create_index(snapshot, previous, shards=configured_shards(previous) if previous else None)
+        if hasattr(index, 'built'):
+            print(f"   {len(index)} shards with {index.ntotal} vectors: {index.built} built, "
+                  f"{index.reused} unchanged and reused")
+        else:
+            print(f"   {type(index).__name__} with {index.ntotal} vectors")
+        del index
+        snapshot.close()
+
+        print("🔤 Building BM25 keyword index...")
+        lexical_meta = lexical.save(writer.tmp_path, data_version=writer.version)
+        print(f"   {lexical_meta['terms']} terms, {lexical_meta['postings']} postings")
+
+        path = writer.publish()
+    except BaseException:
+        writer.abort()
+        raise
+    finally:
+        if isinstance(encoder, EncoderPool):
+            encoder.close()
+        # Kept on failure too, so the next run resumes from here
+        embedding_cache.save()
+        checkpoint.close()
+    checkpoint.clear()
+    print(f"📦 Published snapshot {path}")
+
+    print(f"📈 {embedding_cache.stats_line()}")
+    print(f"✅ Embedding update complete in {time.perf_counter() - start:.1f}s!")
+
+if __name__ == '__main__':
+    main(incremental='--full' not in sys.argv[1:])
@@ -0,0 +1,198 @@
+"""Compact embedding storage: L2-normalised float16 or int8 vectors searched by inner product.
+
+    EMBEDDING_STORAGE=float32   float32 as produced, L2 distance (default; what older snapshots hold)
+    EMBEDDING_STORAGE=float16   normalised, half precision: half the memory
+    EMBEDDING_STORAGE=int8      normalised, int8 with one float32 scale per row: about a quarter
+    NORMALIZE_EMBEDDINGS=1      normalise float32 too, and search it by inner product
+
+Ingestion writes new snapshots in the configured storage. Normalised
+snapshots are searched with inner-product FAISS indexes whose vectors use a
+scalar quantizer of the same width, and results report the cosine distance
+1 - cos, from 0 (same direction) to 2, which is easy to threshold.
+
+    python vector_storage.py migrate --storage int8    # re-publish the current snapshot
+    python vector_storage.py report                    # memory saved vs recall, per storage
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+STORAGES = ('float32', 'float16', 'int8')
+EMBEDDING_STORAGE = os.environ.get('EMBEDDING_STORAGE', 'float32').lower()
+NORMALIZE_EMBEDDINGS = os.environ.get('NORMALIZE_EMBEDDINGS', '0') != '0'
+EMBEDDING_FILES = {'float32': 'embeddings.f32', 'float16': 'embeddings.f16', 'int8': 'embeddings.i8'}
+SCALES_FILE = 'embedding_scales.f32'
+REPORT_PATH = os.path.join('data', 'vector_storage_report.json')
+
+def check_storage(storage):
+    if storage not in STORAGES:
+        raise ValueError(f"EMBEDDING_STORAGE must be one of {STORAGES}, got {storage!r}")
+    return storage
+
+def normalizes(storage, normalize=None):
+    """Whether vectors in ``storage`` are L2-normalised; the compact storages always are."""
+    return storage != 'float32' or (NORMALIZE_EMBEDDINGS if normalize is None else normalize)
+
+def normalize_rows(vectors):
+    vectors = np.asarray(vectors, dtype='float32')
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+def encode_rows(vectors, storage):
+    """``(codes, scales)`` to write for float32 ``vectors``; scales is None except for int8."""
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    if storage == 'float32':
+        return vectors, None
+    if storage == 'float16':
+        return vectors.astype('float16'), None
+    # Symmetric per-row scale: the largest component maps to +-127
+    scales = (np.abs(vectors).max(axis=1) / 127.0 if len(vectors) else np.zeros(0)).astype('float32')
+    codes = np.rint(vectors / np.maximum(scales, 1e-12)[:, None]).astype('int8')
+    return codes, scales
+
+class StoredEmbeddings:
+    """float16/int8 rows on disk that read back as float32, like the float32 memmap does."""
+
+    dtype = np.dtype('float32')
+
+    def __init__(self, codes, scales=None):
+        self.codes = codes
+        self.scales = scales
+        self.shape = codes.shape
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def __getitem__(self, rows):
+        vectors = np.asarray(self.codes[rows], dtype='float32')
+        if self.scales is not None:
+            scales = np.asarray(self.scales[rows], dtype='float32')
+            vectors *= scales[..., None] if vectors.ndim > 1 else scales
+        return vectors
+
+    def __array__(self, dtype=None, copy=None):
+        vectors = self[:]
+        return vectors if dtype is None else vectors.astype(dtype, copy=False)
+
+def migrate(storage, normalize=None, data_dir='data', batch=50000):
+    """Re-publish the current snapshot with ``storage``; texts, manifest and BM25 index are carried over."""
+    from sharded_index import configured_shards, load_or_create_index
+    from snapshot import SnapshotWriter, open_current
+
+    snapshot = open_current(data_dir)
+    if snapshot is None:
+        raise RuntimeError("no snapshot to migrate; run update_embeddings.py first")
+    writer = SnapshotWriter(data_dir, storage=storage, normalize=normalize)
+    try:
+        for start in range(0, len(snapshot), batch):
+            rows = range(start, min(start + batch, len(snapshot)))
+            writer.append(snapshot.embeddings[start:rows.stop], list(snapshot.iter_chunk_texts(rows)),
+                          [snapshot.source(row) for row in rows], [snapshot.file_id(row) for row in rows])
+        # Same rows and text, so the keyword index is unchanged
+        for name in os.listdir(snapshot.path):
+            if name.startswith('bm25'):
+                shutil.copy2(os.path.join(snapshot.path, name), os.path.join(writer.tmp_path, name))
+        kept = {key: value for key, value in snapshot.meta.items()
+                if key not in ('format', 'version', 'created', 'count', 'dim', 'dtype', 'normalized', 'metric')}
+        migrated = writer.finish(snapshot.files, dim=snapshot.dim, extra_meta={**kept, 'migrated_from': snapshot.version})
+        if len(migrated):
+            load_or_create_index(migrated, shards=configured_shards(snapshot))
+        migrated.close()
+        return writer.publish()
+    except BaseException:
+        writer.abort()
+        raise
+
+def _recall(found, truth):
+    return float(np.mean([len(set(f[f >= 0]) & set(t)) / len(t) for f, t in zip(found, truth)]))
+
+def report(kind='flat', queries=200, k=10, data_dir='data', synthetic=None, seed=0):
+    """Memory and recall@k of every storage against exact float32 L2 search on the same vectors."""
+    import faiss
+    from faiss_utils import create_faiss_index
+
+    if synthetic:
+        from benchmarks.synthetic import synthetic_embeddings
+        vectors, source = synthetic_embeddings(synthetic, seed=seed), f"synthetic {synthetic}"
+    else:
+        from snapshot import open_current
+        snapshot = open_current(data_dir)
+        if snapshot is None or not len(snapshot):
+            raise RuntimeError("no snapshot to report on; run update_embeddings.py first or pass --synthetic")
+        vectors, source = np.asarray(snapshot.embeddings[:], dtype='float32'), f"snapshot {snapshot.version}"
+    n, dim = vectors.shape
+    rng = np.random.default_rng(seed)
+    # Sampled chunk vectors moved a little, so a row is not trivially its own nearest neighbour
+    sample = vectors[rng.choice(n, size=min(queries, n), replace=False)]
+    noise = rng.normal(size=sample.shape).astype('float32')
+    probes = sample + 0.3 * noise * np.linalg.norm(sample, axis=1, keepdims=True) / np.sqrt(dim)
+    k = min(k, n)
+    truth = create_faiss_index(vectors, 'flat').search(probes, k)[1]
+
+    rows = []
+    for storage, normalize in (('float32', False), ('float32', True), ('float16', True), ('int8', True)):
+        stored = normalize_rows(vectors) if normalize else vectors
+        codes, scales = encode_rows(stored, storage)
+        start = time.perf_counter()
+        index = create_faiss_index(stored, kind, metric='ip' if normalize else 'l2', storage=storage)
+        build_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        found = index.search(normalize_rows(probes) if normalize else probes, k)[1]
+        search_ms = (time.perf_counter() - start) * 1000 / len(probes)
+        rows.append({
+            'storage': storage,
+            'metric': 'ip' if normalize else 'l2',
+            'kind': kind,
+            'embeddings_mb': round((codes.nbytes + (scales.nbytes if scales is not None else 0)) / 2**20, 2),
+            'index_mb': round(faiss.serialize_index(index).nbytes / 2**20, 2),
+            f'recall@{k}': round(_recall(found, truth), 4),
+            'build_seconds': round(build_seconds, 3),
+            'ms_per_query': round(search_ms, 3),
+        })
+    baseline = rows[0]['embeddings_mb'] + rows[0]['index_mb']
+    for row in rows:
+        row['saved_pct'] = round(100 * (1 - (row['embeddings_mb'] + row['index_mb']) / baseline), 1) if baseline else 0.0
+    return {'source': source, 'chunks': n, 'dim': dim, 'queries': len(probes), 'k': k, 'rows': rows,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    migrate_cmd = commands.add_parser('migrate', help="re-publish the current snapshot in another storage")
+    migrate_cmd.add_argument('--storage', choices=STORAGES, default=EMBEDDING_STORAGE)
+    migrate_cmd.add_argument('--normalize', action='store_true', help="normalise float32 storage as well")
+    report_cmd = commands.add_parser('report', help="memory saved vs recall for each storage")
+    report_cmd.add_argument('--kind', default='flat', help="FAISS index kind to compare (flat, hnsw, ivf_flat, ...)")
+    report_cmd.add_argument('--queries', type=int, default=200)
+    report_cmd.add_argument('--k', type=int, default=10)
+    report_cmd.add_argument('--synthetic', type=int, help="use this many synthetic vectors instead of the snapshot")
+    report_cmd.add_argument('--output', default=REPORT_PATH)
+    args = parser.parse_args()
+
+    if args.command == 'migrate':
+        path = migrate(args.storage, True if args.normalize else None)
+        print(f"✅ Migrated the current snapshot to {args.storage} storage: {path}")
+        return
+    result = report(args.kind, args.queries, args.k, synthetic=args.synthetic)
+    print(f"📐 {result['source']}: {result['chunks']} x {result['dim']}, recall@{result['k']} "
+          f"against exact float32 L2 over {result['queries']} queries")
+    recall = f"recall@{result['k']}"
+    for row in result['rows']:
+        print(f"   {row['storage']:<8} {row['metric']:<3} embeddings {row['embeddings_mb']:>9.2f} MB  "
+              f"index {row['index_mb']:>9.2f} MB  saved {row['saved_pct']:>5.1f}%  "
+              f"recall {row[recall]:.4f}  {row['ms_per_query']:.3f} ms/query")
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f"✅ Report written to {args.output}")
+
+if __name__ == '__main__':
+    main()